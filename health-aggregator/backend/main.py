@@ -4,18 +4,28 @@ Palo Alto Networks Hackathon 2025
 
 A security-minded approach to health data aggregation and anomaly detection.
 """
-from pathlib import Path
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
-from datetime import datetime
+import io
+import threading
 
-from services.data_ingestion import DataIngestionService
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from typing import Optional, Union, List, Dict, Any, Callable, Tuple
+from datetime import datetime, date, timedelta
+
+from services.record_store import RecordStore, RecordAppendError, APPENDED, RELOADED, UNCHANGED
+from services.csv_import import CsvImportError
+from services.source_merge import SourceMergeError
+from services.record_validation import RecordValidationError
+from services.job_queue import JobQueue, JobNotFoundError
+from services.intraday_store import IntradayStore, IntradayError, parse_timestamps
+from services.data_ingestion import DataIngestionService, HistoryQueryError
 from services.anomaly_detection import AnomalyDetectionService
 from services.correlation_engine import CorrelationEngine
 from services.llm_insights import LLMInsightGenerator
 from models.health_data import (
     AnomalyAlert,
+    MultivariateAnomalyAlert,
     CorrelationInsight,
     DashboardSummary,
     HealthScoreResponse
@@ -24,15 +34,15 @@ from models.health_data import (
 # Optional ML counterfactual engine (pandas, sklearn required)
 try:
     from services.counterfactual_engine import (
-        load_records,
-        build_training_frame,
+        build_training_frame_from_columns,
+        append_training_rows,
         simulate_counterfactual,
         SimulationError,
     )
     _ml_available = True
 except ImportError:
     _ml_available = False
-    load_records = build_training_frame = simulate_counterfactual = None
+    build_training_frame_from_columns = append_training_rows = simulate_counterfactual = None
     SimulationError = Exception  # noqa: A001
 
 app = FastAPI(
@@ -50,20 +60,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load data for ML counterfactual engine (if available)
-_ml_df = None
-if _ml_available:
+# Single shared record store: the data file is parsed once and every
+# service (and the ML frame) reads the same snapshot.
+record_store = RecordStore()
+
+llm_generator = LLMInsightGenerator()
+intraday_store = IntradayStore()
+
+
+def _build_ml_frame(columns):
+    """Build the ML counterfactual training frame from store columns (if available)."""
+    if not _ml_available:
+        return None
     try:
-        _data_path = Path(__file__).parent / "data" / "synthetic_health_data.json"
-        _records = load_records(str(_data_path))
-        _ml_df = build_training_frame(_records)
+        return build_training_frame_from_columns(columns)
     except Exception:
-        _ml_df = None
+        return None
+
+
+def _append_ml_frame(frame, columns, start_row: int):
+    """Extend the ML training frame with store rows appended from start_row."""
+    if not _ml_available:
+        return None
+    try:
+        return append_training_rows(frame, columns, start_row)
+    except Exception:
+        return frame
+
+
+class AppState:
+    """
+    Everything the read endpoints serve for one data version: the store
+    snapshot, the services derived from it and the ML frame. A published
+    state is never modified; updates build a new one and swap it in, so a
+    request that reads `_state` once sees one consistent version throughout.
+    """
+
+    __slots__ = ("snapshot", "data_service", "anomaly_service", "correlation_engine", "ml_frame")
+
+    def __init__(self, snapshot, data_service, anomaly_service, correlation_engine, ml_frame):
+        self.snapshot = snapshot
+        self.data_service = data_service
+        self.anomaly_service = anomaly_service
+        self.correlation_engine = correlation_engine
+        self.ml_frame = ml_frame
 
-data_service = DataIngestionService()
-anomaly_service = AnomalyDetectionService()
-correlation_engine = CorrelationEngine()
-llm_generator = LLMInsightGenerator()
+
+_state = AppState(
+    record_store.snapshot,
+    DataIngestionService(store=record_store),
+    AnomalyDetectionService(store=record_store),
+    CorrelationEngine(store=record_store),
+    _build_ml_frame(record_store.columns),
+)
+# Serializes writers; readers never wait on it
+_update_lock = threading.Lock()
+
+
+def _update(apply: Callable[[DataIngestionService], Tuple[Any, str, int]]) -> Tuple[Any, AppState]:
+    """
+    Apply a store change and publish the state derived from it.
+
+    Meant to run in a worker thread. `apply` writes through a fork of the
+    data service and returns (result, change, rows added), change being
+    UNCHANGED, APPENDED or RELOADED. Baselines, anomalies, correlations and
+    the ML frame are then updated on forks as well, and the new state is
+    published with one assignment; readers keep the previous state until then.
+    """
+    global _state
+    with _update_lock:
+        current = _state
+        data_service = current.data_service.fork()
+        result, change, added = apply(data_service)
+        if change == UNCHANGED or (change == APPENDED and not added):
+            return result, current
+        snapshot = data_service.snapshot
+        anomaly_service = current.anomaly_service.fork()
+        correlation_engine = current.correlation_engine.fork()
+        if change == APPENDED:
+            anomaly_service.apply_append(added)
+            correlation_engine.apply_append(added)
+            ml_frame = _append_ml_frame(current.ml_frame, snapshot.columns, len(current.snapshot))
+        else:
+            anomaly_service.recalculate_anomalies()
+            correlation_engine.recalculate_correlations()
+            ml_frame = _build_ml_frame(snapshot.columns)
+        _state = AppState(snapshot, data_service, anomaly_service, correlation_engine, ml_frame)
+        return result, _state
 
 
 @app.get("/")
@@ -80,11 +163,12 @@ async def root():
 @app.get("/api/dashboard/summary")
 async def get_dashboard_summary():
     """Get complete dashboard summary"""
+    state = _state
     try:
-        metrics = data_service.get_latest_metrics()
-        anomalies = anomaly_service.get_recent_anomalies(limit=5)
-        correlations = correlation_engine.get_top_correlations(limit=3)
-        health_score = anomaly_service.calculate_health_score()
+        metrics = state.data_service.get_latest_metrics()
+        anomalies = state.anomaly_service.get_recent_anomalies(limit=5)
+        correlations = state.correlation_engine.get_top_correlations(limit=3)
+        health_score = state.anomaly_service.calculate_health_score()
         
         return {
             "current_metrics": metrics,
@@ -98,11 +182,151 @@ async def get_dashboard_summary():
 
 
 @app.get("/api/metrics/history")
-async def get_metrics_history(days: int = 30, metric_type: Optional[str] = None):
-    """Get historical health metrics"""
+def get_metrics_history(
+    days: int = 30,
+    metric_type: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Get historical health metrics.
+    Without start/end/cursor/limit, returns the last `days` records. Otherwise
+    returns the records dated start..end, oldest first, `limit` per page;
+    pass `next_cursor` back as `cursor` to fetch the next page.
+    `fields` (e.g. "sleep.duration_hours,heart_rate.hrv", or a group such as
+    "sleep") limits each record to those columns.
+    """
+    projection = fields.split(",") if fields else None
+    data_service = _state.data_service
+    try:
+        if start is None and end is None and cursor is None and limit is None:
+            history = data_service.get_metrics_history(days=days, metric_type=metric_type, fields=projection)
+            return {"data": history, "days": days, "metric_type": metric_type}
+        page = data_service.get_metrics_range(
+            start=start, end=end, metric_type=metric_type, cursor=cursor, limit=limit, fields=projection
+        )
+        return {
+            "data": page["data"],
+            "metric_type": metric_type,
+            "start": start,
+            "end": end,
+            "limit": limit,
+            "next_cursor": page["next_cursor"],
+        }
+    except HistoryQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/metrics/aggregate")
+async def get_metric_aggregate(
+    metric: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    bucket: str = "all",
+    agg: str = "mean",
+):
+    """
+    Aggregate one metric (e.g. "steps" or "activity.steps") over start..end,
+    per `bucket` (day, week, month, year or all) with `agg` (sum, mean, min,
+    max or count). Served from precomputed range structures, not the records.
+    """
+    try:
+        return _state.data_service.get_aggregate(metric, start=start, end=end, bucket=bucket, agg=agg)
+    except HistoryQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/metrics/percentiles")
+def get_metric_percentiles(
+    metric: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    bucket: str = "all",
+    q: str = "10,50,90",
+    cohort: bool = False,
+):
+    """
+    Percentiles `q` (e.g. "10,50,90") of one metric over start..end, per
+    `bucket` (day, week, month, year or all), from mergeable monthly
+    quantile digests. `cohort` merges every user of a SQLite store.
+    """
+    try:
+        percentiles = [float(p) for p in q.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid percentiles {q!r}")
+    try:
+        return _state.data_service.get_percentiles(
+            metric, start=start, end=end, bucket=bucket, percentiles=percentiles, cohort=cohort
+        )
+    except HistoryQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/trends")
+async def get_trends(window: str = "7", fields: Optional[str] = None):
+    """
+    Mean of every metric over the last `window` days against the `window`
+    days before (window="month": this calendar month against the last), with
+    the change in percent. `fields` limits the metrics as for history.
+    """
+    projection = fields.split(",") if fields else None
+    try:
+        return _state.data_service.get_trends(window=window, fields=projection)
+    except HistoryQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/metrics/intraday")
+def get_intraday_metrics(
+    metric: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    resolution: Optional[int] = None,
+):
+    """
+    Get minute-level samples for a metric between start and end (inclusive).
+    `resolution` is the widest acceptable bucket in seconds; the coarsest
+    precomputed rollup (5 min, 1 h, 1 day) within it is served, or raw
+    samples below 5 minutes. Without it, the finest rollup giving at most
+    1000 points is served. Defaults to the last 7 days with data.
+    """
+    try:
+        first, last = intraday_store.day_range(metric)
+        end = end or last or date.today()
+        start = start or max(end - timedelta(days=6), first or end)
+        if start > end:
+            raise IntradayError("start must not be after end")
+        return intraday_store.query(metric, start, end, resolution)
+    except IntradayError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/metrics/intraday")
+def add_intraday_samples(payload: Dict[str, Any] = Body(...)):
+    """
+    Store intraday samples: {"metric": "heart_rate", "timestamps": [...], "values": [...]}.
+    Timestamps are ISO local times or epoch seconds.
+    """
     try:
-        history = data_service.get_metrics_history(days=days, metric_type=metric_type)
-        return {"data": history, "days": days, "metric_type": metric_type}
+        timestamps = parse_timestamps(payload.get("timestamps") or [])
+        values = [float("nan") if v is None else v for v in payload.get("values") or []]
+        accepted = intraday_store.add_samples(payload.get("metric", ""), timestamps, values)
+        return {"status": "success", "accepted": accepted}
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -111,7 +335,31 @@ async def get_metrics_history(days: int = 30, metric_type: Optional[str] = None)
 async def get_anomalies(severity: Optional[str] = None, limit: int = 20):
     """Get detected anomalies with optional severity filter"""
     try:
-        return anomaly_service.get_anomalies(severity=severity, limit=limit)
+        return _state.anomaly_service.get_anomalies(severity=severity, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/anomalies/drift", response_model=list[AnomalyAlert])
+async def get_drift_alerts(metric: Optional[str] = None, limit: int = 20):
+    """
+    Slow drifts found by EWMA control charts and two-sided CUSUM over the
+    whole history (e.g. resting_hr creeping up), newest first.
+    """
+    try:
+        return _state.anomaly_service.get_drift_alerts(metric=metric, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/anomalies/multivariate", response_model=list[MultivariateAnomalyAlert])
+async def get_multivariate_anomalies(severity: Optional[str] = None, limit: int = 20):
+    """
+    Days whose metrics are off together, scored by Mahalanobis distance
+    against the baseline covariance, with each metric's contribution.
+    """
+    try:
+        return _state.anomaly_service.get_multivariate_anomalies(severity=severity, limit=limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -120,7 +368,7 @@ async def get_anomalies(severity: Optional[str] = None, limit: int = 20):
 async def get_anomaly_timeline(days: int = 14):
     """Get anomaly timeline for pattern visualization"""
     try:
-        timeline = anomaly_service.get_anomaly_timeline(days=days)
+        timeline = _state.anomaly_service.get_anomaly_timeline(days=days)
         return {"timeline": timeline, "days": days}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -130,7 +378,7 @@ async def get_anomaly_timeline(days: int = 14):
 async def get_correlations(limit: int = 10):
     """Get discovered correlations between health metrics"""
     try:
-        return correlation_engine.get_correlations(limit=limit)
+        return _state.correlation_engine.get_correlations(limit=limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -138,10 +386,11 @@ async def get_correlations(limit: int = 10):
 @app.get("/api/insights/ai")
 async def get_ai_insights():
     """Get AI-generated natural language insights"""
+    state = _state
     try:
-        anomalies = anomaly_service.get_recent_anomalies(limit=5)
-        correlations = correlation_engine.get_top_correlations(limit=5)
-        trends = data_service.get_trend_summary()
+        anomalies = state.anomaly_service.get_recent_anomalies(limit=5)
+        correlations = state.correlation_engine.get_top_correlations(limit=5)
+        trends = state.data_service.get_trend_summary()
         
         insights = llm_generator.generate_insights(
             anomalies=anomalies,
@@ -157,7 +406,7 @@ async def get_ai_insights():
 async def get_health_score():
     """Get detailed health score breakdown"""
     try:
-        return anomaly_service.calculate_health_score_detailed()
+        return _state.anomaly_service.calculate_health_score_detailed()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -166,35 +415,176 @@ async def get_health_score():
 async def get_baselines():
     """Get established personal baselines"""
     try:
-        return {"baselines": anomaly_service.get_baselines()}
+        return {"baselines": _state.anomaly_service.get_baselines()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _run_refresh(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Refresh job body: runs on the refresh queue's thread."""
+    def apply(data_service: DataIngestionService):
+        result = data_service.refresh_data(force=params.get("force", False))
+        return result, result.change, result.added
+    
+    result, _ = _update(apply)
+    return {**result.to_dict(), "refreshed_at": datetime.now().isoformat()}
+
+
+# Refreshes requested while one is waiting join it, so a burst of requests
+# costs at most one run after the current one
+refresh_jobs = JobQueue(_run_refresh, kind="refresh")
+
+
+@app.post("/api/data/refresh", status_code=202)
+async def refresh_data(force: bool = False):
+    """
+    Queue a refresh and return its job id; poll `GET /api/jobs/{job_id}`.
+    Unchanged files are not re-read; rows added at the end are applied
+    incrementally. `force` re-reads and recalculates everything. The new
+    state is published atomically when the job completes.
+    """
+    job = refresh_jobs.submit(force=force)
+    return {"status": job["status"], "job_id": job["job_id"], "job": job}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, timings and result of a background job"""
+    try:
+        return refresh_jobs.get(job_id)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/api/data/status")
+async def get_data_status():
+    """Get the loaded data version, date range and import progress"""
+    snapshot = _state.snapshot
+    records = len(snapshot)
+    progress = record_store.load_progress
+    return {
+        "data_version": snapshot.version,
+        "total_records": records,
+        "start_date": snapshot.get_records(0, 1)[0]["date"] if records else None,
+        "end_date": snapshot.last_date().isoformat() if records else None,
+        "import_progress": progress.to_dict() if progress else None,
+        "refresh_job": refresh_jobs.active,
+    }
+
+
+@app.post("/api/data/records")
+async def append_records(payload: Union[List[Dict[str, Any]], Dict[str, Any]] = Body(...)):
+    """
+    Append one daily record or a batch and update derived state incrementally.
+    Accepts a single record, a list of records, or {"records": [...]}.
+    Records must be in date order and newer than the latest stored day;
+    records failing validation are quarantined and the rest appended.
+    """
+    if isinstance(payload, dict):
+        records = payload["records"] if "records" in payload else [payload]
+    else:
+        records = payload
+    
+    def apply(data_service: DataIngestionService):
+        validation = data_service.append_records(records)
+        return validation, APPENDED, validation["accepted"]
+    
+    try:
+        validation, state = await run_in_threadpool(_update, apply)
+        return {
+            "status": "success",
+            "appended": validation["accepted"],
+            "rejected": validation["rejected"],
+            "validation": validation,
+            "total_records": len(state.snapshot),
+            "data_version": state.snapshot.version,
+        }
+    except (RecordAppendError, RecordValidationError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/data/quarantine")
+def get_quarantine(limit: int = 50):
+    """Recently rejected records with the reasons they failed validation"""
+    try:
+        return _state.data_service.get_quarantine(limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/data/refresh")
-async def refresh_data():
-    """Refresh data and recalculate anomalies"""
+@app.post("/api/data/sync")
+async def sync_sources(payload: Union[List[Dict[str, Any]], Dict[str, Any]] = Body(...)):
+    """
+    Merge daily records from several devices or apps.
+    Accepts a list of records or {"source": ..., "records": [...]}; each
+    record may name its own "source". Records can be in any order and
+    repeat days; conflicting values are resolved by per-field source priority.
+    """
+    if isinstance(payload, dict):
+        records, source = payload.get("records"), payload.get("source")
+    else:
+        records, source = payload, None
+    
+    def apply(data_service: DataIngestionService):
+        return data_service.sync_sources(records, source), RELOADED, 0
+    
     try:
-        data_service.refresh_data()
-        anomaly_service.recalculate_anomalies()
-        correlation_engine.recalculate_correlations()
-        return {"status": "success", "refreshed_at": datetime.now().isoformat()}
+        summary, state = await run_in_threadpool(_update, apply)
+        return {
+            "status": "success",
+            **summary,
+            "total_records": len(state.snapshot),
+            "data_version": state.snapshot.version,
+        }
+    except (SourceMergeError, RecordValidationError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.post("/api/data/import/csv")
+async def import_csv(request: Request, source: Optional[str] = None):
+    """
+    Bulk-import a wearable CSV export (Fitbit, Google Fit, per-sample CSVs)
+    sent as the raw request body. Rows are aggregated per day and merged
+    into the store; imported values win on days that already exist, unless
+    a `source` is named, in which case per-field source priority applies.
+    """
+    body = await request.body()
+    
+    def apply(data_service: DataIngestionService):
+        return data_service.import_csv([io.BytesIO(body)], source_name=source), RELOADED, 0
+    
+    try:
+        summary, state = await run_in_threadpool(_update, apply)
+        return {
+            "status": "success",
+            **summary,
+            "total_records": len(state.snapshot),
+            "data_version": state.snapshot.version,
+        }
+    except CsvImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 def _run_simulate(
+    ml_frame,
     sleep_hours_delta: float = 0,
     steps_delta: float = 0,
     calories_in_delta: float = 0,
     day_index: int = -1,
 ):
     """Shared logic for GET/POST simulate."""
-    if _ml_df is None or len(_ml_df) == 0:
+    if ml_frame is None or len(ml_frame) == 0:
         raise HTTPException(
             status_code=503,
             detail="ML counterfactual engine not available (install pandas, numpy, scikit-learn and ensure data is loaded)."
         )
-    n = len(_ml_df)
+    n = len(ml_frame)
     actual_index = day_index if day_index >= 0 else n + day_index
     if actual_index < 0 or actual_index >= n:
         raise HTTPException(
@@ -208,12 +598,12 @@ def _run_simulate(
         deltas["steps_delta"] = steps_delta
     if calories_in_delta != 0:
         deltas["calories_in_delta"] = calories_in_delta
-    return simulate_counterfactual(_ml_df, actual_index, deltas)
+    return simulate_counterfactual(ml_frame, actual_index, deltas)
 
 
 @app.get("/api/ml/simulate")
 @app.post("/api/ml/simulate")
-async def simulate_what_if(
+def simulate_what_if(
     sleep_hours_delta: float = 0,
     steps_delta: float = 0,
     calories_in_delta: float = 0,
@@ -230,6 +620,7 @@ async def simulate_what_if(
     """
     try:
         return _run_simulate(
+            _state.ml_frame,
             sleep_hours_delta=sleep_hours_delta,
             steps_delta=steps_delta,
             calories_in_delta=calories_in_delta,
@@ -244,19 +635,20 @@ async def simulate_what_if(
 
 
 @app.get("/api/ml/model-info")
-async def get_model_info():
+def get_model_info():
     """Get ML model information and sample predictions."""
-    if _ml_df is None:
+    ml_frame = _state.ml_frame
+    if ml_frame is None:
         raise HTTPException(
             status_code=503,
             detail="ML counterfactual engine not available (install pandas, numpy, scikit-learn and ensure data is loaded)."
         )
     try:
-        result = simulate_counterfactual(_ml_df, len(_ml_df) - 1, {})
+        result = simulate_counterfactual(ml_frame, len(ml_frame) - 1, {})
         return {
             "model_info": result["model_info"],
             "latest_day": result["baseline"],
-            "available_days": len(_ml_df)
+            "available_days": len(ml_frame)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
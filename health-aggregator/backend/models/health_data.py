@@ -4,7 +4,7 @@ Pydantic models for type safety and API documentation.
 """
 
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime, date
 from enum import Enum
 
@@ -58,6 +58,13 @@ class AnomalyAlert(BaseModel):
     recommended_action: Optional[str] = None
 
 
+class MultivariateAnomalyAlert(AnomalyAlert):
+    """Anomaly across several metrics at once, scored by Mahalanobis distance."""
+    # Percent of the squared distance per metric, largest first; negative
+    # where a metric's deviation offsets the others through their correlation
+    contributions: Dict[str, float] = Field(default_factory=dict)
+
+
 class CorrelationInsight(BaseModel):
     """Discovered correlation between two health metrics."""
     id: str
@@ -1,3 +1,42 @@
+from .metric_store import MetricColumns
+from .columnar_format import (
+    write_columnar,
+    ColumnarWriter,
+    open_columnar,
+    convert_json_to_columnar,
+    ColumnarFormatError,
+)
+from .streaming_import import (
+    stream_import,
+    stream_convert_to_columnar,
+    iter_json_records,
+    ImportProgress,
+    StreamingImportError,
+)
+from .apple_health_import import (
+    import_apple_health,
+    parse_apple_health_export,
+    AppleHealthImportError,
+)
+from .csv_import import import_csv, CsvImportError
+from .record_validation import validate_records, validate_columns, Quarantine, RecordValidationError
+from .source_merge import SourceMerger, SourcePriority, merge_sources, SourceMergeError
+from .quantile_sketch import QuantileSketch, MonthlySketches
+from .rollups import MetricRollups, compare_windows, aggregate_buckets, percentile_buckets, RollupError
+from .intraday_store import IntradayStore, IntradayError
+from .job_queue import JobQueue, JobNotFoundError
+from .anomaly_engine import Detection, RollingBaseline, robust_baselines, scan as scan_anomalies, AnomalyEngineError
+from .change_detectors import ChangeDetectors, ChangeSignals
+from .multivariate_scoring import CovarianceBaseline, MultivariateDetection, scan_multivariate
+from .arrow_io import (
+    export_columns,
+    export_batches,
+    import_columns,
+    export_training_frame,
+    ArrowIOError,
+)
+from .sqlite_store import SqliteRecordStore, SqliteStoreError
+from .record_store import RecordStore, StoreSnapshot, RecordAppendError
 from .data_ingestion import DataIngestionService
 from .anomaly_detection import AnomalyDetectionService
 from .correlation_engine import CorrelationEngine
@@ -7,6 +46,8 @@ try:
     from .counterfactual_engine import (
         load_records,
         build_training_frame,
+        build_training_frame_from_columns,
+        append_training_rows,
         simulate_counterfactual,
         CounterfactualEngineError,
         LoadRecordsError,
@@ -15,17 +56,74 @@ try:
     )
     _counterfactual_available = True
 except ImportError:
-    load_records = build_training_frame = simulate_counterfactual = None
+    load_records = build_training_frame = build_training_frame_from_columns = append_training_rows = simulate_counterfactual = None
     CounterfactualEngineError = LoadRecordsError = TrainingFrameError = SimulationError = None  # type: ignore
     _counterfactual_available = False
 
 __all__ = [
+    "MetricColumns",
+    "write_columnar",
+    "ColumnarWriter",
+    "open_columnar",
+    "convert_json_to_columnar",
+    "ColumnarFormatError",
+    "stream_import",
+    "stream_convert_to_columnar",
+    "iter_json_records",
+    "ImportProgress",
+    "StreamingImportError",
+    "import_apple_health",
+    "parse_apple_health_export",
+    "AppleHealthImportError",
+    "import_csv",
+    "CsvImportError",
+    "validate_records",
+    "validate_columns",
+    "Quarantine",
+    "RecordValidationError",
+    "SourceMerger",
+    "SourcePriority",
+    "merge_sources",
+    "SourceMergeError",
+    "QuantileSketch",
+    "MonthlySketches",
+    "MetricRollups",
+    "compare_windows",
+    "aggregate_buckets",
+    "percentile_buckets",
+    "RollupError",
+    "IntradayStore",
+    "IntradayError",
+    "JobQueue",
+    "JobNotFoundError",
+    "Detection",
+    "RollingBaseline",
+    "robust_baselines",
+    "scan_anomalies",
+    "AnomalyEngineError",
+    "ChangeDetectors",
+    "ChangeSignals",
+    "CovarianceBaseline",
+    "MultivariateDetection",
+    "scan_multivariate",
+    "export_columns",
+    "export_batches",
+    "import_columns",
+    "export_training_frame",
+    "ArrowIOError",
+    "SqliteRecordStore",
+    "SqliteStoreError",
+    "RecordStore",
+    "StoreSnapshot",
+    "RecordAppendError",
     "DataIngestionService",
     "AnomalyDetectionService",
     "CorrelationEngine",
     "LLMInsightGenerator",
     "load_records",
     "build_training_frame",
+    "build_training_frame_from_columns",
+    "append_training_rows",
     "simulate_counterfactual",
     "CounterfactualEngineError",
     "LoadRecordsError",
@@ -1,21 +1,34 @@
 """
 Anomaly Detection Service
 Security-style anomaly detection for health metrics using Z-score analysis.
+
+Detection runs on the column store through services.anomaly_engine: all
+days x metrics are scored at once and AnomalyAlert objects are only built
+for the alerts a caller actually asks for.
 """
 
-import json
-import os
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
-from pathlib import Path
-import statistics
+from typing import Optional, List, Dict, Any, Tuple
 from collections import defaultdict
+import copy
+import os
+import threading
 import uuid
 
+import numpy as np
+
 from models.health_data import (
-    AnomalyAlert, SeverityLevel, MetricType,
+    AnomalyAlert, MultivariateAnomalyAlert, SeverityLevel, MetricType,
     Baseline, HealthScoreComponent, HealthScoreResponse
 )
+from services.metric_store import MetricColumns, ordinals_to_strings, EPOCH_ORDINAL
+from services.record_store import RecordStore, StoreSnapshot, get_default_store
+from services.anomaly_engine import (
+    Detection, RollingBaseline, AnomalyEngineError, BASELINE_METHODS, MAD_SCALE,
+    robust_baselines, scan,
+)
+from services.change_detectors import ChangeDetectors, ChangeSignals, EWMA_HIGH, EWMA_LOW, CUSUM_HIGH
+from services.multivariate_scoring import CovarianceBaseline, MultivariateDetection, chi2_thresholds, scan_multivariate
 
 
 class AnomalyDetectionService:
@@ -27,6 +40,35 @@ class AnomalyDetectionService:
         SeverityLevel.CRITICAL: 2.5
     }
     
+    # Severity codes used by the engine
+    SEVERITY_CODES = {
+        SeverityLevel.INFO: 1,
+        SeverityLevel.WARNING: 2,
+        SeverityLevel.CRITICAL: 3,
+    }
+    
+    METRIC_TYPES = {
+        "sleep_duration": MetricType.SLEEP,
+        "sleep_quality": MetricType.SLEEP,
+        "resting_hr": MetricType.HEART_RATE,
+        "hrv": MetricType.HEART_RATE,
+        "steps": MetricType.STEPS,
+        "stress_score": MetricType.STRESS,
+        "energy_level": MetricType.ENERGY,
+    }
+    
+    # Metrics scanned for anomalies, in the order alerts for one day are listed
+    DETECTED_METRICS = [
+        ("sleep_duration", "Sleep Duration", "hours"),
+        ("resting_hr", "Resting Heart Rate", "bpm"),
+        ("hrv", "Heart Rate Variability", "ms"),
+        ("steps", "Daily Steps", "steps"),
+        ("stress_score", "Stress Level", "score"),
+    ]
+    
+    # Alerts are kept for the most recent records only
+    DETECTION_WINDOW = 30
+    
     METRIC_DIRECTIONS = {
         "sleep_duration": "higher_better",
         "sleep_quality": "higher_better",
@@ -37,79 +79,85 @@ class AnomalyDetectionService:
         "energy_level": "higher_better",
     }
     
-    def __init__(self, data_path: Optional[str] = None):
-        self.data_path = data_path or self._get_default_data_path()
+    def __init__(
+        self,
+        data_path: Optional[str] = None,
+        store: Optional[RecordStore] = None,
+        baseline_window: Optional[int] = None,
+        baseline_method: Optional[str] = None,
+    ):
+        self._store = store or (RecordStore(data_path) if data_path else get_default_store())
+        self.data_path = self._store.data_path
+        # None: baselines frozen on the first records; else a trailing window in days
+        if baseline_window is None and os.environ.get("HEALTH_BASELINE_WINDOW"):
+            try:
+                baseline_window = int(os.environ["HEALTH_BASELINE_WINDOW"])
+            except ValueError:
+                raise AnomalyEngineError(f"HEALTH_BASELINE_WINDOW must be a number of days, got {os.environ['HEALTH_BASELINE_WINDOW']!r}")
+        self.baseline_window = baseline_window
+        # "mean" (mean / std) or "median" (median / scaled MAD, robust to the outliers being flagged)
+        baseline_method = baseline_method or os.environ.get("HEALTH_BASELINE_METHOD") or "mean"
+        if baseline_method not in BASELINE_METHODS:
+            raise AnomalyEngineError(f"Baseline method must be one of {', '.join(BASELINE_METHODS)}, got {baseline_method!r}")
+        self.baseline_method = baseline_method
         self._baselines: Dict[str, Baseline] = {}
-        self._anomalies: List[AnomalyAlert] = []
-        self._data_cache: Dict[str, Any] = {}
+        self._baseline_period = 0
+        self._rolling: Optional[RollingBaseline] = None
+        self._detection = Detection.empty(len(self.DETECTED_METRICS))
+        # Alert objects, built on first request, parallel to the detection
+        self._alerts: List[Optional[AnomalyAlert]] = []
+        self._alerts_lock = threading.Lock()
+        # EWMA / CUSUM drift detectors, fed every day of history, and their alerts
+        self._drift = ChangeDetectors(len(self.DETECTED_METRICS))
+        self._drift_signals = ChangeSignals.empty()
+        self._drift_alerts: List[Optional[AnomalyAlert]] = []
+        # Mahalanobis scoring: covariance of the baseline period (refitted
+        # when that period changes) and the days it flagged
+        self._covariance: Optional[CovarianceBaseline] = None
+        self._multivariate = MultivariateDetection.empty(len(self.DETECTED_METRICS))
+        self._multivariate_alerts: List[Optional[MultivariateAnomalyAlert]] = []
+        self._snapshot: StoreSnapshot = self._store.snapshot
+        self._columns: MetricColumns = self._snapshot.columns
         self._load_data()
         self._calculate_baselines()
-        self._detect_anomalies()
-    
-    def _get_default_data_path(self) -> str:
-        current_dir = Path(__file__).parent.parent
-        return str(current_dir / "data" / "synthetic_health_data.json")
+        self._detect_history()
     
     def _load_data(self) -> None:
-        try:
-            if os.path.exists(self.data_path):
-                with open(self.data_path, 'r') as f:
-                    self._data_cache = json.load(f)
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            self._data_cache = {"records": []}
+        self._snapshot = self._store.snapshot
+        self._columns = self._snapshot.columns
     
     def _calculate_baselines(self) -> None:
-        records = self._data_cache.get("records", [])
+        columns = self._columns
         
-        if len(records) < 14:
+        if self.baseline_window is not None:
+            if self.baseline_method == "mean":
+                self._rolling = RollingBaseline.build(self.baseline_window, columns.days, self._metric_matrix(columns, self.METRIC_TYPES))
+            self._update_rolling_baselines()
             return
         
-        baseline_period = min(60, int(len(records) * 0.66))
-        baseline_records = records[:baseline_period]
+        if len(columns) < 14:
+            return
         
-        metrics_data = defaultdict(list)
+        baseline_period = min(60, int(len(columns) * 0.66))
+        self._baseline_period = baseline_period
+        baseline_columns = columns.slice(0, baseline_period)
         
-        for record in baseline_records:
-            sleep = record.get("sleep", {})
-            if sleep.get("duration_hours"):
-                metrics_data["sleep_duration"].append(sleep["duration_hours"])
-            if sleep.get("quality_score"):
-                metrics_data["sleep_quality"].append(sleep["quality_score"])
-            
-            hr = record.get("heart_rate", {})
-            if hr.get("resting"):
-                metrics_data["resting_hr"].append(hr["resting"])
-            if hr.get("hrv"):
-                metrics_data["hrv"].append(hr["hrv"])
-            
-            activity = record.get("activity", {})
-            if activity.get("steps"):
-                metrics_data["steps"].append(activity["steps"])
+        for metric_name in self.METRIC_TYPES:
+            # Zero readings are treated as missing, like the falsy check on raw records
+            values = baseline_columns.metric(metric_name, fill=0)
+            values = values[values != 0]
             
-            wellness = record.get("wellness", {})
-            if wellness.get("stress_score"):
-                metrics_data["stress_score"].append(wellness["stress_score"])
-            if wellness.get("energy_level"):
-                metrics_data["energy_level"].append(wellness["energy_level"])
-        
-        metric_type_mapping = {
-            "sleep_duration": MetricType.SLEEP,
-            "sleep_quality": MetricType.SLEEP,
-            "resting_hr": MetricType.HEART_RATE,
-            "hrv": MetricType.HEART_RATE,
-            "steps": MetricType.STEPS,
-            "stress_score": MetricType.STRESS,
-            "energy_level": MetricType.ENERGY,
-        }
-        
-        for metric_name, values in metrics_data.items():
             if len(values) >= 7:
-                mean = statistics.mean(values)
-                std_dev = statistics.stdev(values) if len(values) > 1 else 0
+                if self.baseline_method == "median":
+                    # Median and scaled MAD are stored as the baseline's mean and std_dev
+                    mean = float(np.median(values))
+                    std_dev = MAD_SCALE * float(np.median(np.abs(values - mean)))
+                else:
+                    mean = float(values.mean())
+                    std_dev = float(values.std(ddof=1)) if len(values) > 1 else 0
                 
                 self._baselines[metric_name] = Baseline(
-                    metric_type=metric_type_mapping.get(metric_name, MetricType.SLEEP),
+                    metric_type=self.METRIC_TYPES[metric_name],
                     mean=round(mean, 2),
                     std_dev=round(std_dev, 2),
                     min_normal=round(mean - 2 * std_dev, 2),
@@ -118,115 +166,306 @@ class AnomalyDetectionService:
                     last_updated=datetime.now()
                 )
     
-    def _detect_anomalies(self) -> None:
-        records = self._data_cache.get("records", [])
-        self._anomalies = []
-        
-        if len(records) < 14:
+    def _update_rolling_baselines(self) -> None:
+        """Baselines as they stand after the latest day (the window the next day is scored against)."""
+        self._baselines = {}
+        if not len(self._columns):
             return
         
-        recent_records = records[-30:]
-        consecutive_anomalies = defaultdict(int)
-        
-        for record in recent_records:
-            record_date = datetime.strptime(record["date"], "%Y-%m-%d")
-            anomalies_today = self._check_record_for_anomalies(record, record_date, consecutive_anomalies)
-            self._anomalies.extend(anomalies_today)
-        
-        self._anomalies.sort(key=lambda x: x.timestamp, reverse=True)
+        means, stds, counts = self._window_baselines(self._columns.days[-1:] + 1)
+        for i, metric_name in enumerate(self.METRIC_TYPES):
+            mean, std_dev = float(means[0, i]), float(stds[0, i])
+            if mean == mean:
+                self._baselines[metric_name] = Baseline(
+                    metric_type=self.METRIC_TYPES[metric_name],
+                    mean=round(mean, 2),
+                    std_dev=round(std_dev, 2),
+                    min_normal=round(mean - 2 * std_dev, 2),
+                    max_normal=round(mean + 2 * std_dev, 2),
+                    sample_days=int(counts[0, i]),
+                    last_updated=datetime.now()
+                )
     
-    def _check_record_for_anomalies(self, record: Dict, record_date: datetime, consecutive_tracker: Dict[str, int]) -> List[AnomalyAlert]:
-        anomalies = []
-        
-        sleep = record.get("sleep", {})
-        if sleep.get("duration_hours") and "sleep_duration" in self._baselines:
-            anomaly = self._check_metric("sleep_duration", sleep["duration_hours"], record_date, consecutive_tracker, "Sleep Duration", "hours")
-            if anomaly:
-                anomalies.append(anomaly)
-        
-        hr = record.get("heart_rate", {})
-        if hr.get("resting") and "resting_hr" in self._baselines:
-            anomaly = self._check_metric("resting_hr", hr["resting"], record_date, consecutive_tracker, "Resting Heart Rate", "bpm")
-            if anomaly:
-                anomalies.append(anomaly)
-        
-        if hr.get("hrv") and "hrv" in self._baselines:
-            anomaly = self._check_metric("hrv", hr["hrv"], record_date, consecutive_tracker, "Heart Rate Variability", "ms")
-            if anomaly:
-                anomalies.append(anomaly)
-        
-        activity = record.get("activity", {})
-        if activity.get("steps") and "steps" in self._baselines:
-            anomaly = self._check_metric("steps", activity["steps"], record_date, consecutive_tracker, "Daily Steps", "steps")
-            if anomaly:
-                anomalies.append(anomaly)
-        
-        wellness = record.get("wellness", {})
-        if wellness.get("stress_score") and "stress_score" in self._baselines:
-            anomaly = self._check_metric("stress_score", wellness["stress_score"], record_date, consecutive_tracker, "Stress Level", "score")
-            if anomaly:
-                anomalies.append(anomaly)
-        
-        return anomalies
+    def _detect_history(self) -> None:
+        """Detect anomalies, drifts and multivariate anomalies from scratch."""
+        # One pass of baselines over the whole history serves both scans
+        scored = self._scored_values(0)
+        self._detect_anomalies(scored)
+        self._detect_drift(scored)
+        self._detect_multivariate()
     
-    def _check_metric(self, metric_name: str, value: float, record_date: datetime, consecutive_tracker: Dict[str, int], display_name: str, unit: str) -> Optional[AnomalyAlert]:
-        baseline = self._baselines[metric_name]
-        
-        if baseline.std_dev == 0:
-            return None
-        
-        z_score = abs(value - baseline.mean) / baseline.std_dev
-        
-        if z_score < self.THRESHOLDS[SeverityLevel.INFO]:
-            consecutive_tracker[metric_name] = 0
-            return None
+    def _detect_anomalies(self, scored: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> None:
+        """
+        Alerts for the detection window. Runs are counted over the whole
+        history, so a run that started before the window keeps its length,
+        as it does when apply_append carries runs forward.
+        """
+        n = len(self._columns)
+        if n < 14 and self.baseline_window is None:
+            self._set_detection(Detection.empty(len(self.DETECTED_METRICS)))
+            return
         
-        if z_score >= self.THRESHOLDS[SeverityLevel.CRITICAL]:
-            severity = SeverityLevel.CRITICAL
-        elif z_score >= self.THRESHOLDS[SeverityLevel.WARNING]:
-            severity = SeverityLevel.WARNING
+        values, means, stds = scored or self._scored_values(0)
+        thresholds = tuple(self.THRESHOLDS[level] for level in self.SEVERITY_CODES)
+        self._set_detection(scan(values, means, stds, thresholds, report_from=max(0, n - self.DETECTION_WINDOW)))
+    
+    def _scan(self, start: int, initial_runs: Optional[np.ndarray] = None) -> Detection:
+        """Detect anomalies in rows start: of the store, continuing `initial_runs`."""
+        values, means, stds = self._scored_values(start)
+        thresholds = tuple(self.THRESHOLDS[level] for level in self.SEVERITY_CODES)
+        return scan(values, means, stds, thresholds, initial_runs, first_row=start)
+    
+    def _scored_values(self, start: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Detected metrics of rows start: with the baseline means and stds they are scored against."""
+        part = self._columns.slice(start)
+        values = self._metric_matrix(part, [name for name, _, _ in self.DETECTED_METRICS])
+        if self.baseline_window is not None:
+            means, stds = self._rolling_baselines(part.days)
         else:
-            severity = SeverityLevel.INFO
-        
-        consecutive_tracker[metric_name] += 1
-        consecutive_days = consecutive_tracker[metric_name]
-        
-        if consecutive_days >= 3 and severity == SeverityLevel.INFO:
-            severity = SeverityLevel.WARNING
-        elif consecutive_days >= 5 and severity == SeverityLevel.WARNING:
-            severity = SeverityLevel.CRITICAL
+            means, stds = self._baseline_vectors()
+        return values, means, stds
+    
+    def _detect_drift(self, scored: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> None:
+        """Replay the drift detectors over the whole history."""
+        self._drift = ChangeDetectors(len(self.DETECTED_METRICS))
+        self._drift_signals = self._drift.replay(self._standardize(*(scored or self._scored_values(0))))
+        self._drift_alerts = [None] * len(self._drift_signals)
+    
+    def _detect_multivariate(self) -> None:
+        """
+        Score the detection window by Mahalanobis distance against the
+        baseline covariance, counting runs over the whole history.
+        """
+        n = len(self._columns)
+        covariance = self._covariance_baseline()
+        if covariance is None:
+            self._multivariate = MultivariateDetection.empty(len(self.DETECTED_METRICS))
+        else:
+            self._multivariate = self._scan_multivariate(covariance, 0, report_from=max(0, n - self.DETECTION_WINDOW))
+        self._multivariate_alerts = [None] * len(self._multivariate)
+    
+    def _covariance_baseline(self) -> Optional[CovarianceBaseline]:
+        """Covariance of the baseline period (the frozen baseline's rows), fitted once per version."""
+        n = len(self._columns)
+        if n < 14:
+            return None
+        # The version is the baseline period's length: its rows only change when it grows
+        version = min(60, int(n * 0.66))
+        if self._covariance is None or self._covariance.version != version:
+            values = self._metric_matrix(self._columns.slice(0, version), [name for name, _, _ in self.DETECTED_METRICS])
+            self._covariance = CovarianceBaseline.fit(values, version)
+        return self._covariance
+    
+    def _scan_multivariate(
+        self,
+        covariance: CovarianceBaseline,
+        start: int,
+        initial_run: Optional[np.ndarray] = None,
+        report_from: int = 0,
+    ) -> MultivariateDetection:
+        values = self._metric_matrix(self._columns.slice(start), [name for name, _, _ in self.DETECTED_METRICS])
+        thresholds = tuple(self.THRESHOLDS[level] for level in self.SEVERITY_CODES)
+        return scan_multivariate(values, covariance, thresholds, initial_run, first_row=start, report_from=max(0, report_from - start))
+    
+    def _residuals(self, start: int) -> np.ndarray:
+        """(value - baseline mean) / baseline std of rows start:, NaN where not scored."""
+        return self._standardize(*self._scored_values(start))
+    
+    @staticmethod
+    def _standardize(values: np.ndarray, means: np.ndarray, stds: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(stds == 0, np.nan, (values - means) / stds)
+    
+    @staticmethod
+    def _metric_matrix(columns: MetricColumns, names) -> np.ndarray:
+        """Days x metrics matrix of `names`, NaN where missing."""
+        values = np.column_stack([columns.metric(name) for name in names]) if len(columns) else np.zeros((0, len(names)))
+        # Zero readings are treated as missing, like the falsy check on raw records
+        values[values == 0] = np.nan
+        return values
+    
+    def _window_baselines(self, days: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (centers, spreads, counts) of the trailing window before each of `days`
+        (ascending), for every metric in METRIC_TYPES.
+        """
+        if self.baseline_method == "mean":
+            return self._rolling.baseline(days)
+        # Only the rows inside the queried windows are read
+        stored = self._columns.days
+        lo = int(np.searchsorted(stored, days[0] - self.baseline_window, side="left"))
+        hi = int(np.searchsorted(stored, days[-1], side="left"))
+        part = self._columns.slice(lo, hi)
+        return robust_baselines(part.days, self._metric_matrix(part, self.METRIC_TYPES), self.baseline_window, days)
+    
+    def _rolling_baselines(self, days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-day rolling baseline centers and spreads of the detected metrics."""
+        means, stds, _ = self._window_baselines(days)
+        names = list(self.METRIC_TYPES)
+        detected = [names.index(name) for name, _, _ in self.DETECTED_METRICS]
+        return means[:, detected], stds[:, detected]
+    
+    def _baseline_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Baseline means and standard deviations per detected metric (std 0 = not scored)."""
+        baselines = [self._baselines.get(name) for name, _, _ in self.DETECTED_METRICS]
+        means = np.array([b.mean if b else np.nan for b in baselines])
+        stds = np.array([b.std_dev if b else 0.0 for b in baselines])
+        return means, stds
+    
+    def _set_detection(self, detection: Detection, alerts: Optional[List[Optional[AnomalyAlert]]] = None) -> None:
+        self._detection = detection
+        self._alerts = alerts if alerts is not None else [None] * len(detection)
+    
+    def _alert(self, i: int) -> AnomalyAlert:
+        """The AnomalyAlert for detection entry i, built once."""
+        alert = self._alerts[i]
+        if alert is None:
+            with self._alerts_lock:
+                alert = self._alerts[i]
+                if alert is None:
+                    alert = self._alerts[i] = self._build_alert(i)
+        return alert
+    
+    def _drift_alert(self, i: int) -> AnomalyAlert:
+        """The AnomalyAlert for drift signal i, built once."""
+        alert = self._drift_alerts[i]
+        if alert is None:
+            with self._alerts_lock:
+                alert = self._drift_alerts[i]
+                if alert is None:
+                    alert = self._drift_alerts[i] = self._build_drift_alert(i)
+        return alert
+    
+    def _multivariate_alert(self, i: int) -> MultivariateAnomalyAlert:
+        """The MultivariateAnomalyAlert for multivariate entry i, built once."""
+        alert = self._multivariate_alerts[i]
+        if alert is None:
+            with self._alerts_lock:
+                alert = self._multivariate_alerts[i]
+                if alert is None:
+                    alert = self._multivariate_alerts[i] = self._build_multivariate_alert(i)
+        return alert
+    
+    def _baseline_at(self, row: int, metric: int) -> Tuple[float, float]:
+        """Baseline mean and std the given row of a detected metric is scored against."""
+        if self.baseline_window is not None:
+            means, stds = self._rolling_baselines(self._columns.days[row:row + 1])
+            return round(float(means[0, metric]), 2), round(float(stds[0, metric]), 2)
+        baseline = self._baselines[self.DETECTED_METRICS[metric][0]]
+        return baseline.mean, baseline.std_dev
+    
+    def _build_alert(self, i: int) -> AnomalyAlert:
+        detection = self._detection
+        row = int(detection.rows[i])
+        metric = int(detection.metrics[i])
+        metric_name, display_name, unit = self.DETECTED_METRICS[metric]
+        baseline_mean = self._baseline_at(row, metric)[0]
+        value = float(self._columns.slice(row, row + 1).metric(metric_name)[0])
+        consecutive_days = int(detection.consecutive[i])
+        severity = self._severity(int(detection.severity[i]))
         
-        deviation_percent = ((value - baseline.mean) / baseline.mean) * 100
-        direction_word = "below" if value < baseline.mean else "above"
+        deviation_percent = ((value - baseline_mean) / baseline_mean) * 100
+        direction_word = "below" if value < baseline_mean else "above"
         
-        description = f"{display_name} is {abs(deviation_percent):.1f}% {direction_word} your baseline of {baseline.mean:.1f} {unit}. Current: {value:.1f} {unit}."
+        description = f"{display_name} is {abs(deviation_percent):.1f}% {direction_word} your baseline of {baseline_mean:.1f} {unit}. Current: {value:.1f} {unit}."
         
         if consecutive_days > 1:
             description += f" Persisted for {consecutive_days} days."
         
-        metric_type_mapping = {
-            "sleep_duration": MetricType.SLEEP,
-            "resting_hr": MetricType.HEART_RATE,
-            "hrv": MetricType.HEART_RATE,
-            "steps": MetricType.STEPS,
-            "stress_score": MetricType.STRESS,
-            "energy_level": MetricType.ENERGY,
-        }
-        
         return AnomalyAlert(
             id=str(uuid.uuid4()),
-            timestamp=record_date,
+            timestamp=datetime.fromordinal(int(self._columns.days[row])),
             severity=severity,
-            metric_type=metric_type_mapping.get(metric_name, MetricType.SLEEP),
+            metric_type=self.METRIC_TYPES[metric_name],
             title=f"{display_name} Anomaly Detected",
             description=description,
             current_value=value,
-            baseline_value=baseline.mean,
+            baseline_value=baseline_mean,
+            deviation_percent=round(deviation_percent, 1),
+            consecutive_days=consecutive_days,
+            recommended_action=self._get_recommendation(metric_name, value < baseline_mean)
+        )
+    
+    def _build_drift_alert(self, i: int) -> AnomalyAlert:
+        signals = self._drift_signals
+        row = int(signals.rows[i])
+        metric = int(signals.metrics[i])
+        kind = int(signals.kinds[i])
+        metric_name, display_name, unit = self.DETECTED_METRICS[metric]
+        baseline_mean, baseline_std = self._baseline_at(row, metric)
+        value = float(self._columns.slice(row, row + 1).metric(metric_name)[0])
+        days = int(signals.runs[i])
+        
+        # Statistics are in baseline standard deviations
+        level = baseline_mean + float(signals.statistics[i]) * baseline_std
+        deviation_percent = ((level - baseline_mean) / baseline_mean) * 100
+        direction_word = "above" if kind in (EWMA_HIGH, CUSUM_HIGH) else "below"
+        
+        if kind in (EWMA_HIGH, EWMA_LOW):
+            description = f"{display_name} is trending {direction_word} your baseline of {baseline_mean:.1f} {unit}: its weighted recent average is {level:.1f} {unit}. Current: {value:.1f} {unit}."
+        else:
+            description = f"{display_name} has drifted {direction_word} your baseline of {baseline_mean:.1f} {unit}, averaging {level:.1f} {unit} over the last {days} days. Current: {value:.1f} {unit}."
+        
+        return AnomalyAlert(
+            id=str(uuid.uuid4()),
+            timestamp=datetime.fromordinal(int(self._columns.days[row])),
+            severity=SeverityLevel.WARNING,
+            metric_type=self.METRIC_TYPES[metric_name],
+            title=f"{display_name} Drift Detected",
+            description=description,
+            current_value=value,
+            baseline_value=baseline_mean,
             deviation_percent=round(deviation_percent, 1),
+            consecutive_days=days,
+            recommended_action=self._get_recommendation(metric_name, direction_word == "below")
+        )
+    
+    def _build_multivariate_alert(self, i: int) -> MultivariateAnomalyAlert:
+        detection = self._multivariate
+        row = int(detection.rows[i])
+        values = self._metric_matrix(self._columns.slice(row, row + 1), [name for name, _, _ in self.DETECTED_METRICS])[0]
+        present = ~np.isnan(values)
+        distance = float(detection.distances[i])
+        consecutive_days = int(detection.consecutive[i])
+        thresholds = tuple(self.THRESHOLDS[level] for level in self.SEVERITY_CODES)
+        alert_level = float(np.sqrt(chi2_thresholds(thresholds, int(present.sum()))[0]))
+        
+        contributions = detection.contributions[i]
+        shares = contributions / contributions.sum() * 100
+        order = [int(j) for j in np.argsort(-shares, kind="stable") if present[j]]
+        top = order[0]
+        top_name, _, _ = self.DETECTED_METRICS[top]
+        
+        breakdown = ", ".join(f"{self.DETECTED_METRICS[j][1]} {shares[j]:.0f}%" for j in order if shares[j] >= 5)
+        description = f"{int(present.sum())} metrics are off together: distance {distance:.1f} from your baseline pattern (alert level {alert_level:.1f}). Largest contributions: {breakdown}."
+        
+        if consecutive_days > 1:
+            description += f" Persisted for {consecutive_days} days."
+        
+        return MultivariateAnomalyAlert(
+            id=str(uuid.uuid4()),
+            timestamp=datetime.fromordinal(int(self._columns.days[row])),
+            severity=self._severity(int(detection.severity[i])),
+            metric_type=self.METRIC_TYPES[top_name],
+            title="Multivariate Anomaly Detected",
+            description=description,
+            current_value=round(distance, 2),
+            baseline_value=round(alert_level, 2),
+            deviation_percent=round((distance - alert_level) / alert_level * 100, 1),
             consecutive_days=consecutive_days,
-            recommended_action=self._get_recommendation(metric_name, value < baseline.mean)
+            recommended_action=self._get_recommendation(top_name, values[top] < self._covariance.means[top]),
+            contributions={self.DETECTED_METRICS[j][0]: round(float(shares[j]), 1) for j in order},
         )
     
+    def _severity(self, code: int) -> SeverityLevel:
+        return next(level for level, c in self.SEVERITY_CODES.items() if c == code)
+    
+    def _since(self, cutoff: datetime) -> np.ndarray:
+        """Indexes of detection entries dated at or after `cutoff`."""
+        days = self._columns.days[self._detection.rows]
+        timestamps = (days.astype(np.int64) - EPOCH_ORDINAL).astype("datetime64[D]")
+        return np.flatnonzero(timestamps >= np.datetime64(cutoff))
+    
     def _get_recommendation(self, metric_name: str, is_low: bool) -> str:
         recommendations = {
             "sleep_duration": ("Consider a consistent bedtime routine.", "Extended sleep may indicate fatigue."),
@@ -239,22 +478,40 @@ class AnomalyDetectionService:
         return rec[0] if is_low else rec[1]
     
     def get_anomalies(self, severity: Optional[str] = None, limit: int = 20) -> List[AnomalyAlert]:
-        anomalies = self._anomalies
+        index = np.arange(len(self._detection))
         if severity:
-            anomalies = [a for a in anomalies if a.severity.value == severity]
-        return anomalies[:limit]
+            code = next((c for level, c in self.SEVERITY_CODES.items() if level.value == severity), 0)
+            index = index[self._detection.severity == code]
+        return [self._alert(i) for i in index[:limit].tolist()]
     
     def get_recent_anomalies(self, limit: int = 5) -> List[AnomalyAlert]:
-        return self._anomalies[:limit]
+        return [self._alert(i) for i in np.arange(len(self._detection))[:limit].tolist()]
+    
+    def get_drift_alerts(self, metric: Optional[str] = None, limit: int = 20) -> List[AnomalyAlert]:
+        """EWMA and CUSUM drift alerts over the whole history, newest first."""
+        index = np.arange(len(self._drift_signals))
+        if metric:
+            names = [name for name, _, _ in self.DETECTED_METRICS]
+            code = names.index(metric) if metric in names else -1
+            index = index[self._drift_signals.metrics == code]
+        return [self._drift_alert(i) for i in index[:limit].tolist()]
+    
+    def get_multivariate_anomalies(self, severity: Optional[str] = None, limit: int = 20) -> List[MultivariateAnomalyAlert]:
+        """Days flagged by Mahalanobis distance in the detection window, newest first."""
+        index = np.arange(len(self._multivariate))
+        if severity:
+            code = next((c for level, c in self.SEVERITY_CODES.items() if level.value == severity), 0)
+            index = index[self._multivariate.severity == code]
+        return [self._multivariate_alert(i) for i in index[:limit].tolist()]
     
     def get_anomaly_timeline(self, days: int = 14) -> List[Dict[str, Any]]:
         cutoff = datetime.now() - timedelta(days=days)
         timeline = defaultdict(lambda: {"info": 0, "warning": 0, "critical": 0})
         
-        for anomaly in self._anomalies:
-            if anomaly.timestamp >= cutoff:
-                date_str = anomaly.timestamp.strftime("%Y-%m-%d")
-                timeline[date_str][anomaly.severity.value] += 1
+        recent = self._since(cutoff)
+        dates = ordinals_to_strings(self._columns.days[self._detection.rows[recent]]).tolist()
+        for date_str, code in zip(dates, self._detection.severity[recent].tolist()):
+            timeline[date_str][self._severity(code).value] += 1
         
         result = []
         for i in range(days):
@@ -281,19 +538,21 @@ class AnomalyDetectionService:
     
     def calculate_health_score_detailed(self) -> HealthScoreResponse:
         cutoff = datetime.now() - timedelta(days=7)
-        recent = [a for a in self._anomalies if a.timestamp >= cutoff]
+        recent = self._since(cutoff)
         
-        critical = sum(1 for a in recent if a.severity == SeverityLevel.CRITICAL)
-        warning = sum(1 for a in recent if a.severity == SeverityLevel.WARNING)
-        info = sum(1 for a in recent if a.severity == SeverityLevel.INFO)
+        severities = self._detection.severity[recent]
+        critical = int((severities == self.SEVERITY_CODES[SeverityLevel.CRITICAL]).sum())
+        warning = int((severities == self.SEVERITY_CODES[SeverityLevel.WARNING]).sum())
+        info = int((severities == self.SEVERITY_CODES[SeverityLevel.INFO]).sum())
         
         deduction = (critical * 15) + (warning * 8) + (info * 3)
         
+        types = [self.METRIC_TYPES[self.DETECTED_METRICS[m][0]] for m in self._detection.metrics[recent].tolist()]
         components = [
-            HealthScoreComponent(category="Sleep", score=max(0, 100 - len([a for a in recent if a.metric_type == MetricType.SLEEP]) * 10), weight=0.25, contributing_factors=["Duration", "Quality"]),
-            HealthScoreComponent(category="Cardiovascular", score=max(0, 100 - len([a for a in recent if a.metric_type == MetricType.HEART_RATE]) * 10), weight=0.25, contributing_factors=["Resting HR", "HRV"]),
-            HealthScoreComponent(category="Activity", score=max(0, 100 - len([a for a in recent if a.metric_type == MetricType.STEPS]) * 10), weight=0.25, contributing_factors=["Steps", "Active minutes"]),
-            HealthScoreComponent(category="Wellness", score=max(0, 100 - len([a for a in recent if a.metric_type in [MetricType.STRESS, MetricType.ENERGY]]) * 10), weight=0.25, contributing_factors=["Stress", "Energy"]),
+            HealthScoreComponent(category="Sleep", score=max(0, 100 - len([t for t in types if t == MetricType.SLEEP]) * 10), weight=0.25, contributing_factors=["Duration", "Quality"]),
+            HealthScoreComponent(category="Cardiovascular", score=max(0, 100 - len([t for t in types if t == MetricType.HEART_RATE]) * 10), weight=0.25, contributing_factors=["Resting HR", "HRV"]),
+            HealthScoreComponent(category="Activity", score=max(0, 100 - len([t for t in types if t == MetricType.STEPS]) * 10), weight=0.25, contributing_factors=["Steps", "Active minutes"]),
+            HealthScoreComponent(category="Wellness", score=max(0, 100 - len([t for t in types if t in [MetricType.STRESS, MetricType.ENERGY]]) * 10), weight=0.25, contributing_factors=["Stress", "Energy"]),
         ]
         
         weighted = sum(c.score * c.weight for c in components)
@@ -307,7 +566,77 @@ class AnomalyDetectionService:
             calculated_at=datetime.now()
         )
     
+    def apply_append(self, added: int) -> None:
+        """
+        Bring baselines and alerts up to date after `added` rows were appended
+        to the store, scanning only the new rows.
+        
+        The consecutive-day runs carry on from where the last scan ended,
+        so a run that started before the appended rows keeps counting. A full
+        recompute counts runs over the whole history too, so both give the
+        same alerts. Alerts older than the 30-record detection window are
+        dropped. Rolling baselines and the drift detectors only take in the
+        new days.
+        """
+        previous = len(self._columns)
+        self._load_data()
+        n = len(self._columns)
+        
+        if self.baseline_window is not None:
+            # Rolling baselines take in the new days; nothing is recomputed
+            if self._rolling is not None:
+                part = self._columns.slice(n - added)
+                self._rolling = self._rolling.appended(part.days, self._metric_matrix(part, self.METRIC_TYPES))
+            self._update_rolling_baselines()
+        elif previous < 14 or min(60, int(n * 0.66)) != self._baseline_period:
+            # Baseline window is still filling up; all passes are bounded (~90 rows)
+            self._calculate_baselines()
+            self._detect_history()
+            return
+        
+        old = self._detection
+        new = self._scan(n - added, old.runs)
+        
+        days = self._columns.days
+        window_start = days[max(0, n - self.DETECTION_WINDOW)]
+        keep_new = np.flatnonzero(days[new.rows] >= window_start)
+        keep_old = np.flatnonzero(days[old.rows] >= window_start)
+        alerts = [None] * len(keep_new) + [self._alerts[i] for i in keep_old.tolist()]
+        self._set_detection(old.take(keep_old).prepend(new.take(keep_new)), alerts)
+        
+        signals = self._drift.replay(self._residuals(n - added))
+        self._drift_signals = self._drift_signals.prepend(signals)
+        self._drift_alerts = [None] * len(signals) + self._drift_alerts
+        
+        covariance_version = self._covariance.version if self._covariance is not None else None
+        covariance = self._covariance_baseline()
+        if covariance is None or covariance.version != covariance_version:
+            # Refitted (rolling mode: the baseline period grew), so rescore the window
+            self._detect_multivariate()
+            return
+        
+        old_multivariate = self._multivariate
+        new_multivariate = self._scan_multivariate(covariance, n - added, old_multivariate.run)
+        keep_new = np.flatnonzero(days[new_multivariate.rows] >= window_start)
+        keep_old = np.flatnonzero(days[old_multivariate.rows] >= window_start)
+        self._multivariate = old_multivariate.take(keep_old).prepend(new_multivariate.take(keep_new))
+        self._multivariate_alerts = [None] * len(keep_new) + [self._multivariate_alerts[i] for i in keep_old.tolist()]
+    
     def recalculate_anomalies(self) -> None:
         self._load_data()
         self._calculate_baselines()
-        self._detect_anomalies()
\ No newline at end of file
+        self._covariance = None
+        self._detect_history()
+    
+    def fork(self) -> "AnomalyDetectionService":
+        """
+        Copy that can be updated (apply_append, recalculate_anomalies) while
+        this instance keeps serving readers unchanged.
+        """
+        clone = copy.copy(self)
+        clone._baselines = dict(self._baselines)
+        clone._alerts = list(self._alerts)
+        clone._drift = self._drift.copy()
+        clone._drift_alerts = list(self._drift_alerts)
+        clone._multivariate_alerts = list(self._multivariate_alerts)
+        return clone
\ No newline at end of file
@@ -0,0 +1,393 @@
+"""
+Anomaly Engine
+Vectorized z-score detection over a days x metrics matrix.
+
+A scan scores every cell against a baseline vector in one array operation,
+maps z-scores to severity codes with one binary search, and derives the
+consecutive-day counts with cumulative sums instead of a per-day loop. The
+result is a set of parallel arrays (row, metric, z, severity, run length)
+in output order; callers build alert objects only for the entries they
+return.
+
+Baselines are either one vector for all days, or per-day rows from a
+RollingBaseline (mean / std) or robust_baselines (median / MAD): each day
+against the trailing window as it stood that day.
+"""
+
+from bisect import bisect_left, insort
+from typing import Optional, List, Tuple
+
+import numpy as np
+
+
+# Severity codes: 0 = no alert, then increasing severity
+INFO, WARNING, CRITICAL = 1, 2, 3
+
+# Runs of at least this many days escalate INFO to WARNING / WARNING to CRITICAL
+ESCALATE_INFO_AFTER = 3
+ESCALATE_WARNING_AFTER = 5
+
+# A rolling baseline needs this many values in its window before days are scored
+MIN_BASELINE_SAMPLES = 7
+
+# "mean": mean / standard deviation; "median": median / MAD, which the
+# outliers being flagged barely move
+BASELINE_METHODS = ("mean", "median")
+
+# Scales the MAD of normally distributed data to its standard deviation, so
+# robust z-scores use the same thresholds
+MAD_SCALE = 1.4826
+
+
+class AnomalyEngineError(ValueError):
+    """Raised for an invalid baseline window or method."""
+
+    pass
+
+
+class _MomentBuffer:
+    """
+    Running sums of values, squared values and counts per metric: entry i
+    covers rows [0, i). Shared by RollingBaseline views; rows are only ever
+    written past `size`, so every view keeps reading its own prefix.
+
+    The sums depend only on the rows, not on how they were split into
+    writes, so a baseline built incrementally equals one built at once,
+    bit for bit.
+    """
+
+    def __init__(self, capacity: int, metrics: int, shift: Optional[np.ndarray] = None):
+        self.days = np.zeros(capacity, dtype=np.int64)
+        self.sums = np.zeros((capacity + 1, metrics))
+        self.squares = np.zeros((capacity + 1, metrics))
+        self.counts = np.zeros((capacity + 1, metrics), dtype=np.int64)
+        # Values are summed relative to a per-metric reference so squares
+        # stay small and the variance does not cancel: each metric's first
+        # value, set when it arrives (NaN until then)
+        self.shift = np.full(metrics, np.nan) if shift is None else shift
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.days)
+
+    def write(self, days: np.ndarray, values: np.ndarray) -> None:
+        start, stop = self.size, self.size + len(days)
+        present = ~np.isnan(values)
+        unset = np.isnan(self.shift) & present.any(axis=0)
+        if unset.any():
+            first = values[present.argmax(axis=0), np.arange(values.shape[1])]
+            self.shift[unset] = first[unset]
+        shifted = np.where(present, values - self.shift, 0.0)
+        self.days[start:stop] = days
+        # Accumulate on from the stored sums, in the same order as one write of all rows
+        self.sums[start + 1:stop + 1] = np.cumsum(np.vstack([self.sums[start], shifted]), axis=0)[1:]
+        self.squares[start + 1:stop + 1] = np.cumsum(np.vstack([self.squares[start], shifted * shifted]), axis=0)[1:]
+        self.counts[start + 1:stop + 1] = self.counts[start] + np.cumsum(present, axis=0)
+        self.size = stop
+
+    def grown(self, n: int, capacity: int) -> "_MomentBuffer":
+        """Copy of the first n rows with room for `capacity` rows."""
+        # A reference set by rows after n does not belong to the copy
+        copy = _MomentBuffer(capacity, self.sums.shape[1], np.where(self.counts[n] > 0, self.shift, np.nan))
+        copy.days[:n] = self.days[:n]
+        copy.sums[:n + 1] = self.sums[:n + 1]
+        copy.squares[:n + 1] = self.squares[:n + 1]
+        copy.counts[:n + 1] = self.counts[:n + 1]
+        copy.size = n
+        return copy
+
+
+class RollingBaseline:
+    """
+    Trailing-window mean and standard deviation per metric, for any day.
+
+    The baseline of a day covers the values dated in [day - window, day), so
+    each day is scored against the baseline as it stood that day. It is two
+    differences of running sums, so appending days costs O(1) each and no
+    window is ever recomputed. This replaces per-step Welford updates, which
+    cannot evict a value leaving the window or be computed for many days
+    at once.
+    """
+
+    def __init__(self, window: int, buffer: _MomentBuffer, size: int):
+        self.window = window
+        self._buffer = buffer
+        self.size = size
+
+    @classmethod
+    def build(cls, window: int, days: np.ndarray, values: np.ndarray) -> "RollingBaseline":
+        """Baseline over rows with ascending `days` and a days x metrics matrix (NaN = missing)."""
+        if window < 1:
+            raise AnomalyEngineError(f"Baseline window must be at least 1 day, got {window}")
+        empty = cls(window, _MomentBuffer(0, values.shape[1]), 0)
+        return empty.appended(days, values)
+
+    def appended(self, days: np.ndarray, values: np.ndarray) -> "RollingBaseline":
+        """Baseline with rows appended (days after our last, NaN = missing)."""
+        n, total = self.size, self.size + len(days)
+        buffer = self._buffer
+        if buffer.size != n or total > buffer.capacity:
+            # Another view already appended to this buffer, or it is full
+            buffer = buffer.grown(n, max(2 * total, 64))
+        buffer.write(days, values)
+        return RollingBaseline(self.window, buffer, total)
+
+    def baseline(self, days: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (means, stds, counts), each len(days) x metrics, of the window before
+        each day. Means are NaN and stds 0 where the window holds fewer than
+        MIN_BASELINE_SAMPLES values.
+        """
+        buffer = self._buffer
+        stored = buffer.days[:self.size]
+        days = np.asarray(days, dtype=np.int64)
+        lo = np.searchsorted(stored, days - self.window, side="left")
+        hi = np.searchsorted(stored, days, side="left")
+        counts = buffer.counts[hi] - buffer.counts[lo]
+        sums = buffer.sums[hi] - buffer.sums[lo]
+        squares = buffer.squares[hi] - buffer.squares[lo]
+        scored = counts >= MIN_BASELINE_SAMPLES
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = np.where(scored, sums / counts + buffer.shift, np.nan)
+            variances = np.where(scored, (squares - sums * sums / counts) / (counts - 1), 0.0)
+        return means, np.sqrt(np.maximum(variances, 0.0)), counts
+
+
+class Detection:
+    """
+    Alerts found by a scan as parallel arrays, newest row first and in
+    metric order within a row, plus each metric's run length at the end of
+    the scan (for carrying on when more rows arrive).
+    """
+
+    __slots__ = ("rows", "metrics", "z", "severity", "consecutive", "runs")
+
+    def __init__(
+        self,
+        rows: np.ndarray,
+        metrics: np.ndarray,
+        z: np.ndarray,
+        severity: np.ndarray,
+        consecutive: np.ndarray,
+        runs: np.ndarray,
+    ):
+        self.rows = rows
+        self.metrics = metrics
+        self.z = z
+        self.severity = severity
+        self.consecutive = consecutive
+        self.runs = runs
+
+    @classmethod
+    def empty(cls, metrics: int) -> "Detection":
+        none = np.zeros(0, dtype=np.int64)
+        return cls(none, none, np.zeros(0), np.zeros(0, dtype=np.int8), none, np.zeros(metrics, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def take(self, index: np.ndarray) -> "Detection":
+        """Entries at `index` (indexes or a mask); run lengths are kept."""
+        return Detection(
+            self.rows[index], self.metrics[index], self.z[index],
+            self.severity[index], self.consecutive[index], self.runs,
+        )
+
+    def prepend(self, newer: "Detection") -> "Detection":
+        """`newer` (from rows after ours) followed by our entries, with its run lengths."""
+        return Detection(
+            np.concatenate([newer.rows, self.rows]),
+            np.concatenate([newer.metrics, self.metrics]),
+            np.concatenate([newer.z, self.z]),
+            np.concatenate([newer.severity, self.severity]),
+            np.concatenate([newer.consecutive, self.consecutive]),
+            newer.runs,
+        )
+
+
+class SortedWindow:
+    """
+    The values of one metric in a sliding window, kept in a sorted list.
+    Insert and evict find their slot in O(log w) comparisons, then shift the
+    list's tail, which is O(w) (a memmove, cheap next to the interpreter
+    overhead for the window sizes used here). The median is an index and
+    the MAD a selection over two sorted runs, O(log w).
+    """
+
+    def __init__(self):
+        self.values: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, value: float) -> None:
+        insort(self.values, value)
+
+    def remove(self, value: float) -> None:
+        del self.values[bisect_left(self.values, value)]
+
+    def median(self) -> float:
+        values, c = self.values, len(self.values)
+        return values[c // 2] if c % 2 else (values[c // 2 - 1] + values[c // 2]) / 2
+
+    def mad(self, median: float) -> float:
+        """Median absolute deviation from `median`, in O(log w)."""
+        c = len(self.values)
+        if c % 2:
+            return self._distance(c // 2, median)
+        return (self._distance(c // 2 - 1, median) + self._distance(c // 2, median)) / 2
+
+    def _distance(self, k: int, median: float) -> float:
+        """k-th smallest (0-based) |value - median|."""
+        values = self.values
+        p = bisect_left(values, median)
+        # Distances below the median, nearest first, and above it: both ascending
+        a, b = p, len(values) - p
+
+        def below(i: int) -> float:
+            return median - values[p - 1 - i]
+
+        def above(j: int) -> float:
+            return values[p + j] - median
+
+        # Take i from below and k + 1 - i from above; find the smallest i
+        # whose next value below is not smaller than the last one taken above
+        lo, hi = max(0, k + 1 - b), min(k + 1, a)
+        while lo < hi:
+            i = (lo + hi) // 2
+            if below(i) < above(k - i):
+                lo = i + 1
+            else:
+                hi = i
+        i, j = lo, k + 1 - lo
+        return max(below(i - 1) if i else -np.inf, above(j - 1) if j else -np.inf)
+
+
+def robust_baselines(
+    days: np.ndarray,
+    values: np.ndarray,
+    window: int,
+    query_days: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (medians, scales, counts), each len(query_days) x metrics: the median and
+    MAD_SCALE * MAD of the values dated in [day - window, day) before each
+    query day. `days` and `query_days` ascend; `values` is days x metrics
+    (NaN = missing). One sweep adds and evicts each value once, so the cost
+    is O(rows * window) element moves plus O(queries * log window)
+    comparisons per metric. Medians are NaN and scales 0 where a window
+    holds fewer than MIN_BASELINE_SAMPLES values.
+    """
+    if window < 1:
+        raise AnomalyEngineError(f"Baseline window must be at least 1 day, got {window}")
+    days = np.asarray(days, dtype=np.int64)
+    query_days = np.asarray(query_days, dtype=np.int64)
+    q, m = len(query_days), values.shape[1]
+    medians = np.full((q, m), np.nan)
+    scales = np.zeros((q, m))
+    counts = np.zeros((q, m), dtype=np.int64)
+    # Rows entering and leaving the window at each query day
+    enter = np.searchsorted(days, query_days, side="left").tolist()
+    leave = np.searchsorted(days, query_days - window, side="left").tolist()
+    for metric in range(m):
+        column = values[:, metric].tolist()
+        sorted_window = SortedWindow()
+        added = evicted = 0
+        for t in range(q):
+            for row in range(added, enter[t]):
+                if column[row] == column[row]:
+                    sorted_window.add(column[row])
+            for row in range(evicted, leave[t]):
+                if column[row] == column[row]:
+                    sorted_window.remove(column[row])
+            added, evicted = max(added, enter[t]), max(evicted, leave[t])
+            counts[t, metric] = len(sorted_window)
+            if len(sorted_window) >= MIN_BASELINE_SAMPLES:
+                median = sorted_window.median()
+                medians[t, metric] = median
+                scales[t, metric] = MAD_SCALE * sorted_window.mad(median)
+    return medians, scales, counts
+
+
+def z_scores(values: np.ndarray, means: np.ndarray, stds: np.ndarray) -> np.ndarray:
+    """
+    |value - mean| / std for a days x metrics matrix, against one baseline
+    vector or one row per day; NaN where missing or std is 0.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.abs(values - means) / stds
+    return np.where(stds == 0, np.nan, z)
+
+
+def severity_codes(z: np.ndarray, thresholds: Tuple[float, float, float]) -> np.ndarray:
+    """0 below the INFO threshold (or NaN), else INFO / WARNING / CRITICAL."""
+    return np.searchsorted(np.asarray(thresholds), np.nan_to_num(z, nan=-np.inf), side="right").astype(np.int8)
+
+
+def run_lengths(hit: np.ndarray, reset: np.ndarray, initial: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Consecutive-hit counts per cell, column-wise: a hit adds one, a reset
+    sets the count to 0, anything else (a missing day) leaves it as is.
+    Columns start from `initial`. Returns (counts, counts after the last row).
+    """
+    hits = np.cumsum(hit, axis=0)
+    # Hits counted up to the latest reset, carried forward (hits never decrease)
+    at_reset = np.maximum.accumulate(np.where(reset, hits, 0), axis=0)
+    before_first_reset = np.cumsum(reset, axis=0) == 0
+    counts = hits - at_reset + np.where(before_first_reset, initial, 0)
+    final = counts[-1] if len(counts) else np.asarray(initial, dtype=np.int64)
+    return counts, final
+
+
+def escalate(codes: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Long runs raise INFO to WARNING and WARNING to CRITICAL (one step each)."""
+    escalated = codes.copy()
+    escalated[(codes == INFO) & (counts >= ESCALATE_INFO_AFTER)] = WARNING
+    escalated[(codes == WARNING) & (counts >= ESCALATE_WARNING_AFTER)] = CRITICAL
+    return escalated
+
+
+def scan(
+    values: np.ndarray,
+    means: np.ndarray,
+    stds: np.ndarray,
+    thresholds: Tuple[float, float, float],
+    initial_runs: Optional[np.ndarray] = None,
+    first_row: int = 0,
+    report_from: int = 0,
+) -> Detection:
+    """
+    Detect anomalies in a days x metrics matrix (NaN = missing) against
+    per-metric baseline means and standard deviations (vectors, or days x
+    metrics matrices for a baseline that moves day by day).
+
+    A day scoring below the INFO threshold ends a metric's run; a missing
+    day does not. `initial_runs` continues runs from an earlier scan, and
+    `first_row` offsets the returned row numbers. Rows before `report_from`
+    only count towards runs: no alerts are returned for them, but runs
+    reaching into the reported rows keep their full length.
+
+    Scanning rows [0, k) and then rows [k, n) with the first scan's runs as
+    `initial_runs` therefore gives the same alerts for rows [k, n) as one
+    scan of [0, n) with report_from=k.
+    """
+    n, m = values.shape
+    initial = np.zeros(m, dtype=np.int64) if initial_runs is None else initial_runs
+    z = z_scores(values, means, stds)
+    codes = severity_codes(z, thresholds)
+    hit = codes > 0
+    counts, runs = run_lengths(hit, ~np.isnan(z) & ~hit, initial)
+    rows, metrics = np.nonzero(hit[report_from:])
+    rows += report_from
+    # Newest day first, metrics in column order within a day
+    order = np.lexsort((metrics, -rows))
+    rows, metrics = rows[order], metrics[order]
+    return Detection(
+        rows + first_row,
+        metrics,
+        z[rows, metrics],
+        escalate(codes[rows, metrics], counts[rows, metrics]),
+        counts[rows, metrics],
+        runs,
+    )
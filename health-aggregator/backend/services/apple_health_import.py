@@ -0,0 +1,246 @@
+"""
+Apple Health Import
+Streams an Apple Health ``export.xml`` into the daily record schema.
+
+The export is parsed with ``ElementTree.iterparse`` and every element is
+cleared as soon as it has been read, so memory does not grow with the number
+of samples. Samples are folded into per-day accumulators on the fly; only one
+small accumulator per (day, metric) is kept, whatever the export size.
+
+Cumulative quantities (steps, energy, distance, ...) are summed per source
+and the largest source total is used for the day, since iPhone and Apple
+Watch record overlapping samples for the same activity.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+from services.metric_store import MetricColumns
+
+
+class AppleHealthImportError(Exception):
+    """Raised when the file is not a readable Apple Health export."""
+
+    pass
+
+
+# Unit conversions to the schema's units
+_UNIT_FACTORS: Dict[str, float] = {
+    "count": 1.0, "count/min": 1.0, "ms": 1.0, "min": 1.0, "g": 1.0, "%": 1.0,
+    "kcal": 1.0, "Cal": 1.0, "kJ": 1 / 4.184,
+    "km": 1.0, "m": 0.001, "mi": 1.609344,
+    "kg": 1.0, "lb": 0.45359237,
+    "mL": 1.0, "L": 1000.0, "fl_oz_us": 29.5735,
+}
+
+# HK quantity type -> (schema field, aggregation)
+#   sum:  cumulative per source, largest source total wins
+#   mean: average of all samples that day
+#   max:  maximum sample
+#   last: latest sample (by start time)
+QUANTITY_TYPES: Dict[str, List[Tuple[str, str]]] = {
+    "HKQuantityTypeIdentifierStepCount": [("activity.steps", "sum")],
+    "HKQuantityTypeIdentifierAppleExerciseTime": [("activity.active_minutes", "sum")],
+    "HKQuantityTypeIdentifierActiveEnergyBurned": [("activity.calories_burned", "sum")],
+    "HKQuantityTypeIdentifierBasalEnergyBurned": [("activity.calories_burned", "sum")],
+    "HKQuantityTypeIdentifierDistanceWalkingRunning": [("activity.distance_km", "sum")],
+    "HKQuantityTypeIdentifierFlightsClimbed": [("activity.floors_climbed", "sum")],
+    "HKQuantityTypeIdentifierRestingHeartRate": [("heart_rate.resting", "mean")],
+    "HKQuantityTypeIdentifierHeartRate": [("heart_rate.average", "mean"), ("heart_rate.max", "max")],
+    "HKQuantityTypeIdentifierHeartRateVariabilitySDNN": [("heart_rate.hrv", "mean")],
+    "HKQuantityTypeIdentifierDietaryEnergyConsumed": [("nutrition.calories", "sum")],
+    "HKQuantityTypeIdentifierDietaryProtein": [("nutrition.protein_g", "sum")],
+    "HKQuantityTypeIdentifierDietaryCarbohydrates": [("nutrition.carbs_g", "sum")],
+    "HKQuantityTypeIdentifierDietaryFatTotal": [("nutrition.fat_g", "sum")],
+    "HKQuantityTypeIdentifierDietarySugar": [("nutrition.sugar_g", "sum")],
+    "HKQuantityTypeIdentifierDietaryFiber": [("nutrition.fiber_g", "sum")],
+    "HKQuantityTypeIdentifierDietaryWater": [("nutrition.water_ml", "sum")],
+    "HKQuantityTypeIdentifierBodyMass": [("weight.weight_kg", "last")],
+    "HKQuantityTypeIdentifierBodyFatPercentage": [("weight.body_fat_percent", "last")],
+}
+
+SLEEP_TYPE = "HKCategoryTypeIdentifierSleepAnalysis"
+_ASLEEP_VALUES = {
+    "HKCategoryValueSleepAnalysisAsleep",
+    "HKCategoryValueSleepAnalysisAsleepUnspecified",
+    "HKCategoryValueSleepAnalysisAsleepCore",
+    "HKCategoryValueSleepAnalysisAsleepDeep",
+    "HKCategoryValueSleepAnalysisAsleepREM",
+}
+_DEEP_VALUE = "HKCategoryValueSleepAnalysisAsleepDeep"
+_REM_VALUE = "HKCategoryValueSleepAnalysisAsleepREM"
+_AWAKE_VALUE = "HKCategoryValueSleepAnalysisAwake"
+
+_ROUNDING = {
+    "activity.distance_km": 1, "heart_rate.hrv": 1, "weight.weight_kg": 1, "weight.body_fat_percent": 1,
+    "nutrition.protein_g": 1, "nutrition.carbs_g": 1, "nutrition.fat_g": 1,
+    "nutrition.sugar_g": 1, "nutrition.fiber_g": 1,
+    "sleep.duration_hours": 1, "sleep.deep_sleep_hours": 1, "sleep.rem_sleep_hours": 1,
+}
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def _parse_time(value: str) -> datetime:
+    # "2024-01-31 07:12:03 -0500": the local wall-clock part is what the day is keyed on
+    return datetime.fromisoformat(value[:19])
+
+
+class _DailyAggregator:
+    """Per-day accumulators; memory is proportional to days x metrics, not samples."""
+
+    def __init__(self):
+        self.sums: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.means: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0.0, 0])
+        self.maxes: Dict[Tuple[str, str], float] = {}
+        self.lasts: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self.sleep: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0.0, 0.0, 0.0, 0])
+
+    def add_quantity(self, type_id: str, attrib: Dict[str, str]) -> bool:
+        targets = QUANTITY_TYPES.get(type_id)
+        if targets is None:
+            return False
+        try:
+            value = float(attrib["value"])
+        except (KeyError, ValueError):
+            return False
+        unit = attrib.get("unit", "")
+        factor = _UNIT_FACTORS.get(unit, 1.0)
+        if type_id == "HKQuantityTypeIdentifierBodyFatPercentage" and unit == "%":
+            factor = 100.0  # stored as a fraction
+        value *= factor
+
+        start = attrib.get("startDate", "")
+        day = start[:10]
+        for field, agg in targets:
+            key = (day, field)
+            if agg == "sum":
+                self.sums[key][attrib.get("sourceName", "")] += value
+            elif agg == "mean":
+                acc = self.means[key]
+                acc[0] += value
+                acc[1] += 1
+            elif agg == "max":
+                if value > self.maxes.get(key, float("-inf")):
+                    self.maxes[key] = value
+            elif agg == "last":
+                if key not in self.lasts or start >= self.lasts[key][0]:
+                    self.lasts[key] = (start, value)
+        return True
+
+    def add_sleep(self, attrib: Dict[str, str]) -> bool:
+        value = attrib.get("value", "")
+        try:
+            start = _parse_time(attrib["startDate"])
+            end = _parse_time(attrib["endDate"])
+        except (KeyError, ValueError):
+            return False
+        # A night's sleep is attributed to the day it ends on; sources are
+        # kept apart because a watch and a sleep app log the same night
+        acc = self.sleep[(attrib["endDate"][:10], attrib.get("sourceName", ""))]
+        hours = (end - start).total_seconds() / 3600
+        if value in _ASLEEP_VALUES:
+            acc[0] += hours
+            if value == _DEEP_VALUE:
+                acc[1] += hours
+            elif value == _REM_VALUE:
+                acc[2] += hours
+        elif value == _AWAKE_VALUE:
+            acc[3] += 1
+        else:
+            return False
+        return True
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        days: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for (day, field), per_source in self.sums.items():
+            days[day][field] = max(per_source.values())
+        for (day, field), (total, count) in self.means.items():
+            days[day][field] = total / count
+        for (day, field), value in self.maxes.items():
+            days[day][field] = value
+        for (day, field), (_, value) in self.lasts.items():
+            days[day][field] = value
+        nights: Dict[str, List[float]] = {}
+        for (day, _), acc in self.sleep.items():
+            if acc[0] > 0 and (day not in nights or acc[0] > nights[day][0]):
+                nights[day] = acc
+        for day, (asleep, deep, rem, wake_ups) in nights.items():
+            days[day]["sleep.duration_hours"] = asleep
+            days[day]["sleep.deep_sleep_hours"] = deep
+            days[day]["sleep.rem_sleep_hours"] = rem
+            days[day]["sleep.wake_ups"] = wake_ups
+
+        records = []
+        for day in sorted(days):
+            record: Dict[str, Any] = {"date": day}
+            for field, value in days[day].items():
+                group, name = field.split(".", 1)
+                decimals = _ROUNDING.get(field)
+                record.setdefault(group, {})[name] = round(value, decimals) if decimals else int(round(value))
+            records.append(record)
+        return records
+
+
+def parse_apple_health_export(
+    path: str,
+    progress: Optional[ProgressCallback] = None,
+    progress_every: int = 100_000,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Aggregate an Apple Health export into daily records.
+
+    Returns (records sorted by date, stats) where stats holds the number of
+    XML records seen and used. `progress(records_seen, bytes_read)` is called
+    every `progress_every` records.
+    """
+    if not os.path.exists(path):
+        raise AppleHealthImportError(f"Path does not exist: {path}")
+
+    aggregator = _DailyAggregator()
+    seen = used = 0
+    depth = 0
+    with open(path, "rb") as f:
+        try:
+            context = ET.iterparse(f, events=("start", "end"))
+            _, root = next(context)
+            if root.tag != "HealthData":
+                raise AppleHealthImportError(f"Not an Apple Health export (root element <{root.tag}>)")
+            for event, elem in context:
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 0:
+                    continue
+                # Only top-level records: members of a <Correlation> are also
+                # exported on their own and would otherwise be counted twice
+                if elem.tag == "Record":
+                    seen += 1
+                    attrib = elem.attrib
+                    type_id = attrib.get("type", "")
+                    if type_id == SLEEP_TYPE:
+                        used += aggregator.add_sleep(attrib)
+                    else:
+                        used += aggregator.add_quantity(type_id, attrib)
+                    if progress and seen % progress_every == 0:
+                        progress(seen, f.tell())
+                # Drop the element and everything parsed before it
+                elem.clear()
+                root.clear()
+        except ET.ParseError as e:
+            raise AppleHealthImportError(f"Invalid XML in {path}: {e}") from e
+
+    if progress:
+        progress(seen, os.path.getsize(path))
+    return aggregator.to_records(), {"xml_records": seen, "used_records": used}
+
+
+def import_apple_health(path: str, progress: Optional[ProgressCallback] = None) -> Tuple[MetricColumns, Dict[str, Any]]:
+    """Import an Apple Health export straight into the columnar store."""
+    records, stats = parse_apple_health_export(path, progress)
+    metadata = {"source": "apple_health", "days": len(records), **stats}
+    return MetricColumns.from_records(records), metadata
@@ -0,0 +1,208 @@
+"""
+Arrow / Parquet I/O
+Exports the record store (and the ML training frame) as Parquet or Arrow IPC
+files, and loads them back as typed columns.
+
+The file schema is flat: a ``date`` (date32) column followed by one nullable
+column per schema field, named like the ``fields=`` API parameter
+(``sleep.duration_hours``). Integer fields are int32; float fields are the
+decoded float64 values, so offline jobs read exactly what the API serves.
+
+Writers emit one Parquet row group / Arrow record batch per slice of rows,
+so exporting a long history needs memory for one slice only. Readers go
+batch by batch straight into MetricColumns; Arrow IPC files are memory-mapped.
+"""
+
+import json
+import os
+from typing import Optional, Dict, Any, Iterator, Tuple
+
+import numpy as np
+
+from services.metric_store import MetricColumns, FIELDS, FIELD_DTYPES, EPOCH_ORDINAL
+
+# pyarrow is optional, as pandas is for the counterfactual engine
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+PARQUET_SUFFIX = ".parquet"
+ARROW_SUFFIXES = (".arrow", ".feather")
+DEFAULT_ROW_GROUP_ROWS = 100_000
+
+# Key of the JSON-encoded store metadata in the file's schema metadata
+METADATA_KEY = b"health_metadata"
+
+
+class ArrowIOError(Exception):
+    """Raised when pyarrow is missing or a file does not hold health records."""
+
+    pass
+
+
+def is_arrow_path(path: str) -> bool:
+    return str(path).endswith((PARQUET_SUFFIX,) + ARROW_SUFFIXES)
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ArrowIOError("Parquet/Arrow support requires pyarrow")
+
+
+def _schema(metadata: Optional[Dict[str, Any]] = None) -> "pa.Schema":
+    fields = [pa.field("date", pa.date32(), nullable=False)]
+    for f in FIELDS:
+        fields.append(pa.field(f, pa.int32() if FIELD_DTYPES[f].kind == "i" else pa.float64()))
+    return pa.schema(fields, metadata={METADATA_KEY: json.dumps(metadata or {}).encode()})
+
+
+def _to_batch(columns: MetricColumns, schema: "pa.Schema") -> "pa.RecordBatch":
+    arrays = [pa.array((columns.days.astype(np.int64) - EPOCH_ORDINAL).astype(np.int32), type=pa.date32())]
+    for f in FIELDS:
+        values = columns.values[f] if FIELD_DTYPES[f].kind == "i" else columns.column(f, fill=0)
+        arrays.append(pa.array(values, type=schema.field(f).type, mask=~columns.valid[f]))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _from_batch(batch: "pa.RecordBatch") -> MetricColumns:
+    names = batch.schema.names
+    if "date" not in names:
+        raise ArrowIOError("File has no 'date' column")
+    dates = batch.column(names.index("date")).cast(pa.date32()).cast(pa.int32())
+    days = (dates.to_numpy(zero_copy_only=False).astype(np.int64) + EPOCH_ORDINAL).astype(np.int32)
+    n = len(days)
+    values: Dict[str, np.ndarray] = {}
+    valid: Dict[str, np.ndarray] = {}
+    for f in FIELDS:
+        dtype = FIELD_DTYPES[f]
+        if f not in names:
+            values[f], valid[f] = np.zeros(n, dtype=dtype), np.zeros(n, dtype=bool)
+            continue
+        column = batch.column(names.index(f))
+        raw = column.fill_null(0).to_numpy(zero_copy_only=False).astype(np.float64)
+        mask = column.is_valid().to_numpy(zero_copy_only=False) & np.isfinite(raw)
+        raw[~mask] = 0
+        values[f] = (np.rint(raw) if dtype.kind == "i" else raw).astype(dtype)
+        valid[f] = mask
+    return MetricColumns(days, values, valid)
+
+
+def _slices(columns: MetricColumns, rows: int) -> Iterator[MetricColumns]:
+    for start in range(0, len(columns), rows):
+        yield columns.slice(start, start + rows)
+
+
+def export_columns(
+    columns: MetricColumns,
+    path: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    row_group_rows: int = DEFAULT_ROW_GROUP_ROWS,
+) -> int:
+    """Write the store to a Parquet (.parquet) or Arrow IPC (.arrow/.feather) file."""
+    return export_batches(_slices(columns, row_group_rows), path, metadata)
+
+
+def export_batches(batches: Iterator[MetricColumns], path: str, metadata: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Stream column batches to a file, one row group / record batch each.
+
+    Written to a temporary file and renamed, so readers never see a partial
+    export. Returns the number of rows written.
+    """
+    _require_pyarrow()
+    schema = _schema(metadata)
+    tmp_path = path + ".tmp"
+    rows = 0
+    try:
+        if str(path).endswith(PARQUET_SUFFIX):
+            writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(tmp_path, schema)
+        with writer:
+            for batch in batches:
+                if len(batch):
+                    writer.write_batch(_to_batch(batch, schema))
+                    rows += len(batch)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return rows
+
+
+def iter_batches(path: str, batch_rows: int = DEFAULT_ROW_GROUP_ROWS) -> Iterator[MetricColumns]:
+    """Yield a Parquet or Arrow IPC file as MetricColumns batches."""
+    _require_pyarrow()
+    try:
+        if str(path).endswith(PARQUET_SUFFIX):
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+                yield _from_batch(batch)
+        else:
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    yield _from_batch(reader.get_batch(i))
+    except (pa.ArrowInvalid, OSError) as e:
+        raise ArrowIOError(f"Cannot read {path}: {e}") from e
+
+
+def read_metadata(path: str) -> Dict[str, Any]:
+    _require_pyarrow()
+    if str(path).endswith(PARQUET_SUFFIX):
+        schema = pq.read_schema(path)
+    else:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    raw = (schema.metadata or {}).get(METADATA_KEY)
+    return json.loads(raw) if raw else {}
+
+
+def import_columns(path: str, batch_rows: int = DEFAULT_ROW_GROUP_ROWS) -> Tuple[MetricColumns, Dict[str, Any]]:
+    """Load a Parquet or Arrow IPC export into columns; returns (columns, metadata)."""
+    columns = MetricColumns.empty()
+    for batch in iter_batches(path, batch_rows):
+        columns = columns.append(batch)
+    return columns, read_metadata(path)
+
+
+def export_training_frame(columns: MetricColumns, path: str, row_group_rows: int = DEFAULT_ROW_GROUP_ROWS) -> int:
+    """
+    Write the ML training frame for `columns` to Parquet, one row group per
+    slice of store rows, without building the whole frame in memory.
+
+    The frame's index (store row numbers) is kept, so ``pd.read_parquet``
+    returns the same DataFrame as build_training_frame_from_columns.
+    """
+    _require_pyarrow()
+    from services.counterfactual_engine import build_training_frame_from_columns, TrainingFrameError
+
+    writer = None
+    tmp_path = path + ".tmp"
+    rows = 0
+    try:
+        for start in range(0, len(columns), row_group_rows):
+            try:
+                frame = build_training_frame_from_columns(columns.slice(start, start + row_group_rows))
+            except TrainingFrameError:
+                continue
+            frame.index += start
+            table = pa.Table.from_pandas(frame, preserve_index=True)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, compression="zstd")
+            writer.write_table(table)
+            rows += len(frame)
+        if writer is None:
+            raise ArrowIOError("No complete rows to export")
+        writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return rows
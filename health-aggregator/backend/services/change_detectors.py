@@ -0,0 +1,194 @@
+"""
+Change Detectors
+EWMA control charts and two-sided CUSUM per metric, for slow drifts that
+never cross a per-day z-score threshold (resting HR creeping up 1 bpm a
+week).
+
+Both detectors read standardized residuals ((value - baseline mean) /
+baseline std, NaN = missing) and keep a fixed handful of numbers per metric,
+so they run as streaming state machines: `update` feeds one day and `replay`
+feeds any number of days with the same result. A replay is vectorized: the
+EWMA recursion is solved as a scaled cumulative sum, and CUSUM uses the closed form of its max(0, ...) recursion (running sum minus
+its running minimum). A missing day leaves every statistic unchanged.
+
+A signal is raised on the day a statistic enters its alarm region, not on
+every day it stays there.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from services.anomaly_engine import AnomalyEngineError, run_lengths
+
+
+# Signal kinds, in output order within a day and metric
+EWMA_HIGH, EWMA_LOW, CUSUM_HIGH, CUSUM_LOW = 0, 1, 2, 3
+SIGNAL_KINDS = ("ewma_high", "ewma_low", "cusum_high", "cusum_low")
+
+# EWMA weight of the newest day and control limit in (asymptotic) EWMA
+# standard deviations; CUSUM allowance and decision interval in baseline
+# standard deviations
+DEFAULT_EWMA_LAMBDA = 0.2
+DEFAULT_EWMA_LIMIT = 3.0
+DEFAULT_CUSUM_K = 0.5
+DEFAULT_CUSUM_H = 5.0
+
+# Largest 1 / (1 - lambda)^k an EWMA replay block may reach
+EWMA_MAX_SCALE = 1e100
+
+
+class ChangeSignals:
+    """
+    Signals raised by a replay as parallel arrays, newest row first, then
+    by metric and kind. `statistics` are in baseline standard deviations:
+    the EWMA, or for CUSUM the mean shift estimate k + S / run length.
+    `runs` count the days the drift has lasted: present days the EWMA has
+    been on that side of the baseline, or since the CUSUM was last at zero.
+    """
+
+    __slots__ = ("rows", "metrics", "kinds", "statistics", "runs")
+
+    def __init__(self, rows: np.ndarray, metrics: np.ndarray, kinds: np.ndarray, statistics: np.ndarray, runs: np.ndarray):
+        self.rows = rows
+        self.metrics = metrics
+        self.kinds = kinds
+        self.statistics = statistics
+        self.runs = runs
+
+    @classmethod
+    def empty(cls) -> "ChangeSignals":
+        none = np.zeros(0, dtype=np.int64)
+        return cls(none, none, none, np.zeros(0), none)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def prepend(self, newer: "ChangeSignals") -> "ChangeSignals":
+        """`newer` (from rows after ours) followed by our signals."""
+        return ChangeSignals(
+            np.concatenate([newer.rows, self.rows]),
+            np.concatenate([newer.metrics, self.metrics]),
+            np.concatenate([newer.kinds, self.kinds]),
+            np.concatenate([newer.statistics, self.statistics]),
+            np.concatenate([newer.runs, self.runs]),
+        )
+
+
+class ChangeDetectors:
+    """EWMA chart and two-sided CUSUM state for a fixed set of metrics."""
+
+    def __init__(
+        self,
+        metrics: int,
+        ewma_lambda: float = DEFAULT_EWMA_LAMBDA,
+        ewma_limit: float = DEFAULT_EWMA_LIMIT,
+        cusum_k: float = DEFAULT_CUSUM_K,
+        cusum_h: float = DEFAULT_CUSUM_H,
+    ):
+        if not 0 < ewma_lambda <= 1:
+            raise AnomalyEngineError(f"EWMA lambda must be in (0, 1], got {ewma_lambda}")
+        if ewma_limit <= 0 or cusum_h <= 0 or cusum_k < 0:
+            raise AnomalyEngineError("EWMA limit and CUSUM h must be positive and CUSUM k non-negative")
+        self.ewma_lambda = ewma_lambda
+        self.ewma_limit = ewma_limit
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.ewma = np.zeros(metrics)
+        # Present days seen, for the EWMA's start-up variance
+        self.count = np.zeros(metrics, dtype=np.int64)
+        self.cusum_high = np.zeros(metrics)
+        self.cusum_low = np.zeros(metrics)
+        # Drift lengths and alarm flags per kind (EWMA_HIGH .. CUSUM_LOW)
+        self.runs = np.zeros((4, metrics), dtype=np.int64)
+        self.alarm = np.zeros((4, metrics), dtype=bool)
+        # Rows fed so far, to number signals
+        self.rows = 0
+
+    def copy(self) -> "ChangeDetectors":
+        clone = ChangeDetectors(len(self.ewma), self.ewma_lambda, self.ewma_limit, self.cusum_k, self.cusum_h)
+        clone.ewma, clone.count = self.ewma.copy(), self.count.copy()
+        clone.cusum_high, clone.cusum_low = self.cusum_high.copy(), self.cusum_low.copy()
+        clone.runs, clone.alarm = self.runs.copy(), self.alarm.copy()
+        clone.rows = self.rows
+        return clone
+
+    def update(self, residuals: np.ndarray) -> ChangeSignals:
+        """Feed one day's residuals (one per metric)."""
+        return self.replay(np.asarray(residuals, dtype=np.float64)[None, :])
+
+    def replay(self, residuals: np.ndarray) -> ChangeSignals:
+        """Feed a days x metrics matrix of residuals, oldest day first."""
+        n = len(residuals)
+        if n == 0:
+            return ChangeSignals.empty()
+        present = ~np.isnan(residuals)
+        x = np.where(present, residuals, 0.0)
+
+        ewma, counts = self._ewma(x, present)
+        decay = (1 - self.ewma_lambda) ** (2 * counts)
+        limit = self.ewma_limit * np.sqrt(self.ewma_lambda / (2 - self.ewma_lambda) * (1 - decay))
+        high = self._cusum(np.where(present, x - self.cusum_k, 0.0), self.cusum_high)
+        low = self._cusum(np.where(present, -x - self.cusum_k, 0.0), self.cusum_low)
+
+        # Drift lengths: present days on the drifting side since the last day off it
+        runs = np.stack([
+            run_lengths(present & (ewma > 0), present & (ewma <= 0), self.runs[EWMA_HIGH])[0],
+            run_lengths(present & (ewma < 0), present & (ewma >= 0), self.runs[EWMA_LOW])[0],
+            run_lengths(present & (high > 0), present & (high == 0), self.runs[CUSUM_HIGH])[0],
+            run_lengths(present & (low > 0), present & (low == 0), self.runs[CUSUM_LOW])[0],
+        ])
+        alarm = np.stack([ewma > limit, ewma < -limit, high > self.cusum_h, low > self.cusum_h])
+        previous = np.concatenate([self.alarm[:, None, :], alarm[:, :-1]], axis=1)
+        raised = alarm & ~previous
+
+        kinds, rows, metrics = np.nonzero(raised)
+        order = np.lexsort((kinds, metrics, -rows))
+        kinds, rows, metrics = kinds[order], rows[order], metrics[order]
+        lengths = runs[kinds, rows, metrics]
+        # Raised CUSUM signals have S > h > 0, so their run length is at least 1
+        statistics = np.select(
+            [kinds <= EWMA_LOW, kinds == CUSUM_HIGH],
+            [ewma[rows, metrics], self.cusum_k + high[rows, metrics] / np.maximum(lengths, 1)],
+            -(self.cusum_k + low[rows, metrics] / np.maximum(lengths, 1)),
+        )
+        signals = ChangeSignals(rows + self.rows, metrics, kinds, statistics, lengths)
+
+        self.ewma, self.count = ewma[-1], counts[-1]
+        self.cusum_high, self.cusum_low = high[-1], low[-1]
+        self.runs, self.alarm = runs[:, -1], alarm[:, -1]
+        self.rows += n
+        return signals
+
+    def _ewma(self, x: np.ndarray, present: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        EWMA after each day (z = lambda * x + (1 - lambda) * z on present
+        days, unchanged on missing ones) and running present-day counts.
+
+        With P_t = (1 - lambda)^(present days up to t), the recursion solves
+        to z_t = P_t * (z_0 + sum over i <= t of lambda * x_i / P_i): a
+        cumulative sum for all metrics at once. Blocks restart z_0 so 1 / P
+        stays within EWMA_MAX_SCALE.
+        """
+        lam, decay = self.ewma_lambda, 1 - self.ewma_lambda
+        counts = self.count + np.cumsum(present, axis=0)
+        if decay == 0:
+            # lambda = 1: the EWMA is the latest present value
+            latest = np.maximum.accumulate(np.where(present, np.arange(len(x))[:, None], -1), axis=0)
+            taken = np.take_along_axis(x, np.maximum(latest, 0), axis=0)
+            return np.where(latest >= 0, taken, self.ewma), counts
+        block = max(1, int(np.log(EWMA_MAX_SCALE) / -np.log(decay)))
+        ewma = np.empty_like(x)
+        last = self.ewma
+        for start in range(0, len(x), block):
+            stop = min(start + block, len(x))
+            scale = decay ** np.cumsum(present[start:stop], axis=0)
+            ewma[start:stop] = scale * (last + np.cumsum(lam * x[start:stop] * present[start:stop] / scale, axis=0))
+            last = ewma[stop - 1]
+        return ewma, counts
+
+    @staticmethod
+    def _cusum(steps: np.ndarray, initial: np.ndarray) -> np.ndarray:
+        """S_t = max(0, S_t-1 + step_t) from S_0 = initial, as running sum minus its running minimum."""
+        sums = initial + np.cumsum(steps, axis=0)
+        return sums - np.minimum(np.minimum.accumulate(sums, axis=0), 0.0)
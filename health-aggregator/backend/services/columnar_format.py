@@ -0,0 +1,255 @@
+"""
+Columnar File Format
+Compact binary on-disk layout for the metric store, opened with mmap.
+
+Layout (all integers little-endian):
+
+    8 bytes   magic b"HCOL\\x00\\x00\\x00\\x01"
+    8 bytes   uint64 length of the JSON header
+    N bytes   JSON header: schema, row count, date range, source metadata and
+              the byte offset of every array
+    ...       fixed-width arrays, each aligned to 64 bytes
+
+The day-ordinal column comes first, followed by one value array and one
+uint8 validity mask per field. Arrays are sliced straight out of the mapping
+with ``np.frombuffer``, so opening a file only reads the header and pages are
+faulted in as columns are actually touched.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from services.metric_store import (
+    MetricColumns, FIELDS, FIELD_DTYPES, FIELD_DECIMALS, ordinals_to_strings
+)
+
+
+MAGIC = b"HCOL\x00\x00\x00\x01"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+COLUMNAR_SUFFIX = ".hcol"
+
+
+class ColumnarFormatError(Exception):
+    """Raised when a columnar file is missing, truncated or has an unknown layout."""
+
+    pass
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_columnar_path(path: str) -> bool:
+    return str(path).endswith(COLUMNAR_SUFFIX)
+
+
+def _array_specs() -> List[Tuple[str, Optional[str], np.dtype]]:
+    """(name, kind, on-disk dtype) for every array in file order."""
+    specs: List[Tuple[str, Optional[str], np.dtype]] = [("days", None, np.dtype("<i4"))]
+    for field in FIELDS:
+        specs.append((field, "values", FIELD_DTYPES[field].newbyteorder("<")))
+        specs.append((field, "valid", np.dtype(np.uint8)))
+    return specs
+
+
+def _build_header(n: int, days: np.ndarray, metadata: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], bytes, List[int]]:
+    """Lay out all arrays for `n` rows; returns (header, encoded header, absolute offsets)."""
+    specs = _array_specs()
+    dates = ordinals_to_strings(days).tolist() if n else [None, None]
+    header: Dict[str, Any] = {
+        "format": "hcol",
+        "version": FORMAT_VERSION,
+        "rows": n,
+        "start_date": dates[0],
+        "end_date": dates[1],
+        "metadata": metadata or {},
+        "days": None,
+        "fields": {},
+    }
+
+    relative = []
+    position = 0
+    for _, _, dtype in specs:
+        position = _align(position)
+        relative.append(position)
+        position += n * dtype.itemsize
+
+    # Offsets depend on the header size, so iterate until its length is stable
+    data_start = 0
+    while True:
+        for (name, kind, dtype), rel in zip(specs, relative):
+            entry = {"dtype": dtype.str, "offset": data_start + rel, "nbytes": n * dtype.itemsize}
+            if kind is None:
+                header["days"] = entry
+            else:
+                field = header["fields"].setdefault(name, {"decimals": FIELD_DECIMALS[name]})
+                field[kind] = entry
+        encoded = json.dumps(header).encode("utf-8")
+        needed = _align(len(MAGIC) + 8 + len(encoded))
+        if needed == data_start:
+            break
+        data_start = needed
+
+    return header, encoded, [data_start + rel for rel in relative]
+
+
+def _column_arrays(columns: MetricColumns) -> List[np.ndarray]:
+    arrays = []
+    for name, kind, dtype in _array_specs():
+        if kind is None:
+            source = columns.days
+        elif kind == "values":
+            source = columns.values[name]
+        else:
+            source = columns.valid[name]
+        arrays.append(np.ascontiguousarray(source, dtype=dtype))
+    return arrays
+
+
+def write_columnar(columns: MetricColumns, path: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Write the metric columns to `path` and return the header that was written."""
+    n = len(columns)
+    header, encoded, offsets = _build_header(n, columns.days[[0, -1]] if n else columns.days, metadata)
+
+    tmp_path = Path(str(path) + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for arr, offset in zip(_column_arrays(columns), offsets):
+            f.seek(offset)
+            f.write(arr.tobytes())
+    tmp_path.replace(path)
+    return header
+
+
+class ColumnarWriter:
+    """
+    Writes a columnar file from batches without holding all rows in memory.
+
+    Each batch is appended to one spill file per array; ``close`` lays out the
+    header and concatenates the spill files into the final file.
+    """
+
+    def __init__(self, path: str, metadata: Optional[Dict[str, Any]] = None):
+        self.path = str(path)
+        self.metadata = metadata or {}
+        self.rows = 0
+        self._first_day: Optional[int] = None
+        self._last_day: Optional[int] = None
+        self._spill_dir = tempfile.mkdtemp(prefix="hcol-", dir=str(Path(self.path).parent))
+        self._spills = [open(os.path.join(self._spill_dir, str(i)), "wb") for i in range(len(_array_specs()))]
+
+    def write(self, columns: MetricColumns) -> None:
+        if len(columns) == 0:
+            return
+        if self._first_day is None:
+            self._first_day = int(columns.days[0])
+        self._last_day = int(columns.days[-1])
+        for spill, arr in zip(self._spills, _column_arrays(columns)):
+            spill.write(arr.tobytes())
+        self.rows += len(columns)
+
+    def abort(self) -> None:
+        """Discard everything written so far."""
+        for spill in self._spills:
+            spill.close()
+        shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def close(self, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if metadata is not None:
+            self.metadata = metadata
+        for spill in self._spills:
+            spill.close()
+        try:
+            days = np.array([self._first_day, self._last_day] if self.rows else [], dtype=np.int32)
+            header, encoded, offsets = _build_header(self.rows, days, self.metadata)
+            tmp_path = Path(self.path + ".tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(MAGIC)
+                f.write(struct.pack("<Q", len(encoded)))
+                f.write(encoded)
+                for spill, offset in zip(self._spills, offsets):
+                    f.seek(offset)
+                    with open(spill.name, "rb") as src:
+                        shutil.copyfileobj(src, f, 1 << 20)
+            tmp_path.replace(self.path)
+            return header
+        finally:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    """Read only the JSON header of a columnar file."""
+    with open(path, "rb") as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            raise ColumnarFormatError(f"Not a columnar health data file: {path}")
+        (length,) = struct.unpack("<Q", prefix[len(MAGIC):])
+        raw = f.read(length)
+    if len(raw) != length:
+        raise ColumnarFormatError(f"Truncated header in {path}")
+    header = json.loads(raw.decode("utf-8"))
+    if header.get("version") != FORMAT_VERSION:
+        raise ColumnarFormatError(f"Unsupported columnar format version {header.get('version')} in {path}")
+    return header
+
+
+def open_columnar(path: str) -> Tuple[MetricColumns, Dict[str, Any]]:
+    """
+    Memory-map a columnar file and return zero-copy, read-only columns.
+
+    Fields present in the current schema but absent from the file are
+    returned as all-missing columns.
+    """
+    header = read_header(path)
+    n = header["rows"]
+    if n == 0:
+        return MetricColumns.empty(), header
+
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if size == 0:
+            raise ColumnarFormatError(f"Empty columnar file: {path}")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def view(entry: Dict[str, Any]) -> np.ndarray:
+        if entry["offset"] + entry["nbytes"] > size:
+            raise ColumnarFormatError(f"Truncated column data in {path}")
+        return np.frombuffer(mm, dtype=np.dtype(entry["dtype"]), count=n, offset=entry["offset"])
+
+    days = view(header["days"])
+    values: Dict[str, np.ndarray] = {}
+    valid: Dict[str, np.ndarray] = {}
+    for field in FIELDS:
+        entry = header["fields"].get(field)
+        if entry is None:
+            values[field] = np.zeros(n, dtype=FIELD_DTYPES[field])
+            valid[field] = np.zeros(n, dtype=bool)
+            continue
+        values[field] = view(entry["values"])
+        valid[field] = view(entry["valid"]).view(bool)
+
+    return MetricColumns(days, values, valid), header
+
+
+def convert_json_to_columnar(json_path: str, out_path: Optional[str] = None) -> str:
+    """Convert a JSON export (list of records or {"records": [...]}) to the columnar format."""
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"records": data}
+
+    out_path = out_path or str(Path(json_path).with_suffix(COLUMNAR_SUFFIX))
+    columns = MetricColumns.from_records(data.get("records", []))
+    write_columnar(columns, out_path, metadata=data.get("metadata"))
+    return out_path
@@ -3,15 +3,15 @@ Correlation Engine
 Discovers correlations between different health metrics.
 """
 
-import json
-import os
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any, Tuple
-from pathlib import Path
-import statistics
+from typing import Optional, List, Dict, Tuple
+import copy
 import uuid
 
+import numpy as np
+
 from models.health_data import CorrelationInsight, MetricType
+from services.metric_store import MetricColumns
+from services.record_store import RecordStore, StoreSnapshot, get_default_store
 
 
 class CorrelationEngine:
@@ -31,67 +31,74 @@ class CorrelationEngine:
         ("stress_score", "sleep_quality", 1),
     ]
     
-    def __init__(self, data_path: Optional[str] = None):
-        self.data_path = data_path or self._get_default_data_path()
+    EMPTY_STATS = (0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    
+    def __init__(self, data_path: Optional[str] = None, store: Optional[RecordStore] = None):
+        self._store = store or (RecordStore(data_path) if data_path else get_default_store())
+        self.data_path = self._store.data_path
         self._correlations: List[CorrelationInsight] = []
-        self._data_cache: Dict[str, Any] = {}
+        # Sufficient statistics per pair: (n, mean_a, mean_b, m2_a, m2_b, co-moment)
+        self._pair_stats: Dict[Tuple[str, str, int], Tuple[float, ...]] = {}
+        self._snapshot: StoreSnapshot = self._store.snapshot
+        self._columns: MetricColumns = self._snapshot.columns
         self._load_data()
         self._calculate_correlations()
     
-    def _get_default_data_path(self) -> str:
-        current_dir = Path(__file__).parent.parent
-        return str(current_dir / "data" / "synthetic_health_data.json")
-    
     def _load_data(self) -> None:
-        try:
-            if os.path.exists(self.data_path):
-                with open(self.data_path, 'r') as f:
-                    self._data_cache = json.load(f)
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            self._data_cache = {"records": []}
-    
-    def _extract_metric_series(self, metric_name: str) -> List[Tuple[str, float]]:
-        records = self._data_cache.get("records", [])
-        series = []
-        
-        for record in records:
-            date = record.get("date")
-            value = None
-            
-            if metric_name == "sleep_duration":
-                value = record.get("sleep", {}).get("duration_hours")
-            elif metric_name == "sleep_quality":
-                value = record.get("sleep", {}).get("quality_score")
-            elif metric_name == "resting_hr":
-                value = record.get("heart_rate", {}).get("resting")
-            elif metric_name == "hrv":
-                value = record.get("heart_rate", {}).get("hrv")
-            elif metric_name == "steps":
-                value = record.get("activity", {}).get("steps")
-            elif metric_name == "stress_score":
-                value = record.get("wellness", {}).get("stress_score")
-            elif metric_name == "energy_level":
-                value = record.get("wellness", {}).get("energy_level")
-            
-            if value is not None:
-                series.append((date, value))
-        
-        return series
+        self._snapshot = self._store.snapshot
+        self._columns = self._snapshot.columns
+    
+    def _extract_metric_series(self, metric_name: str, columns: Optional[MetricColumns] = None, start_row: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (day ordinals, values) for the days on which the metric was recorded."""
+        columns = columns if columns is not None else self._columns
+        values = columns.metric(metric_name)
+        present = ~np.isnan(values)
+        present[:start_row] = False
+        return columns.days[present], values[present]
     
-    def _calculate_pearson(self, x_values: List[float], y_values: List[float]) -> Tuple[float, float]:
+    @staticmethod
+    def _series_stats(x_values: np.ndarray, y_values: np.ndarray) -> Tuple[float, ...]:
         n = len(x_values)
+        if n == 0:
+            return CorrelationEngine.EMPTY_STATS
+        x = np.asarray(x_values, dtype=np.float64)
+        y = np.asarray(y_values, dtype=np.float64)
+        dx = x - x.mean()
+        dy = y - y.mean()
+        return (n, float(x.mean()), float(y.mean()), float(np.dot(dx, dx)), float(np.dot(dy, dy)), float(np.dot(dx, dy)))
+    
+    @staticmethod
+    def _merge_stats(a: Tuple[float, ...], b: Tuple[float, ...]) -> Tuple[float, ...]:
+        """Combine two sets of pair statistics (Chan et al. parallel update)."""
+        n_a, mx_a, my_a, m2x_a, m2y_a, c_a = a
+        n_b, mx_b, my_b, m2x_b, m2y_b, c_b = b
+        if n_a == 0:
+            return b
+        if n_b == 0:
+            return a
+        n = n_a + n_b
+        delta_x = mx_b - mx_a
+        delta_y = my_b - my_a
+        weight = n_a * n_b / n
+        return (
+            n,
+            mx_a + delta_x * n_b / n,
+            my_a + delta_y * n_b / n,
+            m2x_a + m2x_b + delta_x * delta_x * weight,
+            m2y_a + m2y_b + delta_y * delta_y * weight,
+            c_a + c_b + delta_x * delta_y * weight,
+        )
+    
+    def _calculate_pearson(self, stats: Tuple[float, ...]) -> Tuple[float, float]:
+        n, _, _, m2_x, m2_y, co_moment = stats
         
         if n < 10:
             return 0.0, 0.0
         
-        mean_x = statistics.mean(x_values)
-        mean_y = statistics.mean(y_values)
-        
-        covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(x_values, y_values)) / n
+        covariance = co_moment / n
         
-        std_x = statistics.stdev(x_values) if len(x_values) > 1 else 0
-        std_y = statistics.stdev(y_values) if len(y_values) > 1 else 0
+        std_x = float(np.sqrt(m2_x / (n - 1)))
+        std_y = float(np.sqrt(m2_y / (n - 1)))
         
         if std_x == 0 or std_y == 0:
             return 0.0, 0.0
@@ -102,43 +109,64 @@ class CorrelationEngine:
         return correlation, confidence
     
     def _calculate_correlations(self) -> None:
-        self._correlations = []
+        self._pair_stats = {}
         
         for metric_a, metric_b, offset in self.CORRELATION_PAIRS:
             series_a = self._extract_metric_series(metric_a)
             series_b = self._extract_metric_series(metric_b)
-            
-            if not series_a or not series_b:
-                continue
-            
             aligned_a, aligned_b = self._align_series(series_a, series_b, offset)
+            self._pair_stats[(metric_a, metric_b, offset)] = self._series_stats(aligned_a, aligned_b)
+        
+        self._build_insights()
+    
+    def _build_insights(self) -> None:
+        self._correlations = []
+        
+        for metric_a, metric_b, offset in self.CORRELATION_PAIRS:
+            stats = self._pair_stats.get((metric_a, metric_b, offset))
+            sample_size = int(stats[0]) if stats else 0
             
-            if len(aligned_a) < 14:
+            if sample_size < 14:
                 continue
             
-            correlation, confidence = self._calculate_pearson(aligned_a, aligned_b)
+            correlation, confidence = self._calculate_pearson(stats)
             
             if abs(correlation) >= self.MIN_CORRELATION:
-                insight = self._create_insight(metric_a, metric_b, correlation, confidence, len(aligned_a), offset)
+                insight = self._create_insight(metric_a, metric_b, correlation, confidence, sample_size, offset)
                 self._correlations.append(insight)
         
         self._correlations.sort(key=lambda x: abs(x.correlation_coefficient), reverse=True)
     
-    def _align_series(self, series_a: List[Tuple[str, float]], series_b: List[Tuple[str, float]], offset: int) -> Tuple[List[float], List[float]]:
-        dict_b = {date: value for date, value in series_b}
+    def _align_series(self, series_a: Tuple[np.ndarray, np.ndarray], series_b: Tuple[np.ndarray, np.ndarray], offset: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Pair each value of A with the value of B recorded `offset` days later."""
+        days_a, values_a = series_a
+        days_b, values_b = series_b
         
-        aligned_a = []
-        aligned_b = []
+        _, idx_a, idx_b = np.intersect1d(days_a + offset, days_b, return_indices=True)
+        return values_a[idx_a], values_b[idx_b]
+    
+    def apply_append(self, added: int) -> None:
+        """
+        Fold `added` rows appended to the store into the pair statistics.
+        
+        A new pair exists only where its later (B) day is a new row, and its A
+        day is at most the largest offset earlier, so only the tail is read.
+        """
+        previous = len(self._columns)
+        self._load_data()
         
-        for date_a, value_a in series_a:
-            target_date = datetime.strptime(date_a, "%Y-%m-%d") + timedelta(days=offset)
-            target_str = target_date.strftime("%Y-%m-%d")
-            
-            if target_str in dict_b:
-                aligned_a.append(value_a)
-                aligned_b.append(dict_b[target_str])
+        max_offset = max(offset for _, _, offset in self.CORRELATION_PAIRS)
+        tail_start = max(0, previous - max_offset)
+        tail = self._columns.slice(tail_start)
+        
+        for metric_a, metric_b, offset in self.CORRELATION_PAIRS:
+            series_a = self._extract_metric_series(metric_a, tail)
+            series_b = self._extract_metric_series(metric_b, tail, start_row=previous - tail_start)
+            new_stats = self._series_stats(*self._align_series(series_a, series_b, offset))
+            key = (metric_a, metric_b, offset)
+            self._pair_stats[key] = self._merge_stats(self._pair_stats.get(key, self.EMPTY_STATS), new_stats)
         
-        return aligned_a, aligned_b
+        self._build_insights()
     
     def _create_insight(self, metric_a: str, metric_b: str, correlation: float, confidence: float, sample_size: int, offset: int) -> CorrelationInsight:
         display_names = {
@@ -201,4 +229,13 @@ class CorrelationEngine:
     
     def recalculate_correlations(self) -> None:
         self._load_data()
-        self._calculate_correlations()
\ No newline at end of file
+        self._calculate_correlations()
+    
+    def fork(self) -> "CorrelationEngine":
+        """
+        Copy that can be updated (apply_append, recalculate_correlations)
+        while this instance keeps serving readers unchanged.
+        """
+        clone = copy.copy(self)
+        clone._pair_stats = dict(self._pair_stats)
+        return clone
\ No newline at end of file
@@ -188,6 +188,76 @@ def build_training_frame(records: list[dict[str, Any]]) -> pd.DataFrame:
     return df
 
 
+# Training frame column -> columnar store field
+FRAME_FIELDS = {
+    "sleep_hours": "sleep.duration_hours",
+    "sleep_quality": "sleep.quality_score",
+    "steps": "activity.steps",
+    "active_minutes": "activity.active_minutes",
+    "resting_hr": "heart_rate.resting",
+    "hrv": "heart_rate.hrv",
+    "calories_in": "nutrition.calories",
+    "stress": "wellness.stress_score",
+    "energy": "wellness.energy_level",
+}
+
+
+def build_training_frame_from_columns(columns: Any) -> pd.DataFrame:
+    """
+    Build the training frame directly from a columnar metric store.
+
+    Equivalent to build_training_frame on the same records, but each column
+    is a vectorized slice of the store instead of a per-record dict walk.
+
+    Args:
+        columns: services.metric_store.MetricColumns (or anything exposing
+            ``date_strings()``, ``column(field)`` and ``len()``).
+
+    Returns:
+        DataFrame with numeric types and no missing values.
+
+    Raises:
+        TrainingFrameError: If the store is empty or no rows remain after
+            dropping missing values.
+    """
+    if columns is None or len(columns) == 0:
+        raise TrainingFrameError("records list is empty")
+
+    frame: dict[str, Any] = {"date": columns.date_strings()}
+    for col, field in FRAME_FIELDS.items():
+        frame[col] = columns.column(field)
+
+    df = pd.DataFrame(frame)
+    df = df.dropna(subset=list(frame)).copy()
+    if df.empty:
+        raise TrainingFrameError("No rows remaining after dropping missing values")
+
+    return df
+
+
+def append_training_rows(df: pd.DataFrame | None, columns: Any, start_row: int) -> pd.DataFrame:
+    """
+    Extend a training frame with the store rows from `start_row` onwards.
+
+    Only the new rows are converted; their index continues the store's row
+    numbering so it matches a frame built from scratch.
+
+    Raises:
+        TrainingFrameError: If there is no existing frame and the new rows
+            contain no complete day.
+    """
+    try:
+        new_rows = build_training_frame_from_columns(columns.slice(start_row))
+    except TrainingFrameError:
+        if df is None:
+            raise
+        return df
+    new_rows.index += start_row
+    if df is None or df.empty:
+        return new_rows
+    return pd.concat([df, new_rows])
+
+
 # ---------------------------------------------------------------------------
 # Training and simulation
 # ---------------------------------------------------------------------------
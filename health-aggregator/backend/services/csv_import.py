@@ -0,0 +1,271 @@
+"""
+CSV Bulk Import
+Imports wearable CSV exports (Fitbit, Google Fit, sample-level exports) into
+the columnar store.
+
+Files are read in chunks with pandas' C parser. Dates and numbers are parsed
+a whole column at a time, and each chunk is reduced to per-day partial
+aggregates with sorted ``reduceat`` calls, so no Python object is created per
+row and memory stays proportional to the number of days, not rows.
+
+Columns are recognised by their (case-insensitive) header, so one file can be
+a daily summary (one row per day) or raw samples (many rows per day) alike.
+"""
+
+import io
+from typing import Optional, List, Dict, Any, Callable, Tuple, Union
+
+import numpy as np
+
+from services.metric_store import MetricColumns, FIELDS, FIELD_DTYPES, EPOCH_ORDINAL
+
+# pandas is optional, as for the counterfactual engine
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+DEFAULT_CHUNK_ROWS = 200_000
+
+CsvSource = Union[str, io.IOBase]
+ProgressCallback = Callable[[int], None]
+
+
+class CsvImportError(Exception):
+    """Raised when a CSV export cannot be read or has no recognised columns."""
+
+    pass
+
+
+# Date column candidates in order of preference; sleep sessions are keyed on
+# the day they end, as in the Apple Health import
+DATE_COLUMNS = ["date", "end time", "endtime", "timestamp", "datetime", "time", "start time", "starttime"]
+
+# Lower-case header -> [(schema field, aggregation, unit factor)]
+#   sum:  total over the day's rows
+#   mean: average over the day's rows
+#   max:  largest value that day
+#   last: value of the day's last row
+CSV_COLUMNS: Dict[str, List[Tuple[str, str, float]]] = {
+    # Fitbit activities export
+    "steps": [("activity.steps", "sum", 1.0)],
+    "distance": [("activity.distance_km", "sum", 1.0)],
+    "floors": [("activity.floors_climbed", "sum", 1.0)],
+    "calories burned": [("activity.calories_burned", "sum", 1.0)],
+    "minutes fairly active": [("activity.active_minutes", "sum", 1.0)],
+    "minutes very active": [("activity.active_minutes", "sum", 1.0)],
+    # Fitbit sleep export
+    "minutes asleep": [("sleep.duration_hours", "sum", 1 / 60)],
+    "minutes deep sleep": [("sleep.deep_sleep_hours", "sum", 1 / 60)],
+    "minutes rem sleep": [("sleep.rem_sleep_hours", "sum", 1 / 60)],
+    "number of awakenings": [("sleep.wake_ups", "sum", 1.0)],
+    "sleep score": [("sleep.quality_score", "mean", 1.0)],
+    "overall_score": [("sleep.quality_score", "mean", 1.0)],
+    # Fitbit body / food logs
+    "weight": [("weight.weight_kg", "last", 1.0)],
+    "fat": [("weight.body_fat_percent", "last", 1.0)],
+    "calories in": [("nutrition.calories", "sum", 1.0)],
+    "water": [("nutrition.water_ml", "sum", 1.0)],
+    # Google Fit daily summaries
+    "step count": [("activity.steps", "sum", 1.0)],
+    "distance (m)": [("activity.distance_km", "sum", 0.001)],
+    "calories (kcal)": [("activity.calories_burned", "sum", 1.0)],
+    "move minutes count": [("activity.active_minutes", "sum", 1.0)],
+    "average heart rate (bpm)": [("heart_rate.average", "mean", 1.0)],
+    "max heart rate (bpm)": [("heart_rate.max", "max", 1.0)],
+    "average weight (kg)": [("weight.weight_kg", "last", 1.0)],
+    # Sample-level exports (one row per reading)
+    "heart rate": [("heart_rate.average", "mean", 1.0), ("heart_rate.max", "max", 1.0)],
+    "bpm": [("heart_rate.average", "mean", 1.0), ("heart_rate.max", "max", 1.0)],
+    "beats per minute": [("heart_rate.average", "mean", 1.0), ("heart_rate.max", "max", 1.0)],
+    "resting heart rate": [("heart_rate.resting", "mean", 1.0)],
+    "hrv": [("heart_rate.hrv", "mean", 1.0)],
+    "rmssd": [("heart_rate.hrv", "mean", 1.0)],
+}
+
+
+def _parse_days(raw: "pd.Series") -> np.ndarray:
+    """Day ordinals for a column of date/timestamp strings; -1 where unparseable."""
+    text = raw.astype(str)
+    # ISO dates and timestamps share a fixed-width prefix, which parses fast
+    parsed = pd.to_datetime(text.str.slice(0, 10), format="%Y-%m-%d", errors="coerce")
+    if parsed.isna().all():
+        parsed = pd.to_datetime(text, errors="coerce")
+    days = parsed.to_numpy(dtype="datetime64[ns]", na_value=np.datetime64("NaT")).astype("datetime64[D]")
+    ordinals = days.astype(np.int64) + EPOCH_ORDINAL
+    ordinals[np.isnat(days)] = -1
+    return ordinals
+
+
+class _DailyPartials:
+    """Per-day partial aggregates for one field, merged across chunks."""
+
+    def __init__(self, agg: str):
+        self.agg = agg
+        self.days: List[np.ndarray] = []
+        self.totals: List[np.ndarray] = []
+        self.counts: List[np.ndarray] = []
+
+    def add(self, days: np.ndarray, values: np.ndarray) -> None:
+        keep = (days >= 0) & ~np.isnan(values)
+        if not keep.any():
+            return
+        days, values = days[keep], values[keep]
+        order = np.argsort(days, kind="stable")
+        days, values = days[order], values[order]
+        starts = np.flatnonzero(np.append(True, days[1:] != days[:-1]))
+        ends = np.append(starts[1:], len(days))
+        self.days.append(days[starts])
+        self.counts.append(ends - starts)
+        if self.agg == "max":
+            self.totals.append(np.maximum.reduceat(values, starts))
+        elif self.agg == "last":
+            self.totals.append(values[ends - 1])
+        else:
+            self.totals.append(np.add.reduceat(values, starts))
+
+    def reduce(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(sorted unique days, aggregated values) over every chunk added."""
+        if not self.days:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        # Partials combine like the rows themselves (means via their sums)
+        chunk_partials = _DailyPartials(self.agg)
+        days = np.concatenate(self.days)
+        totals = np.concatenate(self.totals)
+        counts = np.concatenate(self.counts).astype(np.float64)
+        chunk_partials.add(days, totals)
+        unique_days = chunk_partials.days[0]
+        result = chunk_partials.totals[0]
+        if self.agg == "mean":
+            counts_partials = _DailyPartials("sum")
+            counts_partials.add(days, counts)
+            result = result / counts_partials.totals[0]
+        return unique_days, result
+
+
+def _resolve_columns(header: List[str]) -> Tuple[str, Dict[str, List[Tuple[str, str, float]]]]:
+    by_name = {h.strip().lower(): h for h in header}
+    date_column = next((by_name[c] for c in DATE_COLUMNS if c in by_name), None)
+    if date_column is None:
+        raise CsvImportError(f"No date column found (expected one of: {', '.join(DATE_COLUMNS)})")
+    targets = {by_name[name]: CSV_COLUMNS[name] for name in by_name if name in CSV_COLUMNS}
+    if not targets:
+        raise CsvImportError(f"No recognised metric columns in header: {', '.join(header)}")
+    return date_column, targets
+
+
+def _build_columns(partials: Dict[str, _DailyPartials]) -> MetricColumns:
+    reduced = {field: p.reduce() for field, p in partials.items()}
+    all_days = [days for days, _ in reduced.values() if len(days)]
+    if not all_days:
+        return MetricColumns.empty()
+    days = np.unique(np.concatenate(all_days))
+    values: Dict[str, np.ndarray] = {}
+    valid: Dict[str, np.ndarray] = {}
+    for f in FIELDS:
+        values[f] = np.zeros(len(days), dtype=FIELD_DTYPES[f])
+        valid[f] = np.zeros(len(days), dtype=bool)
+        if f not in reduced:
+            continue
+        field_days, field_values = reduced[f]
+        rows = np.searchsorted(days, field_days)
+        if FIELD_DTYPES[f].kind == "i":
+            field_values = np.rint(field_values)
+        values[f][rows] = field_values
+        valid[f][rows] = True
+    return MetricColumns(days.astype(np.int32), values, valid)
+
+
+def _plain(value: Any) -> Any:
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _rejected_rows(
+    chunk: "pd.DataFrame",
+    first_row: int,
+    date_column: str,
+    columns: List[str],
+    bad_date: np.ndarray,
+    bad_cells: Dict[str, np.ndarray],
+) -> List[Tuple[Dict[str, Any], List[str]]]:
+    """(row as read, reasons) for each rejected row of a chunk."""
+    rejected = bad_date.copy()
+    for bad in bad_cells.values():
+        rejected |= bad
+    result = []
+    for i in np.flatnonzero(rejected).tolist():
+        row = chunk.iloc[i]
+        record = {"row": first_row + i + 1, date_column: _plain(row[date_column])}
+        record.update({c: _plain(row[c]) for c in columns if not pd.isna(row[c])})
+        reasons = ([f"{date_column}: not a date"] if bad_date[i] else []) + [
+            f"{c}: not a number" for c, bad in bad_cells.items() if bad[i]
+        ]
+        result.append((record, reasons))
+    return result
+
+
+def import_csv(
+    source: CsvSource,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    progress: Optional[ProgressCallback] = None,
+    rejects: Optional[List[Tuple[Dict[str, Any], List[str]]]] = None,
+) -> Tuple[MetricColumns, Dict[str, Any]]:
+    """
+    Aggregate one CSV export into daily columns.
+
+    `source` is a path or a file object. Returns (columns, stats) where stats
+    holds the rows read, the rows rejected, the non-empty cells that were not
+    numbers and the columns that were used. A row is rejected, and none of
+    its cells imported, when its date or any recognised cell does not parse;
+    each is appended to `rejects` as (row as read, reasons) when given.
+    `progress(rows_read)` is called after each chunk.
+    """
+    if pd is None:
+        raise CsvImportError("CSV import requires pandas")
+
+    try:
+        reader = pd.read_csv(source, chunksize=chunk_rows, thousands=",", skipinitialspace=True)
+    except (OSError, ValueError) as e:
+        raise CsvImportError(f"Could not read CSV: {e}") from e
+
+    partials: Dict[str, _DailyPartials] = {}
+    rows = rejected = invalid_cells = 0
+    date_column = None
+    targets: Dict[str, List[Tuple[str, str, float]]] = {}
+    try:
+        for chunk in reader:
+            if date_column is None:
+                date_column, targets = _resolve_columns(list(chunk.columns))
+            days = _parse_days(chunk[date_column])
+            bad_date = days < 0
+            numbers: Dict[str, np.ndarray] = {}
+            bad_cells: Dict[str, np.ndarray] = {}
+            for column in targets:
+                raw = chunk[column]
+                numbers[column] = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+                # Empty cells read as missing; anything else that is NaN now did not parse
+                bad = raw.notna().to_numpy() & np.isnan(numbers[column])
+                if bad.any():
+                    bad_cells[column] = bad
+                    invalid_cells += int(bad.sum())
+            if bad_cells or bad_date.any():
+                if rejects is not None:
+                    rejects.extend(_rejected_rows(chunk, rows, date_column, list(targets), bad_date, bad_cells))
+                days = days.copy()
+                for bad in bad_cells.values():
+                    days[bad] = -1
+            rows += len(chunk)
+            rejected += int((days < 0).sum())
+            for column, column_targets in targets.items():
+                for field, agg, factor in column_targets:
+                    if field not in partials:
+                        partials[field] = _DailyPartials(agg)
+                    partials[field].add(days, numbers[column] * factor)
+            if progress:
+                progress(rows)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise CsvImportError(f"Invalid CSV: {e}") from e
+
+    stats = {"rows": rows, "rejected": rejected, "invalid_cells": invalid_cells, "columns": sorted(targets)}
+    return _build_columns(partials), stats
@@ -3,43 +3,193 @@ Data Ingestion Service
 Handles loading, normalizing, and serving health data.
 """
 
-import json
-import os
-from datetime import datetime, date, timedelta
-from typing import Optional, List, Dict, Any
-from pathlib import Path
+import copy
+from datetime import datetime, date
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
 
 from models.health_data import HealthMetrics, TrendSummary, MetricType
+from services.metric_store import MetricColumns, FIELD_DTYPES, ANALYSIS_FIELDS, resolve_fields
+from services.csv_import import import_csv, CsvSource, DEFAULT_CHUNK_ROWS
+from services.record_store import RecordStore, StoreSnapshot, RefreshResult, RELOADED, get_default_store
+from services.rollups import compare_windows, aggregate_buckets, percentile_buckets, RollupError
+from services.quantile_sketch import QuantileSketch
+from services.source_merge import SourceMerger, SourcePriority, DEFAULT_SOURCE, SOURCES_SUFFIX
+from services.record_validation import validate_records, validate_columns, Quarantine, QUARANTINE_SUFFIX
+
+
+class HistoryQueryError(ValueError):
+    """Raised for an invalid history range, cursor or page size."""
+    
+    pass
 
 
 class DataIngestionService:
     """Service for ingesting and normalizing health data."""
     
-    def __init__(self, data_path: Optional[str] = None):
-        self.data_path = data_path or self._get_default_data_path()
-        self._data_cache: Dict[str, Any] = {}
+    # (metric type, column, "stable" band in percent) for trend summaries
+    TREND_METRICS = [
+        (MetricType.SLEEP, "sleep.duration_hours", 2),
+        (MetricType.STEPS, "activity.steps", 5),
+        (MetricType.HEART_RATE, "heart_rate.resting", 3),
+    ]
+    
+    def __init__(
+        self,
+        data_path: Optional[str] = None,
+        store: Optional[RecordStore] = None,
+        source_priority: Optional[SourcePriority] = None,
+    ):
+        self._store = store or (RecordStore(data_path) if data_path else get_default_store())
+        self.data_path = self._store.data_path
+        self._snapshot: StoreSnapshot = self._store.snapshot
+        self._columns: MetricColumns = self._snapshot.columns
+        # With a SQLite-backed store, cohort queries across users run as SQL;
+        # this user's reads are served from the snapshot like any other store
+        self._sql = self._store.sqlite
+        # Per-source rows synced so far (kept on disk), for resolving multi-device syncs
+        self._merger = SourceMerger(source_priority, self.data_path + SOURCES_SUFFIX)
+        # Records that fail validation are kept here instead of in the store
+        self.quarantine = Quarantine(self.data_path + QUARANTINE_SUFFIX)
         self._load_data()
     
-    def _get_default_data_path(self) -> str:
-        current_dir = Path(__file__).parent.parent
-        return str(current_dir / "data" / "synthetic_health_data.json")
+    @property
+    def store(self) -> RecordStore:
+        return self._store
     
     def _load_data(self) -> None:
-        try:
-            if os.path.exists(self.data_path):
-                with open(self.data_path, 'r') as f:
-                    self._data_cache = json.load(f)
-            else:
-                self._data_cache = {"records": []}
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            self._data_cache = {"records": []}
-    
-    def refresh_data(self) -> None:
+        self._snapshot = self._store.snapshot
+        self._columns = self._snapshot.columns
+    
+    def fork(self) -> "DataIngestionService":
+        """
+        Copy that can take writes (append, sync, import, refresh) while this
+        instance keeps serving the snapshot it holds. The source merger and
+        quarantine are shared: they are write-side state.
+        """
+        return copy.copy(self)
+    
+    @property
+    def snapshot(self) -> StoreSnapshot:
+        return self._snapshot
+    
+    def refresh_data(self, force: bool = False) -> RefreshResult:
+        """
+        Pick up changes to the data files. Unless `force`d, nothing is re-read
+        when the files are unchanged (see RecordStore.refresh).
+        """
+        if force:
+            result = RefreshResult(RELOADED, self._store.reload())
+        else:
+            result = self._store.refresh()
+        self._load_data()
+        return result
+    
+    def append_records(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Validate daily records and append the valid ones to the shared store.
+        
+        Invalid records are quarantined first, so they are kept even when
+        the append fails. Returns the validation summary, whose "accepted"
+        count is the number of rows appended.
+        """
+        columns, accepted, rejected, summary, reasons = validate_records(records)
+        self._quarantine(records, rejected, reasons, "append")
+        valid_records = [records[i] for i in accepted.tolist()] if len(rejected) else records
+        self._store.append(valid_records, columns)
         self._load_data()
+        return summary
+    
+    def sync_sources(self, records: List[Dict[str, Any]], source: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Merge daily records synced from several devices or apps into the store.
+        
+        Each record names its origin in a "source" key (default `source`).
+        Records may arrive in any order and repeat days; where sources
+        disagree on a day, the per-field source priority decides. Invalid
+        records are quarantined.
+        """
+        columns, accepted, rejected, summary, reasons = validate_records(records)
+        grouped: Dict[str, List[int]] = {}
+        for row, i in enumerate(accepted.tolist()):
+            name = str(records[i].get("source") or source or DEFAULT_SOURCE)
+            grouped.setdefault(name, []).append(row)
+        batches = {name: columns.take(np.array(rows)) for name, rows in grouped.items()}
+        self._quarantine(records, rejected, reasons, "sync")
+        result = self._merge_sources(batches)
+        return {**result, "validation": summary}
+    
+    def get_quarantine(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The most recently quarantined records with their rejection reasons."""
+        return self.quarantine.recent(limit)
+    
+    def _quarantine(self, records: List[Any], rejected: np.ndarray, reasons: List[List[str]], origin: str) -> None:
+        if len(rejected):
+            self.quarantine.add([records[i] for i in rejected.tolist()], reasons, origin)
+    
+    def _merge_sources(self, batches: Dict[str, MetricColumns]) -> Dict[str, Any]:
+        resolved, report, synced = self._merger.resolve(batches)
+        self._store.merge(resolved)
+        # Recorded only once stored, so the merger never runs ahead of the store
+        self._merger.commit(synced)
+        self._load_data()
+        dates = resolved.date_strings()
+        return {
+            **report,
+            "start_date": str(dates[0]) if len(dates) else None,
+            "end_date": str(dates[-1]) if len(dates) else None,
+        }
+    
+    def import_csv(
+        self,
+        sources: List[CsvSource],
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        source_name: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Bulk-import wearable CSV exports and merge them into the shared store.
+        
+        Each file is aggregated to daily values on its own; where files (or
+        the store) overlap, later files win for the fields they carry. With a
+        `source_name`, the files are merged as that source's sync instead, so
+        the per-field source priority applies. Rows with an unparseable date
+        or cell, and days failing validation, are quarantined.
+        """
+        imported = MetricColumns.empty()
+        files = []
+        for source in sources:
+            rejects: List[Tuple[Dict[str, Any], List[str]]] = []
+            columns, stats = import_csv(source, chunk_rows=chunk_rows, rejects=rejects)
+            # Rows whose date or cells did not parse, quarantined before anything is stored
+            self.quarantine.add([row for row, _ in rejects], [errors for _, errors in rejects], "csv")
+            imported = imported.merge(columns)
+            files.append({**stats, "days": len(columns)})
+        
+        rejected, validation, reasons = validate_columns(imported)
+        if len(rejected):
+            self._quarantine(imported.take(rejected).to_records(), np.arange(len(rejected)), reasons, "csv")
+            keep = np.ones(len(imported), dtype=bool)
+            keep[rejected] = False
+            imported = imported.take(keep)
+        
+        if source_name is None:
+            self._store.merge(imported)
+            self._load_data()
+        else:
+            self._merge_sources({source_name: imported})
+        dates = imported.date_strings()
+        return {
+            "files": files,
+            "rows": sum(f["rows"] for f in files),
+            "days": len(imported),
+            "start_date": str(dates[0]) if len(dates) else None,
+            "end_date": str(dates[-1]) if len(dates) else None,
+            "validation": validation,
+        }
     
     def get_latest_metrics(self) -> HealthMetrics:
-        records = self._data_cache.get("records", [])
+        records = self._snapshot.get_records(-1)
         
         if not records:
             return HealthMetrics(
@@ -51,32 +201,108 @@ class DataIngestionService:
         
         latest = records[-1]
         
+        def value(group: str, field: str, default: Any = 0) -> Any:
+            # Sources such as Apple Health leave some fields empty (None)
+            found = (latest.get(group) or {}).get(field)
+            return default if found is None else found
+        
         return HealthMetrics(
             date=datetime.strptime(latest["date"], "%Y-%m-%d").date(),
-            sleep_hours=latest.get("sleep", {}).get("duration_hours", 0),
-            sleep_quality=latest.get("sleep", {}).get("quality_score", 0),
-            resting_heart_rate=latest.get("heart_rate", {}).get("resting", 0),
-            hrv=latest.get("heart_rate", {}).get("hrv", 0),
-            steps=latest.get("activity", {}).get("steps", 0),
-            active_minutes=latest.get("activity", {}).get("active_minutes", 0),
-            calories_consumed=latest.get("nutrition", {}).get("calories", 0),
-            calories_burned=latest.get("activity", {}).get("calories_burned", 0),
-            weight_kg=latest.get("weight", {}).get("weight_kg"),
-            stress_level=latest.get("wellness", {}).get("stress_score", 50),
-            energy_level=latest.get("wellness", {}).get("energy_level", 50)
+            sleep_hours=value("sleep", "duration_hours"),
+            sleep_quality=value("sleep", "quality_score"),
+            resting_heart_rate=value("heart_rate", "resting"),
+            hrv=value("heart_rate", "hrv"),
+            steps=value("activity", "steps"),
+            active_minutes=value("activity", "active_minutes"),
+            calories_consumed=value("nutrition", "calories"),
+            calories_burned=value("activity", "calories_burned"),
+            weight_kg=value("weight", "weight_kg", None),
+            stress_level=value("wellness", "stress_score", 50),
+            energy_level=value("wellness", "energy_level", 50)
         )
     
-    def get_metrics_history(self, days: int = 30, metric_type: Optional[str] = None) -> List[Dict[str, Any]]:
-        records = self._data_cache.get("records", [])
-        
-        if len(records) > days:
-            records = records[-days:]
+    def get_metrics_history(
+        self,
+        days: int = 30,
+        metric_type: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        selected = self._resolve_fields(fields)
+        start = -days if len(self._snapshot) > days else None
+        records = self._get_records(self._snapshot, start, None, selected)
         
         if metric_type:
             return self._extract_metric_type(records, metric_type)
         
         return records
     
+    def get_metrics_range(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        metric_type: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Records dated start..end (inclusive), oldest first, in pages of `limit`,
+        optionally projected onto `fields`.
+        
+        Rows are located by binary search on the sorted day column, so a page
+        costs O(log n + limit). `next_cursor` is the date of the first row of
+        the next page (None on the last page); passing it back as `cursor`
+        continues from there, and stays valid if records are appended.
+        """
+        if limit is not None and limit <= 0:
+            raise HistoryQueryError("limit must be positive")
+        if cursor is not None:
+            try:
+                cursor_day = date.fromisoformat(cursor)
+            except ValueError:
+                raise HistoryQueryError(f"Invalid cursor {cursor!r}")
+            start = max(start, cursor_day) if start else cursor_day
+        if start and end and start > end:
+            raise HistoryQueryError("start must not be after end")
+        
+        selected = self._resolve_fields(fields)
+        next_cursor = None
+        snapshot = self._snapshot
+        lo, hi = snapshot.row_range(start, end)
+        stop = min(hi, lo + limit) if limit is not None else hi
+        records = self._get_records(snapshot, lo, stop, selected)
+        if stop < hi:
+            next_cursor = date.fromordinal(int(snapshot.columns.days[stop])).isoformat()
+        
+        if metric_type:
+            records = self._extract_metric_type(records, metric_type)
+        return {"data": records, "next_cursor": next_cursor}
+    
+    def _get_records(
+        self,
+        snapshot: StoreSnapshot,
+        start: Optional[int],
+        stop: Optional[int],
+        fields: Optional[List[str]],
+    ) -> List[Dict[str, Any]]:
+        """Rows start:stop, projected onto resolved `fields` straight from the columns if given."""
+        if fields is None:
+            return snapshot.get_records(start, stop)
+        start, stop, _ = slice(start, stop).indices(len(snapshot))
+        return snapshot.columns.to_records(start, stop, fields=fields)
+    
+    @staticmethod
+    def _resolve_fields(fields: Optional[List[str]]) -> Optional[List[str]]:
+        if fields is None:
+            return None
+        try:
+            selected = resolve_fields(fields)
+        except KeyError as e:
+            raise HistoryQueryError(f"Unknown field {e.args[0]!r}")
+        if not selected:
+            raise HistoryQueryError("fields must name at least one field")
+        return selected
+    
     def _extract_metric_type(self, records: List[Dict], metric_type: str) -> List[Dict[str, Any]]:
         result = []
         
@@ -100,54 +326,114 @@ class DataIngestionService:
         
         return result
     
-    def get_trend_summary(self) -> List[TrendSummary]:
-        records = self._data_cache.get("records", [])
-        
-        if len(records) < 14:
+    def get_trend_summary(self, window: int = 7) -> List[TrendSummary]:
+        """Mean of the last `window` records against the `window` before them."""
+        rollups = self._snapshot.rollups
+        n = len(rollups)
+        if n < 2 * window:
             return []
         
-        recent = records[-7:]
-        previous = records[-14:-7]
-        
         trends = []
         
-        # Sleep trend
-        recent_sleep = sum(r.get("sleep", {}).get("duration_hours", 0) for r in recent) / 7
-        prev_sleep = sum(r.get("sleep", {}).get("duration_hours", 0) for r in previous) / 7
-        if prev_sleep > 0:
-            change = ((recent_sleep - prev_sleep) / prev_sleep) * 100
-            trends.append(TrendSummary(
-                metric_type=MetricType.SLEEP,
-                direction="up" if change > 2 else "down" if change < -2 else "stable",
-                change_percent=round(change, 1),
-                period_days=7
-            ))
-        
-        # Steps trend
-        recent_steps = sum(r.get("activity", {}).get("steps", 0) for r in recent) / 7
-        prev_steps = sum(r.get("activity", {}).get("steps", 0) for r in previous) / 7
-        if prev_steps > 0:
-            change = ((recent_steps - prev_steps) / prev_steps) * 100
-            trends.append(TrendSummary(
-                metric_type=MetricType.STEPS,
-                direction="up" if change > 5 else "down" if change < -5 else "stable",
-                change_percent=round(change, 1),
-                period_days=7
-            ))
-        
-        # Heart rate trend
-        recent_hr = sum(r.get("heart_rate", {}).get("resting", 0) for r in recent) / 7
-        prev_hr = sum(r.get("heart_rate", {}).get("resting", 0) for r in previous) / 7
-        if prev_hr > 0:
-            change = ((recent_hr - prev_hr) / prev_hr) * 100
-            trends.append(TrendSummary(
-                metric_type=MetricType.HEART_RATE,
-                direction="up" if change > 3 else "down" if change < -3 else "stable",
-                change_percent=round(change, 1),
-                period_days=7
-            ))
+        for metric_type, field, band in self.TREND_METRICS:
+            # Prefix sums: each window is two lookups; missing values count as 0
+            prev_avg = rollups.window(field, n - 2 * window, n - window)[0] / window
+            recent_avg = rollups.window(field, n - window, n)[0] / window
+            if prev_avg > 0:
+                change = float((recent_avg - prev_avg) / prev_avg * 100)
+                trends.append(TrendSummary(
+                    metric_type=metric_type,
+                    direction="up" if change > band else "down" if change < -band else "stable",
+                    change_percent=round(change, 1),
+                    period_days=window
+                ))
         
         return trends
     
+    def get_trends(self, window: str = "7", fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Every field's (or the selected `fields`') mean over the last `window`
+        days against the `window` days before, or this calendar month against
+        the last with window="month". Averages skip days without a value.
+        """
+        selected = self._resolve_fields(fields)
+        bands = {field: band for _, field, band in self.TREND_METRICS}
+        try:
+            return compare_windows(self._snapshot.rollups, window, selected, bands)
+        except RollupError as e:
+            raise HistoryQueryError(str(e))
+    
+    def get_aggregate(
+        self,
+        metric: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        bucket: str = "all",
+        agg: str = "mean",
+    ) -> Dict[str, Any]:
+        """
+        `agg` (sum, mean, min, max or count) of one metric per calendar
+        bucket (day, week, month, year or all) over start..end. `metric` is
+        a field name ("activity.steps") or an analysis name ("steps").
+        """
+        field = ANALYSIS_FIELDS.get(metric, metric)
+        if field not in FIELD_DTYPES:
+            raise HistoryQueryError(f"Unknown metric {metric!r}")
+        try:
+            buckets = aggregate_buckets(self._snapshot.rollups, field, start, end, bucket, agg)
+        except RollupError as e:
+            raise HistoryQueryError(str(e))
+        return {"metric": field, "agg": agg, "bucket": bucket, "buckets": buckets}
+    
+    def get_percentiles(
+        self,
+        metric: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        bucket: str = "all",
+        percentiles: Optional[List[float]] = None,
+        cohort: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Percentiles of one metric per calendar bucket over start..end, from
+        the monthly quantile digests. With `cohort` (SQLite stores only) the
+        digests of every user in the database are merged instead.
+        """
+        field = ANALYSIS_FIELDS.get(metric, metric)
+        if field not in FIELD_DTYPES:
+            raise HistoryQueryError(f"Unknown metric {metric!r}")
+        percentiles = percentiles or [10, 50, 90]
+        result: Dict[str, Any] = {"metric": field, "bucket": bucket, "cohort": cohort}
+        try:
+            if not cohort:
+                result["buckets"] = percentile_buckets(self._snapshot.rollups, field, start, end, bucket, percentiles)
+                return result
+        except RollupError as e:
+            raise HistoryQueryError(str(e))
+        
+        if self._sql is None:
+            raise HistoryQueryError("Cohort percentiles need a SQLite store")
+        if bucket != "all":
+            raise HistoryQueryError("Cohort percentiles support bucket=all only")
+        if any(not 0 <= p <= 100 for p in percentiles):
+            raise HistoryQueryError("percentiles must be between 0 and 100")
+        # One digest per user, built batch by batch, then merged across users
+        users: Dict[str, QuantileSketch] = {}
+        for user_id, values in self._sql.iter_values(field, start, end):
+            users[user_id] = users[user_id].add(values) if user_id in users else QuantileSketch.from_values(values)
+        sketch = QuantileSketch.merge_all(users.values())
+        values = sketch.quantiles([p / 100 for p in percentiles]).tolist()
+        result["users"] = len(users)
+        result["buckets"] = [{
+            "start": start.isoformat() if start else None,
+            "end": end.isoformat() if end else None,
+            "count": sketch.count,
+            "percentiles": {f"p{p:g}": None if np.isnan(v) else round(v, 2) for p, v in zip(percentiles, values)},
+        }]
+        return result
+    
     def get_records_for_analysis(self) -> List[Dict[str, Any]]:
-        return self._data_cache.get("records", [])
\ No newline at end of file
+        return self._snapshot.records
+    
+    def get_columns(self) -> MetricColumns:
+        return self._columns
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Intraday Store
+Minute-level samples (heart rate, steps, ...) kept apart from the daily
+records.
+
+Samples are stored per metric in day chunks: sorted seconds-since-midnight
+and float32 value arrays, plus precomputed 5-minute, hourly and daily rollups
+(min, max, sum, count). Each chunk is one ``.npz`` file under
+``<root>/<metric>/<YYYY-MM-DD>.npz``; the arrays in it are read lazily, so a
+query served from a rollup never loads the raw samples. At most
+MAX_LOADED_CHUNKS chunks keep their arrays in memory; the least recently
+used ones drop them and reload from disk when queried again.
+
+Timestamps are local wall-clock time, which is what days are keyed on
+throughout the app.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from services.metric_store import EPOCH_ORDINAL
+
+
+INTRADAY_METRICS = ("heart_rate", "steps", "hrv", "calories")
+
+# Rollup bucket widths in seconds, finest first
+ROLLUP_SECONDS = (300, 3600, 86400)
+
+SECONDS_PER_DAY = 86400
+
+# Auto resolution aims for at most this many points per response
+MAX_POINTS = 1000
+
+# Metric-days whose arrays stay loaded; older ones are reloaded from disk on use
+MAX_LOADED_CHUNKS = 512
+
+
+class IntradayError(ValueError):
+    """Raised for unknown metrics or malformed sample batches."""
+
+    pass
+
+
+class _Rollup:
+    """Bucketed aggregates for one day at one width."""
+
+    __slots__ = ("start", "min", "max", "sum", "count")
+
+    def __init__(self, start: np.ndarray, min_: np.ndarray, max_: np.ndarray, sum_: np.ndarray, count: np.ndarray):
+        self.start = start
+        self.min = min_
+        self.max = max_
+        self.sum = sum_
+        self.count = count
+
+    @classmethod
+    def build(cls, seconds: np.ndarray, values: np.ndarray, width: int) -> "_Rollup":
+        buckets = seconds // width
+        starts = np.flatnonzero(np.append(True, buckets[1:] != buckets[:-1]))
+        ends = np.append(starts[1:], len(seconds))
+        values = values.astype(np.float64)
+        return cls(
+            (buckets[starts] * width).astype(np.int32),
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            np.add.reduceat(values, starts),
+            (ends - starts).astype(np.int32),
+        )
+
+    def arrays(self, width: int) -> Dict[str, np.ndarray]:
+        return {f"r{width}_{name}": getattr(self, name) for name in self.__slots__}
+
+
+class _DayChunk:
+    """One metric-day: raw samples and rollups, loaded from disk on first use."""
+
+    def __init__(self, day: int, path: str):
+        self.day = day
+        self.path = path
+        self._raw: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._rollups: Dict[int, _Rollup] = {}
+
+    @classmethod
+    def build(cls, day: int, path: str, seconds: np.ndarray, values: np.ndarray) -> "_DayChunk":
+        chunk = cls(day, path)
+        chunk._raw = (seconds, values)
+        chunk._rollups = {w: _Rollup.build(seconds, values, w) for w in ROLLUP_SECONDS}
+        return chunk
+
+    def raw(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Read into locals: another thread may unload the chunk meanwhile
+        raw = self._raw
+        if raw is None:
+            with np.load(self.path) as f:
+                raw = self._raw = (f["seconds"], f["values"])
+        return raw
+
+    def rollup(self, width: int) -> _Rollup:
+        rollups = self._rollups
+        rollup = rollups.get(width)
+        if rollup is None:
+            with np.load(self.path) as f:
+                rollup = rollups[width] = _Rollup(*(f[f"r{width}_{name}"] for name in _Rollup.__slots__))
+        return rollup
+
+    def unload(self) -> None:
+        """Drop the loaded arrays; they are read from disk again on next use."""
+        self._raw = None
+        self._rollups = {}
+
+    def save(self) -> None:
+        seconds, values = self.raw()
+        arrays: Dict[str, np.ndarray] = {"seconds": seconds, "values": values}
+        for width in ROLLUP_SECONDS:
+            arrays.update(self.rollup(width).arrays(width))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self.path)
+
+
+def parse_timestamps(raw: List[Any]) -> np.ndarray:
+    """Epoch seconds (int64) from ISO strings or numeric epoch seconds."""
+    # Exact types: True / False are not epoch seconds
+    if raw and all(type(t) in (int, float) for t in raw):
+        try:
+            seconds = np.asarray(raw, dtype=np.float64)
+        except OverflowError:
+            seconds = np.full(1, np.inf)
+        if not np.isfinite(seconds).all() or (np.abs(seconds) >= 2 ** 62).any():
+            raise IntradayError("Invalid timestamp: epoch seconds out of range")
+        return seconds.astype(np.int64)
+    if any(type(t) is bool for t in raw):
+        raise IntradayError("Invalid timestamp: expected ISO strings or epoch seconds, got a boolean")
+    try:
+        # Offsets are dropped: the wall-clock time is what gets stored
+        return np.array([str(t)[:19] for t in raw], dtype="datetime64[s]").astype(np.int64)
+    except ValueError as e:
+        raise IntradayError(f"Invalid timestamp: {e}") from e
+
+
+def resolution_for(span_seconds: int, resolution: Optional[int] = None) -> int:
+    """
+    Bucket width to serve: the coarsest rollup no wider than `resolution`,
+    or 0 for raw samples. Without a resolution, the finest rollup that
+    splits the span into at most MAX_POINTS buckets (raw samples when the
+    span has at most MAX_POINTS seconds); spans over MAX_POINTS days get
+    daily buckets.
+    """
+    if resolution is None:
+        if span_seconds <= MAX_POINTS:
+            return 0
+        widths = [w for w in ROLLUP_SECONDS if w * MAX_POINTS >= span_seconds]
+        return widths[0] if widths else ROLLUP_SECONDS[-1]
+    widths = [w for w in ROLLUP_SECONDS if w <= resolution]
+    return widths[-1] if widths else 0
+
+
+class IntradayStore:
+    """Per-metric, day-chunked intraday samples with precomputed rollups."""
+
+    def __init__(self, root: Optional[str] = None, max_loaded: int = MAX_LOADED_CHUNKS):
+        self.root = root or self._get_default_root()
+        self._lock = threading.Lock()
+        # metric -> {day ordinal -> chunk}; replaced, never mutated, on write
+        self._chunks: Dict[str, Dict[int, _DayChunk]] = {}
+        # metric -> sorted day ordinals
+        self._index: Dict[str, np.ndarray] = {}
+        # Chunks holding loaded arrays, least recently used first
+        self._max_loaded = max_loaded
+        self._loaded: "OrderedDict[Tuple[str, int], _DayChunk]" = OrderedDict()
+        self._loaded_lock = threading.Lock()
+        self._scan()
+
+    def _get_default_root(self) -> str:
+        env_path = os.environ.get("HEALTH_INTRADAY_PATH")
+        if env_path:
+            return env_path
+        current_dir = Path(__file__).parent.parent
+        return str(current_dir / "data" / "intraday")
+
+    def _chunk_path(self, metric: str, day: int) -> str:
+        return os.path.join(self.root, metric, date.fromordinal(day).isoformat() + ".npz")
+
+    def _scan(self) -> None:
+        for metric in INTRADAY_METRICS:
+            directory = os.path.join(self.root, metric)
+            chunks: Dict[int, _DayChunk] = {}
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if not name.endswith(".npz"):
+                        continue
+                    try:
+                        day = date.fromisoformat(name[:-4]).toordinal()
+                    except ValueError:
+                        continue
+                    chunks[day] = _DayChunk(day, os.path.join(directory, name))
+            self._chunks[metric] = chunks
+            self._index[metric] = np.array(sorted(chunks), dtype=np.int64)
+
+    def _touch(self, metric: str, chunks: List[_DayChunk]) -> None:
+        """Mark chunks as just used, unloading the least recently used beyond the bound."""
+        with self._loaded_lock:
+            for chunk in chunks:
+                key = (metric, chunk.day)
+                self._loaded[key] = chunk
+                self._loaded.move_to_end(key)
+            while len(self._loaded) > self._max_loaded:
+                _, chunk = self._loaded.popitem(last=False)
+                chunk.unload()
+
+    def _check_metric(self, metric: str) -> None:
+        if metric not in INTRADAY_METRICS:
+            raise IntradayError(f"Unknown intraday metric {metric!r} (expected one of: {', '.join(INTRADAY_METRICS)})")
+
+    def add_samples(self, metric: str, timestamps: np.ndarray, values: np.ndarray) -> int:
+        """
+        Store samples (epoch seconds, values) and rebuild the touched days' rollups.
+
+        A sample at the same second as a stored one replaces it. Returns the
+        number of samples accepted (non-finite values are dropped).
+        """
+        self._check_metric(metric)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if timestamps.shape != values.shape:
+            raise IntradayError("timestamps and values must have the same length")
+        keep = np.isfinite(values)
+        timestamps, values = timestamps[keep], values[keep]
+        if len(timestamps) == 0:
+            return 0
+
+        days = timestamps // SECONDS_PER_DAY + EPOCH_ORDINAL
+        order = np.argsort(days, kind="stable")
+        days, timestamps, values = days[order], timestamps[order], values[order]
+        starts = np.flatnonzero(np.append(True, days[1:] != days[:-1]))
+        ends = np.append(starts[1:], len(days))
+
+        with self._lock:
+            chunks = dict(self._chunks[metric])
+            written = []
+            for lo, hi in zip(starts, ends):
+                day = int(days[lo])
+                seconds = (timestamps[lo:hi] % SECONDS_PER_DAY).astype(np.int32)
+                day_values = values[lo:hi].astype(np.float32)
+                if day in chunks:
+                    old_seconds, old_values = chunks[day].raw()
+                    seconds = np.concatenate([old_seconds, seconds])
+                    day_values = np.concatenate([old_values, day_values])
+                # Sort by time; on equal seconds the later sample wins
+                by_time = np.argsort(seconds, kind="stable")
+                seconds, day_values = seconds[by_time], day_values[by_time]
+                last = np.append(seconds[1:] != seconds[:-1], True)
+                chunk = _DayChunk.build(day, self._chunk_path(metric, day), seconds[last], day_values[last])
+                chunk.save()
+                chunks[day] = chunk
+                written.append(chunk)
+            self._chunks[metric] = chunks
+            self._index[metric] = np.array(sorted(chunks), dtype=np.int64)
+        self._touch(metric, written)
+        return len(timestamps)
+
+    def day_range(self, metric: str) -> Tuple[Optional[date], Optional[date]]:
+        """First and last day with samples for a metric."""
+        self._check_metric(metric)
+        index = self._index[metric]
+        if len(index) == 0:
+            return None, None
+        return date.fromordinal(int(index[0])), date.fromordinal(int(index[-1]))
+
+    def query(self, metric: str, start: date, end: date, resolution: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Samples for the days start..end (inclusive) at the coarsest rollup no
+        wider than `resolution` seconds (raw samples below 5 minutes), or
+        without a resolution at most MAX_POINTS buckets (see resolution_for).
+        """
+        self._check_metric(metric)
+        # Index first: writers publish chunks before the index that lists them
+        index = self._index[metric]
+        chunks = self._chunks[metric]
+        lo = np.searchsorted(index, start.toordinal(), side="left")
+        hi = np.searchsorted(index, end.toordinal(), side="right")
+        days = index[lo:hi]
+
+        span = ((end - start).days + 1) * SECONDS_PER_DAY
+        width = resolution_for(span, resolution)
+        result: Dict[str, Any] = {"metric": metric, "resolution": width, "source": "raw" if width == 0 else "rollup"}
+
+        def stamps(day: int, seconds: np.ndarray) -> np.ndarray:
+            return (day - EPOCH_ORDINAL) * SECONDS_PER_DAY + seconds.astype(np.int64)
+
+        # Marked as used once read, so a long range cannot unload its own chunks mid-query
+        used = [chunks[int(day)] for day in days]
+        if width == 0:
+            parts = [chunks[int(day)].raw() + (int(day),) for day in days]
+            seconds = np.concatenate([stamps(day, s) for s, _, day in parts]) if parts else np.zeros(0, dtype=np.int64)
+            values = np.concatenate([v for _, v, _ in parts]) if parts else np.zeros(0)
+            result["timestamps"] = seconds.astype("datetime64[s]").astype(str).tolist()
+            result["values"] = np.round(values.astype(np.float64), 2).tolist()
+            self._touch(metric, used)
+            return result
+
+        rollups = [(int(day), chunks[int(day)].rollup(width)) for day in days]
+        if rollups:
+            starts = np.concatenate([stamps(day, r.start) for day, r in rollups])
+            count = np.concatenate([r.count for _, r in rollups])
+            total = np.concatenate([r.sum for _, r in rollups])
+            low = np.concatenate([r.min for _, r in rollups])
+            high = np.concatenate([r.max for _, r in rollups])
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+            count = np.zeros(0, dtype=np.int32)
+            total = low = high = np.zeros(0)
+        result["timestamps"] = starts.astype("datetime64[s]").astype(str).tolist()
+        result["min"] = np.round(low, 2).tolist()
+        result["max"] = np.round(high, 2).tolist()
+        result["mean"] = np.round(total / np.maximum(count, 1), 2).tolist()
+        result["sum"] = np.round(total, 2).tolist()
+        result["count"] = count.tolist()
+        self._touch(metric, used)
+        return result
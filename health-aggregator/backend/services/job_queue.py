@@ -0,0 +1,180 @@
+"""
+Job Queue
+Runs slow maintenance work (data refreshes) on a background thread and
+tracks it as jobs that clients poll by id.
+
+At most one job runs and at most one waits. A submission arriving while a
+job is waiting joins that job instead of queueing another, so any number of
+concurrent requests cost one follow-up run after the current one. A job
+that is already running is never joined: it may have read the data before
+the change the new request is about.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable
+
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Finished jobs kept for status polling; older ones are forgotten
+MAX_FINISHED_JOBS = 100
+
+
+class JobNotFoundError(Exception):
+    """Raised for an unknown (or long finished and forgotten) job id."""
+
+    pass
+
+
+def merge_flags(pending: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Default parameter merge for joined submissions: any truthy value wins."""
+    merged = dict(pending)
+    for key, value in new.items():
+        merged[key] = merged.get(key) or value
+    return merged
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+class Job:
+    """One unit of queued work and its timings."""
+
+    __slots__ = ("id", "kind", "params", "status", "requests", "created_at", "started_at", "finished_at", "result", "error")
+
+    def __init__(self, kind: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = QUEUED
+        self.requests = 1
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        started = self.started_at if self.started_at is not None else now
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "requests": self.requests,
+            "created_at": _iso(self.created_at),
+            "started_at": _iso(self.started_at),
+            "finished_at": _iso(self.finished_at),
+            "queued_ms": round((started - self.created_at) * 1000, 1),
+            "run_ms": round(((self.finished_at or now) - self.started_at) * 1000, 1) if self.started_at is not None else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Serial background runner for one kind of job.
+
+    `run(params)` does the work on the queue's thread and returns the job
+    result; an exception marks the job failed with its message. `merge`
+    combines the parameters of a waiting job with those of a submission
+    joining it (by default flags are OR-ed, so a forced refresh joining a
+    plain one makes the run forced).
+    """
+
+    def __init__(
+        self,
+        run: Callable[[Dict[str, Any]], Any],
+        kind: str = "job",
+        merge: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]] = merge_flags,
+        max_finished: int = MAX_FINISHED_JOBS,
+    ):
+        self._run = run
+        self.kind = kind
+        self._merge = merge
+        self._max_finished = max_finished
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._pending: Optional[Job] = None
+        self._running: Optional[Job] = None
+        self._worker: Optional[threading.Thread] = None
+        self._changed = threading.Condition()
+
+    def submit(self, **params: Any) -> Dict[str, Any]:
+        """Queue a run (or join the waiting one); returns the job's status."""
+        with self._changed:
+            job = self._pending
+            if job is not None:
+                job.params = self._merge(job.params, params)
+                job.requests += 1
+            else:
+                job = self._pending = Job(self.kind, params)
+                self._jobs[job.id] = job
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name=f"{self.kind}-jobs", daemon=True)
+                self._worker.start()
+            return job.to_dict()
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise JobNotFoundError(f"Unknown job: {job_id}")
+            return job.to_dict()
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Block until the job has finished (or `timeout` seconds pass)."""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise JobNotFoundError(f"Unknown job: {job_id}")
+            self._changed.wait_for(lambda: job.done, timeout)
+            return job.to_dict()
+
+    @property
+    def active(self) -> Optional[Dict[str, Any]]:
+        """Status of the running job, else of the waiting one, else None."""
+        with self._changed:
+            job = self._running or self._pending
+            return job.to_dict() if job is not None else None
+
+    def _work(self) -> None:
+        while True:
+            with self._changed:
+                job = self._pending
+                if job is None:
+                    self._worker = None
+                    return
+                self._pending = None
+                self._running = job
+                job.status = RUNNING
+                job.started_at = time.time()
+                params = dict(job.params)
+            try:
+                result, status, error = self._run(params), SUCCEEDED, None
+            except Exception as e:
+                result, status, error = None, FAILED, str(e) or type(e).__name__
+            with self._changed:
+                job.result, job.status, job.error = result, status, error
+                job.finished_at = time.time()
+                self._running = None
+                self._forget_old()
+                self._changed.notify_all()
+
+    def _forget_old(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
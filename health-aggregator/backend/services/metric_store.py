@@ -0,0 +1,454 @@
+"""
+Columnar Metric Store
+Struct-of-arrays representation of the daily health records.
+
+Each metric is held in one typed NumPy array plus a boolean validity mask,
+alongside an int32 day-ordinal column, so baselines, trends, correlations and
+the ML training frame are computed with vectorized slices instead of walking
+nested record dicts.
+
+Rows appended to read-only (memory-mapped) columns go to a separate tail
+buffer; a field's file and tail rows are joined into one array only when
+that field is read, so memory grows with the fields actually used.
+"""
+
+import threading
+from collections.abc import Mapping
+from datetime import date
+from typing import Optional, List, Dict, Any, Iterable, Tuple, Callable, Iterator, Union
+
+import numpy as np
+
+
+# (group, field, dtype, decimals). Floats are stored as float32 and rounded
+# back to `decimals` when decoded, which reproduces the source values exactly
+# at half the footprint of float64.
+FIELD_SCHEMA: List[Tuple[str, str, str, int]] = [
+    ("sleep", "duration_hours", "float32", 1),
+    ("sleep", "quality_score", "int32", 0),
+    ("sleep", "deep_sleep_hours", "float32", 1),
+    ("sleep", "rem_sleep_hours", "float32", 1),
+    ("sleep", "time_to_sleep_minutes", "int32", 0),
+    ("sleep", "wake_ups", "int32", 0),
+    ("heart_rate", "resting", "int32", 0),
+    ("heart_rate", "average", "int32", 0),
+    ("heart_rate", "max", "int32", 0),
+    ("heart_rate", "hrv", "float32", 1),
+    ("activity", "steps", "int32", 0),
+    ("activity", "active_minutes", "int32", 0),
+    ("activity", "calories_burned", "int32", 0),
+    ("activity", "distance_km", "float32", 1),
+    ("activity", "floors_climbed", "int32", 0),
+    ("nutrition", "calories", "int32", 0),
+    ("nutrition", "protein_g", "float32", 1),
+    ("nutrition", "carbs_g", "float32", 1),
+    ("nutrition", "fat_g", "float32", 1),
+    ("nutrition", "water_ml", "int32", 0),
+    ("nutrition", "sugar_g", "float32", 1),
+    ("nutrition", "fiber_g", "float32", 1),
+    ("weight", "weight_kg", "float32", 1),
+    ("weight", "body_fat_percent", "float32", 1),
+    ("wellness", "stress_score", "int32", 0),
+    ("wellness", "energy_level", "int32", 0),
+    ("wellness", "mood_score", "int32", 0),
+]
+
+FIELDS: List[str] = [f"{group}.{field}" for group, field, _, _ in FIELD_SCHEMA]
+FIELD_DTYPES: Dict[str, np.dtype] = {f"{g}.{f}": np.dtype(t) for g, f, t, _ in FIELD_SCHEMA}
+FIELD_DECIMALS: Dict[str, int] = {f"{g}.{f}": d for g, f, _, d in FIELD_SCHEMA}
+GROUPS: List[str] = list(dict.fromkeys(group for group, _, _, _ in FIELD_SCHEMA))
+
+# Short metric names used by the analysis services
+ANALYSIS_FIELDS: Dict[str, str] = {
+    "sleep_duration": "sleep.duration_hours",
+    "sleep_quality": "sleep.quality_score",
+    "resting_hr": "heart_rate.resting",
+    "hrv": "heart_rate.hrv",
+    "steps": "activity.steps",
+    "stress_score": "wellness.stress_score",
+    "energy_level": "wellness.energy_level",
+}
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def ordinals_to_strings(days: np.ndarray) -> np.ndarray:
+    """Convert day ordinals to ISO date strings ("YYYY-MM-DD")."""
+    return (np.asarray(days, dtype=np.int64) - EPOCH_ORDINAL).astype("datetime64[D]").astype(str)
+
+
+def strings_to_ordinals(dates: Iterable[str]) -> np.ndarray:
+    """Convert ISO date strings to int32 day ordinals."""
+    parsed = np.array(list(dates), dtype="datetime64[D]")
+    return (parsed.astype(np.int64) + EPOCH_ORDINAL).astype(np.int32)
+
+
+def to_typed(raw: List[Any], dtype: np.dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert raw values (None = missing) to a `dtype` column and its valid mask."""
+    n = len(raw)
+    valid = np.fromiter((v is not None for v in raw), dtype=bool, count=n)
+    try:
+        values = np.array([0 if v is None else v for v in raw], dtype=np.float64)
+    except (TypeError, ValueError):
+        values = np.zeros(n, dtype=np.float64)
+        for i, v in enumerate(raw):
+            try:
+                values[i] = float(v)
+            except (TypeError, ValueError):
+                valid[i] = False
+    valid &= np.isfinite(values)
+    values[~valid] = 0
+    if dtype.kind == "i":
+        values = np.rint(values)
+    return values.astype(dtype), valid
+
+
+class _ColumnBuffer:
+    """Geometrically grown backing arrays shared by successive appended views."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self.days = np.zeros(capacity, dtype=np.int32)
+        self.values = {f: np.zeros(capacity, dtype=FIELD_DTYPES[f]) for f in FIELDS}
+        self.valid = {f: np.zeros(capacity, dtype=bool) for f in FIELDS}
+
+    def write(self, start: int, columns: "MetricColumns") -> None:
+        stop = start + len(columns)
+        self.days[start:stop] = columns.days
+        for f in FIELDS:
+            self.values[f][start:stop] = columns.values[f]
+            self.valid[f][start:stop] = columns.valid[f]
+        self.size = stop
+
+    def view(self, n: int) -> "MetricColumns":
+        return MetricColumns(
+            self.days[:n],
+            {f: a[:n] for f, a in self.values.items()},
+            {f: m[:n] for f, m in self.valid.items()},
+            buffer=self,
+        )
+
+
+class _LazyFields(Mapping):
+    """Field -> array mapping whose arrays are produced on first access."""
+
+    def __init__(self, load: Callable[[str], np.ndarray]):
+        self._load = load
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        array = self._arrays.get(field)
+        if array is None:
+            if field not in FIELD_DTYPES:
+                raise KeyError(field)
+            array = self._arrays[field] = self._load(field)
+        return array
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FIELDS)
+
+    def __len__(self) -> int:
+        return len(FIELDS)
+
+
+def _map_fields(fields: Mapping, fn: Callable[[np.ndarray], np.ndarray]) -> Mapping:
+    """fn applied to every field's array; deferred per field for lazy mappings."""
+    if isinstance(fields, _LazyFields):
+        return _LazyFields(lambda f: fn(fields[f]))
+    return {f: fn(a) for f, a in fields.items()}
+
+
+class _TailBuffer:
+    """
+    Rows appended to read-only columns (a memory-mapped file), kept apart
+    from them: the file's arrays are never copied as a whole. Appended rows
+    go to `tail`; a field's base + tail array is assembled the first time
+    it is read and then only extended, like _ColumnBuffer. Views only ever
+    read their own prefix of the joined arrays, which is never rewritten.
+    """
+
+    def __init__(self, base: "MetricColumns", tail: _ColumnBuffer, days: np.ndarray, size: int):
+        self.base = base
+        self.tail = tail
+        # Day ordinals of base + tail rows (every reader needs them)
+        self.days = days
+        self.size = size
+        # field -> (values, valid, rows filled) of the joined arrays
+        self._joined: Dict[str, Tuple[np.ndarray, np.ndarray, int]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, base: "MetricColumns", rows: int) -> "_TailBuffer":
+        """Empty tail over `base`, with room for `rows` appended rows."""
+        n = len(base)
+        days = np.zeros(max(2 * (n + rows), 64), dtype=np.int32)
+        days[:n] = base.days
+        return cls(base, _ColumnBuffer(max(2 * rows, 64)), days, n)
+
+    def prefix(self, n: int, rows: int) -> "_TailBuffer":
+        """New tail buffer holding our first n rows, with room for `rows` more."""
+        tail_rows = n - len(self.base)
+        copy = _TailBuffer.start(self.base, tail_rows + rows)
+        copy.days[:n] = self.days[:n]
+        copy.tail.write(0, self.tail.view(tail_rows))
+        copy.size = n
+        return copy
+
+    def write(self, columns: "MetricColumns") -> None:
+        n, k = self.size, len(columns)
+        tail_rows = n - len(self.base)
+        if tail_rows + k > self.tail.capacity:
+            tail = _ColumnBuffer(max(2 * (tail_rows + k), 64))
+            tail.write(0, self.tail.view(tail_rows))
+            self.tail = tail
+        self.tail.write(tail_rows, columns)
+        if n + k > len(self.days):
+            days = np.zeros(max(2 * (n + k), 64), dtype=np.int32)
+            days[:n] = self.days[:n]
+            self.days = days
+        self.days[n:n + k] = columns.days
+        self.size = n + k
+
+    def field(self, field: str, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(values, valid) of the first n rows of a field, joined on first read."""
+        nb = len(self.base)
+        with self._lock:
+            joined = self._joined.get(field)
+            if joined is None or len(joined[0]) < n:
+                capacity = max(len(self.days), n)
+                values = np.empty(capacity, dtype=FIELD_DTYPES[field])
+                valid = np.empty(capacity, dtype=bool)
+                if joined is None:
+                    values[:nb], valid[:nb], filled = self.base.values[field], self.base.valid[field], nb
+                else:
+                    filled = joined[2]
+                    values[:filled], valid[:filled] = joined[0][:filled], joined[1][:filled]
+                joined = (values, valid, filled)
+            values, valid, filled = joined
+            if filled < n:
+                values[filled:n] = self.tail.values[field][filled - nb:n - nb]
+                valid[filled:n] = self.tail.valid[field][filled - nb:n - nb]
+                filled = n
+            self._joined[field] = (values, valid, filled)
+        return values[:n], valid[:n]
+
+    def view(self, n: int) -> "MetricColumns":
+        return MetricColumns(
+            self.days[:n],
+            _LazyFields(lambda f: self.field(f, n)[0]),
+            _LazyFields(lambda f: self.field(f, n)[1]),
+            buffer=self,
+        )
+
+
+class MetricColumns:
+    """Struct-of-arrays store: day ordinals plus one typed array and mask per field."""
+
+    def __init__(
+        self,
+        days: np.ndarray,
+        values: Mapping,
+        valid: Mapping,
+        buffer: Optional[Union[_ColumnBuffer, _TailBuffer]] = None,
+    ):
+        self.days = days
+        self.values = values
+        self.valid = valid
+        self._buffer = buffer
+
+    @classmethod
+    def empty(cls) -> "MetricColumns":
+        return cls(
+            np.zeros(0, dtype=np.int32),
+            {f: np.zeros(0, dtype=FIELD_DTYPES[f]) for f in FIELDS},
+            {f: np.zeros(0, dtype=bool) for f in FIELDS},
+        )
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "MetricColumns":
+        """Build the columns from nested record dicts in a single pass per group."""
+        if not records:
+            return cls.empty()
+
+        days = strings_to_ordinals(r["date"] for r in records)
+        values: Dict[str, np.ndarray] = {}
+        valid: Dict[str, np.ndarray] = {}
+        for group in GROUPS:
+            sub = [r.get(group) or {} for r in records]
+            for g, field, _, _ in FIELD_SCHEMA:
+                if g != group:
+                    continue
+                name = f"{g}.{field}"
+                values[name], valid[name] = to_typed([s.get(field) for s in sub], FIELD_DTYPES[name])
+        return cls(days, values, valid)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    @property
+    def nbytes(self) -> int:
+        return int(
+            self.days.nbytes
+            + sum(a.nbytes for a in self.values.values())
+            + sum(m.nbytes for m in self.valid.values())
+        )
+
+    def append(self, other: "MetricColumns") -> "MetricColumns":
+        """
+        Return new columns with `other`'s rows appended.
+
+        Rows are written into the spare capacity of a shared buffer that grows
+        geometrically, so appends cost amortized O(len(other)). Existing views
+        (older snapshots) only ever see their own prefix, which is never
+        rewritten; a view that is no longer the buffer's tip gets a fresh copy.
+        Read-only (memory-mapped) columns are not copied: the rows go to a
+        tail buffer next to them (see _TailBuffer).
+        """
+        n, k = len(self), len(other)
+        buffer = self._buffer
+        if isinstance(buffer, _TailBuffer):
+            if buffer.size != n:
+                buffer = buffer.prefix(n, k)
+            buffer.write(other)
+            return buffer.view(n + k)
+        if buffer is None and n and not self.days.flags.writeable:
+            buffer = _TailBuffer.start(self, k)
+            buffer.write(other)
+            return buffer.view(n + k)
+        if buffer is None or buffer.size != n or n + k > buffer.capacity:
+            buffer = _ColumnBuffer(max(2 * (n + k), 64))
+            buffer.write(0, self)
+        buffer.write(n, other)
+        return buffer.view(n + k)
+
+    def take(self, rows: np.ndarray) -> "MetricColumns":
+        """Copy of the given rows (an index array or boolean mask)."""
+        return MetricColumns(
+            self.days[rows],
+            _map_fields(self.values, lambda a: a[rows]),
+            _map_fields(self.valid, lambda m: m[rows]),
+        )
+
+    def merge(self, other: "MetricColumns") -> "MetricColumns":
+        """
+        Return the union of both stores by day, with `other`'s valid values
+        replacing ours on days present in both.
+
+        `other` may be unsorted and repeat days (the last occurrence wins).
+        When every day in `other` is after our tail this is a plain append.
+        """
+        if len(other) == 0:
+            return self
+        order = np.argsort(other.days, kind="stable")
+        sorted_days = other.days[order]
+        last = np.append(sorted_days[1:] != sorted_days[:-1], True)
+        other = other.take(order[last])
+        if len(self) == 0 or other.days[0] > self.days[-1]:
+            return self.append(other)
+
+        days = np.union1d(self.days, other.days).astype(np.int32)
+        ours = np.searchsorted(days, self.days)
+        theirs = np.searchsorted(days, other.days)
+        values: Dict[str, np.ndarray] = {}
+        valid: Dict[str, np.ndarray] = {}
+        for f in FIELDS:
+            values[f] = np.zeros(len(days), dtype=FIELD_DTYPES[f])
+            valid[f] = np.zeros(len(days), dtype=bool)
+            values[f][ours] = self.values[f]
+            valid[f][ours] = self.valid[f]
+            mask = other.valid[f]
+            values[f][theirs[mask]] = other.values[f][mask]
+            valid[f][theirs[mask]] = True
+        return MetricColumns(days, values, valid)
+
+    def starts_with(self, other: "MetricColumns") -> bool:
+        """True when our first len(other) rows are exactly `other`'s rows."""
+        n = len(other)
+        if n > len(self) or not np.array_equal(self.days[:n], other.days):
+            return False
+        return all(
+            np.array_equal(self.valid[f][:n], other.valid[f]) and np.array_equal(self.values[f][:n], other.values[f])
+            for f in FIELDS
+        )
+
+    def column(self, field: str, fill: float = np.nan) -> np.ndarray:
+        """Decoded float64 values for a field with missing entries set to `fill`."""
+        values = self.values[field].astype(np.float64)
+        decimals = FIELD_DECIMALS[field]
+        if decimals:
+            values = np.round(values, decimals)
+        mask = self.valid[field]
+        if not mask.all():
+            values[~mask] = fill
+        return values
+
+    def metric(self, name: str, fill: float = np.nan) -> np.ndarray:
+        """Decoded values for an analysis metric name (e.g. "resting_hr")."""
+        return self.column(ANALYSIS_FIELDS[name], fill=fill)
+
+    def date_strings(self) -> np.ndarray:
+        return ordinals_to_strings(self.days)
+
+    def slice(self, start: Optional[int] = None, stop: Optional[int] = None) -> "MetricColumns":
+        """Zero-copy row slice."""
+        s = slice(start, stop)
+        return MetricColumns(
+            self.days[s],
+            _map_fields(self.values, lambda a: a[s]),
+            _map_fields(self.valid, lambda m: m[s]),
+        )
+
+    def to_records(
+        self,
+        start: Optional[int] = None,
+        stop: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Materialize rows back into the nested record dict schema.
+
+        With `fields` (dotted names, see resolve_fields) only those columns are
+        decoded and emitted, still nested by group.
+        """
+        part = self.slice(start, stop)
+        dates = part.date_strings().tolist()
+        selected = FIELDS if fields is None else fields
+        decoded = {}
+        for f in selected:
+            col = part.column(f)
+            if FIELD_DTYPES[f].kind == "i":
+                items = part.values[f].tolist()
+            else:
+                items = col.tolist()
+            mask = part.valid[f].tolist()
+            decoded[f] = [v if ok else None for v, ok in zip(items, mask)]
+
+        layout = [(f.split(".", 1)[0], f.split(".", 1)[1], decoded[f]) for f in selected]
+        records = []
+        for i, day in enumerate(dates):
+            record: Dict[str, Any] = {"date": day}
+            for group, field, items in layout:
+                record.setdefault(group, {})[field] = items[i]
+            records.append(record)
+        return records
+
+
+def resolve_fields(names: Iterable[str]) -> List[str]:
+    """
+    Expand a projection list into schema field names, in schema order.
+
+    Accepts dotted field names ("sleep.duration_hours") and group names
+    ("sleep", meaning every field of the group). Raises KeyError for
+    anything else.
+    """
+    wanted = set()
+    for name in names:
+        name = name.strip()
+        if name in FIELD_DTYPES:
+            wanted.add(name)
+        elif name in GROUPS:
+            wanted.update(f for f in FIELDS if f.startswith(name + "."))
+        elif name:
+            raise KeyError(name)
+    return [f for f in FIELDS if f in wanted]
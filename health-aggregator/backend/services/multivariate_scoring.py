@@ -0,0 +1,185 @@
+"""
+Multivariate Scoring
+Mahalanobis distance of each day's metrics from the baseline mean, so a day
+that is mildly off on several correlated metrics together (HR up, HRV, sleep
+down, stress up) is flagged even when no single z-score crosses a threshold.
+
+The baseline covariance is fitted once per baseline version and its inverse
+cached per pattern of present metrics (a day missing a metric is scored
+against the marginal covariance of the others). Days are scored in batches:
+one matrix product per pattern. Each day's squared distance splits exactly
+into per-metric terms d_j * (S^-1 d)_j, reported as contributions.
+"""
+
+import math
+from statistics import NormalDist
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from services.anomaly_engine import escalate, run_lengths
+
+
+# Baseline days with every metric present needed to fit the covariance
+MIN_COMPLETE_DAYS = 14
+
+# Weight moved from the sample covariance to its diagonal, which keeps the
+# estimate invertible with few days or near-duplicate metrics
+SHRINKAGE = 0.1
+
+# A day needs this many present metrics to be scored
+MIN_SCORED_METRICS = 2
+
+
+def chi2_thresholds(z_thresholds: Tuple[float, ...], dims: int) -> np.ndarray:
+    """
+    Squared-distance thresholds for `dims` metrics with the same tail
+    probabilities as the two-sided univariate z thresholds
+    (Wilson-Hilferty approximation of the chi-square quantiles).
+    """
+    tails = [math.erfc(z / math.sqrt(2)) for z in z_thresholds]
+    quantiles = np.array([NormalDist().inv_cdf(1 - p) for p in tails])
+    spread = 2 / (9 * dims)
+    return dims * (1 - spread + quantiles * math.sqrt(spread)) ** 3
+
+
+class CovarianceBaseline:
+    """Baseline mean vector and covariance, with inverses cached per present-metric pattern."""
+
+    def __init__(self, version: int, means: np.ndarray, covariance: np.ndarray):
+        self.version = version
+        self.means = means
+        self.covariance = covariance
+        self._inverses: Dict[bytes, np.ndarray] = {}
+
+    @classmethod
+    def fit(cls, values: np.ndarray, version: int) -> Optional["CovarianceBaseline"]:
+        """Fit on the complete days of a days x metrics matrix (NaN = missing); None if too few."""
+        complete = values[~np.isnan(values).any(axis=1)]
+        if len(complete) < MIN_COMPLETE_DAYS:
+            return None
+        covariance = np.cov(complete, rowvar=False, ddof=1)
+        covariance = (1 - SHRINKAGE) * covariance + SHRINKAGE * np.diag(np.diag(covariance))
+        return cls(version, complete.mean(axis=0), covariance)
+
+    def inverse(self, present: np.ndarray) -> np.ndarray:
+        """Inverse of the covariance of the `present` metrics (a boolean mask)."""
+        key = present.tobytes()
+        inverse = self._inverses.get(key)
+        if inverse is None:
+            # pinv: a metric constant over the baseline has zero variance
+            inverse = np.linalg.pinv(self.covariance[np.ix_(present, present)])
+            self._inverses[key] = inverse
+        return inverse
+
+    def score(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (squared distances, contributions, present counts) for a days x
+        metrics matrix. Contributions (days x metrics) sum to the squared
+        distance; missing metrics contribute 0. Days with fewer than
+        MIN_SCORED_METRICS present metrics get NaN distances.
+        """
+        n, m = values.shape
+        present = ~np.isnan(values)
+        deviations = np.where(present, values - self.means, 0.0)
+        contributions = np.zeros((n, m))
+        patterns, groups = np.unique(present, axis=0, return_inverse=True)
+        for g, pattern in enumerate(patterns):
+            if pattern.sum() < MIN_SCORED_METRICS:
+                continue
+            rows = np.flatnonzero(groups.ravel() == g)
+            d = deviations[np.ix_(rows, pattern)]
+            contributions[np.ix_(rows, pattern)] = d * (d @ self.inverse(pattern))
+        counts = present.sum(axis=1)
+        distances = np.where(counts >= MIN_SCORED_METRICS, contributions.sum(axis=1), np.nan)
+        return distances, contributions, counts
+
+
+class MultivariateDetection:
+    """
+    Days flagged by Mahalanobis distance as parallel arrays, newest first:
+    distance (not squared), severity code, consecutive flagged days and the
+    days x metrics contributions to the squared distance. `run` is the
+    flagged-day run at the end of the scan.
+    """
+
+    __slots__ = ("rows", "distances", "severity", "consecutive", "contributions", "run")
+
+    def __init__(
+        self,
+        rows: np.ndarray,
+        distances: np.ndarray,
+        severity: np.ndarray,
+        consecutive: np.ndarray,
+        contributions: np.ndarray,
+        run: np.ndarray,
+    ):
+        self.rows = rows
+        self.distances = distances
+        self.severity = severity
+        self.consecutive = consecutive
+        self.contributions = contributions
+        self.run = run
+
+    @classmethod
+    def empty(cls, metrics: int) -> "MultivariateDetection":
+        none = np.zeros(0, dtype=np.int64)
+        return cls(none, np.zeros(0), np.zeros(0, dtype=np.int8), none, np.zeros((0, metrics)), np.zeros(1, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def take(self, index: np.ndarray) -> "MultivariateDetection":
+        return MultivariateDetection(
+            self.rows[index], self.distances[index], self.severity[index],
+            self.consecutive[index], self.contributions[index], self.run,
+        )
+
+    def prepend(self, newer: "MultivariateDetection") -> "MultivariateDetection":
+        """`newer` (from rows after ours) followed by our entries, with its run."""
+        return MultivariateDetection(
+            np.concatenate([newer.rows, self.rows]),
+            np.concatenate([newer.distances, self.distances]),
+            np.concatenate([newer.severity, self.severity]),
+            np.concatenate([newer.consecutive, self.consecutive]),
+            np.concatenate([newer.contributions, self.contributions]),
+            newer.run,
+        )
+
+
+def scan_multivariate(
+    values: np.ndarray,
+    baseline: CovarianceBaseline,
+    z_thresholds: Tuple[float, float, float],
+    initial_run: Optional[np.ndarray] = None,
+    first_row: int = 0,
+    report_from: int = 0,
+) -> MultivariateDetection:
+    """
+    Flag days of a days x metrics matrix (NaN = missing) whose squared
+    Mahalanobis distance passes the chi-square equivalents of the
+    univariate thresholds for its number of present metrics. Runs and
+    escalation follow the univariate scan: an unflagged scored day ends a
+    run, an unscored day does not. Rows before `report_from` only count
+    towards the run, as in the univariate scan.
+    """
+    m = values.shape[1]
+    distances, contributions, counts = baseline.score(values)
+    # thresholds[k] for k present metrics
+    thresholds = np.array([chi2_thresholds(z_thresholds, max(k, 1)) for k in range(m + 1)])
+    scored = ~np.isnan(distances)
+    codes = np.zeros(len(values), dtype=np.int8)
+    for level in range(len(z_thresholds)):
+        codes[scored & (distances >= thresholds[counts, level])] = level + 1
+    hit = codes > 0
+    initial = np.zeros(1, dtype=np.int64) if initial_run is None else initial_run
+    runs, run = run_lengths(hit[:, None], (scored & ~hit)[:, None], initial)
+    rows = np.flatnonzero(hit[report_from:])[::-1] + report_from
+    return MultivariateDetection(
+        rows + first_row,
+        np.sqrt(distances[rows]),
+        escalate(codes[rows], runs[rows, 0]),
+        runs[rows, 0],
+        contributions[rows],
+        run,
+    )
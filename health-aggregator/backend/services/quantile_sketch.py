@@ -0,0 +1,167 @@
+"""
+Quantile Sketches
+Mergeable t-digests for percentile queries (p10 / p50 / p90 of a metric over
+any period, or over a cohort of users) without sorting the full history.
+
+A digest is a short sorted list of centroids (mean, weight). Centroids near
+the median may absorb many values while those in the tails stay small, which
+keeps tail percentiles accurate. Digests merge by pooling their centroids and
+compressing once, so monthly digests combine into any period and per-user
+digests into a cohort. Up to `compression` values are kept exactly, so a
+month of daily values is never approximated on its own.
+"""
+
+from typing import Optional, List, Iterable
+
+import numpy as np
+
+from services.metric_store import MetricColumns, EPOCH_ORDINAL
+
+
+DEFAULT_COMPRESSION = 200
+
+
+class QuantileSketch:
+    """A merging t-digest: centroid means and weights, plus min / max."""
+
+    __slots__ = ("compression", "means", "weights", "min", "max")
+
+    def __init__(
+        self,
+        means: Optional[np.ndarray] = None,
+        weights: Optional[np.ndarray] = None,
+        compression: int = DEFAULT_COMPRESSION,
+    ):
+        self.compression = compression
+        self.means = np.zeros(0) if means is None else means
+        self.weights = np.zeros(0) if weights is None else weights
+        self.min = float(self.means[0]) if len(self.means) else np.nan
+        self.max = float(self.means[-1]) if len(self.means) else np.nan
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, compression: int = DEFAULT_COMPRESSION) -> "QuantileSketch":
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        return cls._compressed(values, np.ones(len(values)), compression, values)
+
+    @classmethod
+    def merge_all(cls, sketches: Iterable["QuantileSketch"], compression: int = DEFAULT_COMPRESSION) -> "QuantileSketch":
+        """One digest for the union of the sketches' values."""
+        sketches = [s for s in sketches if s.count]
+        if not sketches:
+            return cls(compression=compression)
+        means = np.concatenate([s.means for s in sketches])
+        weights = np.concatenate([s.weights for s in sketches])
+        extremes = np.array([v for s in sketches for v in (s.min, s.max)])
+        return cls._compressed(means, weights, compression, extremes)
+
+    @classmethod
+    def _compressed(cls, means: np.ndarray, weights: np.ndarray, compression: int, extremes: np.ndarray) -> "QuantileSketch":
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        if len(means) > compression:
+            # Group centroids by unit steps of the k1 scale function; the
+            # arcsin makes steps narrow in q at the tails and wide at the median
+            total = weights.sum()
+            q = (np.cumsum(weights) - weights / 2) / total
+            k = np.floor(compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+            starts = np.flatnonzero(np.append(True, k[1:] != k[:-1]))
+            merged_weights = np.add.reduceat(weights, starts)
+            means = np.add.reduceat(means * weights, starts) / merged_weights
+            weights = merged_weights
+        sketch = cls(means, weights, compression)
+        if len(extremes):
+            sketch.min, sketch.max = float(extremes.min()), float(extremes.max())
+        return sketch
+
+    @property
+    def count(self) -> int:
+        return int(round(self.weights.sum()))
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        return QuantileSketch.merge_all([self, other], self.compression)
+
+    def add(self, values: np.ndarray) -> "QuantileSketch":
+        """New digest with `values` folded in (digests are never modified)."""
+        return self.merge(QuantileSketch.from_values(values, self.compression))
+
+    def quantiles(self, qs: Iterable[float]) -> np.ndarray:
+        """
+        Values at quantiles `qs` (0..1), interpolating between centroid
+        midpoints; exact (Hazen definition) while values are kept singly.
+        """
+        qs = np.asarray(list(qs), dtype=np.float64)
+        if not len(self.means):
+            return np.full(len(qs), np.nan)
+        total = self.weights.sum()
+        positions = np.cumsum(self.weights) - self.weights / 2
+        xp = np.concatenate([[0.0], positions, [total]])
+        fp = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(qs * total, xp, fp)
+
+
+def _month_numbers(days: np.ndarray) -> np.ndarray:
+    return (days.astype(np.int64) - EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+class MonthlySketches:
+    """
+    One digest per calendar month of a field's values, with each month's
+    first row, so a row range is answered by merging the months it covers.
+
+    Used as a MetricRollups structure. Appends replace the last month's
+    digest, so each extension works on a copy of the (short) month lists and
+    older snapshots keep theirs.
+    """
+
+    def __init__(self, capacity: int = 0, compression: int = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.months: List[int] = []
+        self.starts: List[int] = []
+        self.sketches: List[QuantileSketch] = []
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        # Never room to extend in place: see the class docstring
+        return self.size
+
+    def grown(self, n: int, capacity: int) -> "MonthlySketches":
+        copy = MonthlySketches(compression=self.compression)
+        copy.months, copy.starts, copy.sketches = list(self.months), list(self.starts), list(self.sketches)
+        copy.size = n
+        return copy
+
+    def write(self, columns: MetricColumns, field: str, start: int, stop: int) -> None:
+        part = columns.slice(start, stop)
+        months = _month_numbers(part.days)
+        values = part.column(field)
+        bounds = np.concatenate([[0], np.flatnonzero(months[1:] != months[:-1]) + 1, [len(part)]]).tolist()
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            month = int(months[lo])
+            if self.months and self.months[-1] == month:
+                self.sketches[-1] = self.sketches[-1].add(values[lo:hi])
+            else:
+                self.months.append(month)
+                self.starts.append(start + lo)
+                self.sketches.append(QuantileSketch.from_values(values[lo:hi], self.compression))
+        self.size = stop
+
+    def sketch(self, columns: MetricColumns, field: str, lo: int, hi: int) -> QuantileSketch:
+        """
+        Digest of rows [lo, hi): the months wholly inside the range are
+        merged; rows of the partial months at either end are added exactly.
+        """
+        if hi <= lo:
+            return QuantileSketch(compression=self.compression)
+        ends = self.starts[1:] + [self.size]
+        first = int(np.searchsorted(self.starts, lo, side="left"))
+        last = int(np.searchsorted(ends, hi, side="right"))
+        if first >= last:
+            return QuantileSketch.from_values(columns.slice(lo, hi).column(field), self.compression)
+        edges = np.concatenate([
+            columns.slice(lo, self.starts[first]).column(field),
+            columns.slice(ends[last - 1], hi).column(field),
+        ])
+        parts = self.sketches[first:last] + [QuantileSketch.from_values(edges, self.compression)]
+        return QuantileSketch.merge_all(parts, self.compression)
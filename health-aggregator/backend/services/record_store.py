@@ -0,0 +1,542 @@
+"""
+Record Store
+Single shared, versioned in-memory copy of the health records.
+
+Every service reads from the same store instead of parsing the data file on
+its own. A reload builds a complete new snapshot and publishes it with one
+reference assignment, so readers always see a consistent version.
+
+Records appended through the API are written to a JSON-lines journal next to
+the data file (``<data file>.journal.jsonl``) and replayed on reload. Days
+merged in by bulk imports are journaled as ``{"merged": record}`` entries,
+which are applied on reload even when they fall inside the data file's range.
+
+When the data path is a SQLite database (``.db``/``.sqlite``) the database is
+the source of truth instead: appends and merges are upserted into it and no
+journal is kept.
+
+refresh() is the cheap form of reload: it compares the files' size and mtime
+(and, for small data files, a content digest) with what was last loaded and
+does nothing when they match. New journal lines are replayed on their own, and
+a re-read that only added rows at the end is reported as an append, so the
+services can update incrementally.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from services.metric_store import MetricColumns
+from services.rollups import MetricRollups
+from services.columnar_format import is_columnar_path, open_columnar
+from services.streaming_import import stream_import, ImportProgress
+from services.record_validation import parse_dates
+from services.apple_health_import import import_apple_health
+from services.arrow_io import is_arrow_path, import_columns
+from services.sqlite_store import SqliteRecordStore, is_sqlite_path
+
+
+# JSON files larger than this are imported with the streaming parser
+STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Data files up to this size get a content digest, so a touch without a
+# content change does not force a reload
+DIGEST_MAX_BYTES = 64 * 1024 * 1024
+
+# refresh() outcomes
+UNCHANGED = "unchanged"
+APPENDED = "appended"
+RELOADED = "reloaded"
+
+
+class RecordAppendError(ValueError):
+    """Raised when appended records are malformed or not after the current tail."""
+
+    pass
+
+
+class RefreshResult:
+    """What refresh() found: no change, rows added at the end, or a full reload."""
+
+    __slots__ = ("change", "added", "snapshot")
+
+    def __init__(self, change: str, snapshot: "StoreSnapshot", added: int = 0):
+        self.change = change
+        self.snapshot = snapshot
+        self.added = added
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"change": self.change, "added": self.added, "data_version": self.snapshot.version}
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _digest(path: str) -> Optional[str]:
+    stat = _stat(path)
+    if stat is None or stat[0] > DIGEST_MAX_BYTES:
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StoreSnapshot:
+    """Immutable view of the loaded data at one store version."""
+
+    __slots__ = ("version", "metadata", "columns", "_records", "_rollups")
+
+    def __init__(
+        self,
+        version: int,
+        columns: MetricColumns,
+        metadata: Optional[Dict[str, Any]] = None,
+        records: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.version = version
+        self.columns = columns
+        self.metadata = metadata or {}
+        # Source dicts are kept when loaded from JSON; for columnar files they
+        # are materialized from the columns only for the rows requested.
+        self._records = records
+        self._rollups: Optional[MetricRollups] = None
+
+    @classmethod
+    def from_records(cls, version: int, records: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> "StoreSnapshot":
+        return cls(version, MetricColumns.from_records(records), metadata, records)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    @property
+    def records(self) -> List[Dict[str, Any]]:
+        if self._records is None:
+            self._records = self.columns.to_records()
+        if len(self._records) != len(self):
+            # The list is shared with newer snapshots that appended to it
+            return self._records[:len(self)]
+        return self._records
+
+    def get_records(self, start: Optional[int] = None, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Records for a row range, without materializing the rest of the store."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if self._records is not None:
+            return self._records[start:stop]
+        return self.columns.to_records(start, stop)
+
+    def row_range(self, start: Optional[date] = None, end: Optional[date] = None) -> Tuple[int, int]:
+        """
+        Row bounds [lo, hi) of the records dated start..end (inclusive), found
+        by binary search on the sorted day column in O(log n).
+        """
+        days = self.columns.days
+        lo = int(np.searchsorted(days, start.toordinal(), side="left")) if start else 0
+        hi = int(np.searchsorted(days, end.toordinal(), side="right")) if end else len(days)
+        return lo, max(lo, hi)
+
+    def sorted_by_date(self) -> "StoreSnapshot":
+        """This snapshot with rows in ascending date order (itself if already sorted)."""
+        days = self.columns.days
+        if len(days) < 2 or bool(np.all(days[1:] >= days[:-1])):
+            return self
+        order = np.argsort(days, kind="stable")
+        records = [self._records[i] for i in order] if self._records is not None else None
+        return StoreSnapshot(self.version, self.columns.take(order), self.metadata, records)
+
+    @property
+    def rollups(self) -> MetricRollups:
+        """Prefix sums over the rows (built per field on first use)."""
+        if self._rollups is None:
+            self._rollups = MetricRollups(self.columns)
+        return self._rollups
+
+    def last_date(self) -> Optional[date]:
+        if len(self) == 0:
+            return None
+        return date.fromordinal(int(self.columns.days[-1]))
+
+    def appended(
+        self, version: int, records: List[Dict[str, Any]], columns: Optional[MetricColumns] = None
+    ) -> "StoreSnapshot":
+        """
+        New snapshot with `records` added after the current tail, in O(len(records)).
+        `columns` are the records already parsed, when the caller has them.
+        """
+        n = len(self)
+        columns = self.columns.append(columns if columns is not None else MetricColumns.from_records(records))
+        shared = None
+        if self._records is not None:
+            shared = self._records if len(self._records) == n else self._records[:n]
+            shared.extend(records)
+        snapshot = StoreSnapshot(version, columns, self.metadata, shared)
+        if self._rollups is not None:
+            snapshot._rollups = self._rollups.extended(columns)
+        return snapshot
+
+    def extending(self, older: "StoreSnapshot") -> "StoreSnapshot":
+        """
+        This snapshot, which holds `older`'s rows plus new ones at the end,
+        with the rollups `older` already built extended instead of rebuilt.
+        """
+        if older._rollups is not None and self._rollups is None:
+            self._rollups = older._rollups.extended(self.columns)
+        return self
+
+    def merged(self, version: int, columns: MetricColumns) -> "StoreSnapshot":
+        """New snapshot with `columns` merged in by day (see MetricColumns.merge)."""
+        return StoreSnapshot(version, self.columns.merge(columns), self.metadata)
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        return {"metadata": self.metadata, "records": self.records}
+
+
+class RecordStore:
+    """Loads the health data file once and shares it across services."""
+
+    def __init__(self, data_path: Optional[str] = None, streaming: Optional[bool] = None):
+        self.data_path = data_path or self._get_default_data_path()
+        self.journal_path = self.data_path + ".journal.jsonl"
+        # None: stream JSON files above STREAMING_THRESHOLD_BYTES
+        if streaming is None and os.environ.get("HEALTH_STREAMING_IMPORT"):
+            streaming = os.environ["HEALTH_STREAMING_IMPORT"].lower() in ("1", "true", "yes")
+        self.streaming = streaming
+        self.load_progress: Optional[ImportProgress] = None
+        self.sqlite: Optional[SqliteRecordStore] = SqliteRecordStore(self.data_path) if is_sqlite_path(self.data_path) else None
+        self._lock = threading.Lock()
+        self._snapshot = StoreSnapshot(0, MetricColumns.empty(), records=[])
+        # (size, mtime_ns) of the watched files and the data file's digest as last loaded
+        self._seen: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._seen_digest: Optional[str] = None
+        # Rows of the data file itself (before the journal) as last loaded
+        self._file_columns: Optional[MetricColumns] = None
+        self.reload()
+
+    def _get_default_data_path(self) -> str:
+        env_path = os.environ.get("HEALTH_DATA_PATH")
+        if env_path:
+            return env_path
+        current_dir = Path(__file__).parent.parent
+        return str(current_dir / "data" / "synthetic_health_data.json")
+
+    def _read_file(self, version: int) -> StoreSnapshot:
+        try:
+            if self.sqlite is not None:
+                metadata = {"source": "sqlite", "user_id": self.sqlite.user_id}
+                return StoreSnapshot(version, self.sqlite.load_columns(), metadata)
+
+            if not os.path.exists(self.data_path):
+                return StoreSnapshot(version, MetricColumns.empty(), records=[])
+
+            if is_columnar_path(self.data_path):
+                columns, header = open_columnar(self.data_path)
+                return StoreSnapshot(version, columns, header.get("metadata"))
+
+            if is_arrow_path(self.data_path):
+                columns, metadata = import_columns(self.data_path)
+                return StoreSnapshot(version, columns, metadata)
+
+            if self.data_path.endswith(".xml"):
+                columns, metadata = import_apple_health(self.data_path)
+                return StoreSnapshot(version, columns, metadata)
+
+            if self._use_streaming():
+                columns, metadata = stream_import(self.data_path, progress=self._report_progress)
+                return StoreSnapshot(version, columns, metadata)
+
+            with open(self.data_path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                data = {"records": data}
+            return StoreSnapshot.from_records(version, data.get("records", []), data.get("metadata"))
+        except Exception as e:
+            print(f"Error loading data: {e}")
+            return StoreSnapshot(version, MetricColumns.empty(), records=[])
+
+    def _use_streaming(self) -> bool:
+        if self.streaming is not None:
+            return self.streaming
+        return os.path.getsize(self.data_path) > STREAMING_THRESHOLD_BYTES
+
+    def _report_progress(self, progress: ImportProgress) -> None:
+        self.load_progress = progress
+        if progress.done and progress.rejected:
+            print(f"Streaming import skipped {progress.rejected} records without a valid date")
+
+    def _read_journal(self, offset: int = 0) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, 'r') as f:
+            f.seek(offset)
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+        return records
+
+    def _replay_journal(self, snapshot: StoreSnapshot) -> StoreSnapshot:
+        if self.sqlite is not None:
+            return snapshot
+        try:
+            journal = self._read_journal()
+        except Exception as e:
+            print(f"Error reading journal: {e}")
+            return snapshot
+        merges = [entry["merged"] for entry in journal if "merged" in entry]
+        appends = [entry for entry in journal if "merged" not in entry]
+        # Appended entries already folded into the data file are skipped
+        last = snapshot.last_date()
+        if last is not None:
+            appends = [r for r in appends if r.get("date", "") > last.isoformat()]
+        if appends:
+            snapshot = snapshot.appended(snapshot.version, appends)
+        # Merges never precede an append of the same day, so they go last
+        if merges:
+            snapshot = snapshot.merged(snapshot.version, MetricColumns.from_records(merges))
+        return snapshot
+
+    def _watched_paths(self) -> List[str]:
+        if self.sqlite is not None:
+            return [self.data_path, self.data_path + "-wal"]
+        return [self.data_path, self.journal_path]
+
+    def _mark_seen(self, paths: Optional[List[str]] = None) -> None:
+        """Record the current state of `paths` (default: all) as loaded."""
+        for path in paths or self._watched_paths():
+            self._seen[path] = _stat(path)
+
+    def _load(self) -> StoreSnapshot:
+        # Stat before reading: a write during the read shows up on the next refresh
+        self._mark_seen()
+        self._seen_digest = _digest(self.data_path) if self.sqlite is None else None
+        # Rows are kept in date order so date lookups can binary search
+        snapshot = self._read_file(self._snapshot.version + 1).sorted_by_date()
+        self._file_columns = snapshot.columns
+        return self._replay_journal(snapshot)
+
+    def reload(self) -> StoreSnapshot:
+        """Re-read the data file and atomically publish a new snapshot."""
+        with self._lock:
+            self._snapshot = self._load()
+            return self._snapshot
+
+    def refresh(self) -> RefreshResult:
+        """
+        Reload only if the files changed since they were last loaded.
+
+        Returns UNCHANGED without reading anything when sizes and mtimes match
+        (or only the mtime moved and the content digest is the same). When
+        the journal alone grew, just its new lines are replayed. Otherwise
+        the files are re-read; if the result is the old rows plus new ones at
+        the end, the change is APPENDED, else RELOADED. For a columnar file
+        that check does not read the old rows back (see _file_appended).
+        """
+        with self._lock:
+            old = self._snapshot
+            current = {path: _stat(path) for path in self._watched_paths()}
+            changed = [path for path, stat in current.items() if stat != self._seen.get(path)]
+            if self.data_path in changed and self.sqlite is None:
+                before, after = self._seen.get(self.data_path), current[self.data_path]
+                if before and after and before[0] == after[0] and self._seen_digest is not None:
+                    if _digest(self.data_path) == self._seen_digest:
+                        self._mark_seen([self.data_path])
+                        changed.remove(self.data_path)
+            if not changed:
+                return RefreshResult(UNCHANGED, old)
+
+            if changed == [self.journal_path] and self.sqlite is None:
+                result = self._replay_journal_tail(old)
+                if result is not None:
+                    self._mark_seen([self.journal_path])
+                    self._snapshot = result.snapshot
+                    return result
+
+            previous_file = self._file_columns
+            snapshot = self._load()
+            if is_columnar_path(self.data_path) and self.journal_path not in changed:
+                appended = self._file_appended(old, previous_file, snapshot)
+            else:
+                appended = snapshot.columns.starts_with(old.columns)
+            if not appended:
+                self._snapshot = snapshot
+                return RefreshResult(RELOADED, snapshot)
+            added = len(snapshot) - len(old)
+            if added == 0:
+                # Rewritten with the same rows: keep the current version
+                return RefreshResult(UNCHANGED, old)
+            self._snapshot = snapshot.extending(old)
+            return RefreshResult(APPENDED, self._snapshot, added)
+
+    def _file_appended(self, old: StoreSnapshot, previous: Optional[MetricColumns], snapshot: StoreSnapshot) -> bool:
+        """
+        Whether a re-read memory-mapped file only added rows after `old`'s,
+        judged without faulting in every page: the row count, the day column
+        and the last row the file held before. Values of earlier days
+        rewritten in place are not noticed; reload() picks those up.
+        """
+        n = len(old)
+        if previous is None or len(self._file_columns) < len(previous) or len(snapshot) < n:
+            return False
+        if n != len(previous):
+            # Rows past the file's old end came from the journal: compare them all
+            return snapshot.columns.starts_with(old.columns)
+        if not np.array_equal(snapshot.columns.days[:n], old.columns.days):
+            return False
+        return n == 0 or self._file_columns.slice(n - 1, n).starts_with(previous.slice(n - 1, n))
+
+    def _replay_journal_tail(self, snapshot: StoreSnapshot) -> Optional[RefreshResult]:
+        """Apply journal lines written since the last load; None if that is not possible."""
+        offset = (self._seen.get(self.journal_path) or (0, 0))[0]
+        current = _stat(self.journal_path)
+        if current is None or current[0] < offset:
+            return None
+        try:
+            entries = self._read_journal(offset)
+        except (OSError, ValueError):
+            return None
+        version = snapshot.version + 1
+        appends = [entry for entry in entries if "merged" not in entry]
+        merges = [entry["merged"] for entry in entries if "merged" in entry]
+        if merges:
+            if appends:
+                snapshot = snapshot.appended(version, appends)
+            merged = snapshot.merged(version, MetricColumns.from_records(merges))
+            return RefreshResult(RELOADED, merged)
+        last = snapshot.last_date()
+        if last is not None and any(r.get("date", "") <= last.isoformat() for r in appends):
+            return None
+        if not appends:
+            return RefreshResult(UNCHANGED, snapshot)
+        return RefreshResult(APPENDED, snapshot.appended(version, appends), len(appends))
+
+    def _write_journal(self, entries: List[Dict[str, Any]]) -> None:
+        with open(self.journal_path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        # Our own writes are already in the snapshot; refresh() must not redo them
+        self._mark_seen([self.journal_path])
+
+    def _validate_append(self, records: List[Dict[str, Any]], columns: Optional[MetricColumns] = None) -> None:
+        last = self._snapshot.last_date()
+        if columns is not None:
+            # Dates already parsed and checked: only the ordering is left
+            days = columns.days
+            if last is not None and len(days) and days[0] <= last.toordinal():
+                raise RecordAppendError(
+                    f"Record 0 dated {records[0]['date']} is not after the latest record ({last.isoformat()})"
+                )
+            out_of_order = np.flatnonzero(days[1:] <= days[:-1])
+            if len(out_of_order):
+                i = int(out_of_order[0]) + 1
+                raise RecordAppendError(
+                    f"Record {i} dated {records[i]['date']} is not after the latest record ({records[i - 1]['date']})"
+                )
+            return
+        ordinals = parse_dates([r.get("date") if isinstance(r, dict) else None for r in records])
+        for i, record in enumerate(records):
+            if not isinstance(record, dict) or "date" not in record:
+                raise RecordAppendError(f"Record {i} has no 'date'")
+            if ordinals[i] < 0:
+                raise RecordAppendError(f"Record {i} has invalid date {record['date']!r}")
+            day = date.fromordinal(int(ordinals[i]))
+            if last is not None and day <= last:
+                raise RecordAppendError(
+                    f"Record {i} dated {day.isoformat()} is not after the latest record ({last.isoformat()})"
+                )
+            last = day
+
+    def append(self, records: List[Dict[str, Any]], columns: Optional[MetricColumns] = None) -> StoreSnapshot:
+        """
+        Append daily records after the current tail and publish a new snapshot.
+
+        Records must be in ascending date order and newer than the latest
+        stored day. They are journaled to disk (or written to SQLite) so a
+        reload keeps them. `columns` may carry the records already parsed
+        (see record_validation), which skips parsing them again.
+        """
+        with self._lock:
+            self._validate_append(records, columns)
+            if not records:
+                return self._snapshot
+            if self.sqlite is not None:
+                self.sqlite.upsert_columns(columns if columns is not None else MetricColumns.from_records(records))
+                self._mark_seen()
+            else:
+                self._write_journal(records)
+            self._snapshot = self._snapshot.appended(self._snapshot.version + 1, records, columns)
+            return self._snapshot
+
+    def merge(self, columns: MetricColumns) -> StoreSnapshot:
+        """
+        Merge imported daily columns into the store and publish a new snapshot.
+
+        Imported values replace stored ones on days present in both; fields the
+        import does not carry are left as they were. The resulting rows for
+        every touched day are journaled (or upserted into SQLite) so a reload
+        keeps them.
+        """
+        with self._lock:
+            if len(columns) == 0:
+                return self._snapshot
+            snapshot = self._snapshot
+            version = snapshot.version + 1
+            last = snapshot.last_date()
+            if self.sqlite is not None:
+                self.sqlite.upsert_columns(columns)
+                self._mark_seen()
+            if last is None or int(columns.days.min()) > last.toordinal():
+                records = MetricColumns.empty().merge(columns).to_records()
+                if self.sqlite is None:
+                    self._write_journal(records)
+                self._snapshot = snapshot.appended(version, records)
+                return self._snapshot
+
+            merged = snapshot.merged(version, columns)
+            if self.sqlite is None:
+                touched = np.isin(merged.columns.days, columns.days)
+                self._write_journal([{"merged": r} for r in merged.columns.take(touched).to_records()])
+            self._snapshot = merged
+            return self._snapshot
+
+    @property
+    def snapshot(self) -> StoreSnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def records(self) -> List[Dict[str, Any]]:
+        return self._snapshot.records
+
+    @property
+    def columns(self) -> MetricColumns:
+        return self._snapshot.columns
+
+
+_default_store: Optional[RecordStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> RecordStore:
+    """Return the process-wide store for the default data path."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = RecordStore()
+        return _default_store
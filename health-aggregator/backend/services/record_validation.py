@@ -0,0 +1,322 @@
+"""
+Record Validation
+Checks incoming daily records before they reach the store.
+
+Records are read column by column: a field's values are gathered into one
+list, its type check is the set of Python types in that list, and it is
+converted to float64 in a single call. Range and cross-field rules are then
+NumPy masks over the whole batch, so the checks cost a few array operations
+per field however many records arrive. Rows failing any rule are rejected
+with their reasons; the rest are returned as typed columns.
+"""
+
+import json
+import math
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple, Callable
+
+import numpy as np
+
+from services.metric_store import (
+    MetricColumns,
+    FIELD_SCHEMA,
+    FIELDS,
+    FIELD_DTYPES,
+    GROUPS,
+    EPOCH_ORDINAL,
+)
+
+
+# Inclusive plausible ranges; values outside them are entry or unit errors
+FIELD_RANGES: Dict[str, Tuple[float, float]] = {
+    "sleep.duration_hours": (0, 24),
+    "sleep.quality_score": (0, 100),
+    "sleep.deep_sleep_hours": (0, 24),
+    "sleep.rem_sleep_hours": (0, 24),
+    "sleep.time_to_sleep_minutes": (0, 720),
+    "sleep.wake_ups": (0, 100),
+    "heart_rate.resting": (20, 200),
+    "heart_rate.average": (20, 250),
+    "heart_rate.max": (30, 250),
+    "heart_rate.hrv": (0, 300),
+    "activity.steps": (0, 200_000),
+    "activity.active_minutes": (0, 1440),
+    "activity.calories_burned": (0, 20_000),
+    "activity.distance_km": (0, 300),
+    "activity.floors_climbed": (0, 1000),
+    "nutrition.calories": (0, 20_000),
+    "nutrition.protein_g": (0, 2000),
+    "nutrition.carbs_g": (0, 2000),
+    "nutrition.fat_g": (0, 2000),
+    "nutrition.water_ml": (0, 20_000),
+    "nutrition.sugar_g": (0, 2000),
+    "nutrition.fiber_g": (0, 2000),
+    "weight.weight_kg": (20, 400),
+    "weight.body_fat_percent": (2, 75),
+    "wellness.stress_score": (0, 100),
+    "wellness.energy_level": (0, 100),
+    "wellness.mood_score": (0, 100),
+}
+
+# Rules across fields: (reason, mask of violating rows from float columns with
+# NaN for missing values). Comparisons with NaN are False, so a rule only
+# fires when every field it reads is present.
+CROSS_FIELD_RULES: List[Tuple[str, Callable[[Dict[str, np.ndarray]], np.ndarray]]] = [
+    (
+        "sleep: deep + REM sleep exceed duration",
+        lambda v: v["sleep.deep_sleep_hours"] + v["sleep.rem_sleep_hours"] > v["sleep.duration_hours"] + 0.05,
+    ),
+    (
+        "heart_rate: resting above max",
+        lambda v: v["heart_rate.resting"] > v["heart_rate.max"],
+    ),
+]
+
+MIN_DATE = date(1900, 1, 1)
+# Records may be dated at most this far ahead (time zones ahead of the server)
+MAX_FUTURE_DAYS = 1
+
+MAX_EXAMPLES = 5
+QUARANTINE_SUFFIX = ".quarantine.jsonl"
+
+_NUMERIC = {int, float, type(None)}
+_EMPTY: Dict[str, Any] = {}
+
+
+class RecordValidationError(ValueError):
+    """Raised when a batch is not a list of records."""
+
+    pass
+
+
+def _to_float(value: Any) -> float:
+    """float(value), with integers too large for a float as +/-inf."""
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+
+def _floats(raw: List[Any]) -> np.ndarray:
+    try:
+        return np.array(raw, dtype=np.float64).reshape(len(raw))
+    except OverflowError:
+        # A huge JSON integer: convert one by one so it fails the range check
+        return np.array([_to_float(v) for v in raw], dtype=np.float64).reshape(len(raw))
+
+
+def _parse_column(raw: List[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    float64 values (NaN where missing, +/-inf for integers too large for a
+    float) and the mask of non-numeric entries.
+    """
+    n = len(raw)
+    if set(map(type, raw)) <= _NUMERIC:
+        return _floats(raw), np.zeros(n, dtype=bool)
+    # Only a column holding strings, bools, lists, ... pays for a per-value pass
+    bad = np.fromiter((type(v) not in _NUMERIC for v in raw), dtype=bool, count=n)
+    cleaned = [None if b else v for v, b in zip(raw, bad.tolist())]
+    return _floats(cleaned), bad
+
+
+def parse_dates(raw: List[Any]) -> np.ndarray:
+    """Day ordinals (int64), -1 where a date is missing or not YYYY-MM-DD."""
+    n = len(raw)
+    ordinals = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return ordinals
+    if not set(map(type, raw)) <= {str}:
+        raw = [v if type(v) is str else "" for v in raw]
+    # One spare code point: a non-zero 11th character means the value is too long
+    text = np.array(raw, dtype="U11")
+    codes = text.view(np.uint32).reshape(n, 11)
+    digits = (codes >= ord("0")) & (codes <= ord("9"))
+    well_formed = (
+        digits[:, [0, 1, 2, 3, 5, 6, 8, 9]].all(axis=1)
+        & (codes[:, 4] == ord("-"))
+        & (codes[:, 7] == ord("-"))
+        & (codes[:, 10] == 0)
+    )
+    try:
+        parsed = np.where(well_formed, text, "NaT").astype("datetime64[D]")
+    except ValueError:
+        # A well-formed value is not a calendar date (2024-02-30); find which
+        parsed = np.full(n, np.datetime64("NaT"), dtype="datetime64[D]")
+        for i in np.flatnonzero(well_formed):
+            try:
+                parsed[i] = np.datetime64(text[i], "D")
+            except ValueError:
+                pass
+    ok = ~np.isnat(parsed)
+    ordinals[ok] = parsed[ok].astype(np.int64) + EPOCH_ORDINAL
+    return ordinals
+
+
+def check_columns(values: Dict[str, np.ndarray], present: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Range and cross-field checks over float columns (NaN for missing).
+
+    Returns {reason: mask of failing rows} for the rules any row breaks.
+    """
+    reasons: Dict[str, np.ndarray] = {}
+    with np.errstate(invalid="ignore"):
+        for f in FIELDS:
+            low, high = FIELD_RANGES[f]
+            column = values[f]
+            bad = present[f] & ((column < low) | (column > high))
+            if bad.any():
+                reasons[f"{f}: out of range [{low:g}, {high:g}]"] = bad
+        for reason, rule in CROSS_FIELD_RULES:
+            bad = rule(values)
+            if bad.any():
+                reasons[reason] = bad
+    return reasons
+
+
+def _typed_columns(days: np.ndarray, values: Dict[str, np.ndarray], present: Dict[str, np.ndarray]) -> MetricColumns:
+    typed: Dict[str, np.ndarray] = {}
+    for f in FIELDS:
+        column = np.where(present[f], values[f], 0)
+        if FIELD_DTYPES[f].kind == "i":
+            column = np.rint(column)
+        typed[f] = column.astype(FIELD_DTYPES[f])
+    return MetricColumns(days.astype(np.int32), typed, present)
+
+
+def _summary(n: int, reasons: Dict[str, np.ndarray], rejected: np.ndarray, dates: List[Any]) -> Tuple[Dict[str, Any], List[List[str]]]:
+    """Summary dict plus the list of reasons for each rejected row."""
+    row_reasons: List[List[str]] = [[] for _ in rejected]
+    position = {int(row): i for i, row in enumerate(rejected)}
+    for reason, mask in reasons.items():
+        for row in np.flatnonzero(mask):
+            row_reasons[position[int(row)]].append(reason)
+    examples = [
+        {"index": int(row), "date": dates[row] if isinstance(dates[row], str) else None, "errors": row_reasons[i]}
+        for i, row in enumerate(rejected[:MAX_EXAMPLES])
+    ]
+    summary = {
+        "received": n,
+        "accepted": n - len(rejected),
+        "rejected": len(rejected),
+        "errors": {reason: int(mask.sum()) for reason, mask in reasons.items()},
+        "examples": examples,
+    }
+    return summary, row_reasons
+
+
+def validate_records(
+    records: List[Any],
+    today: Optional[date] = None,
+) -> Tuple[MetricColumns, np.ndarray, np.ndarray, Dict[str, Any], List[List[str]]]:
+    """
+    Validate a batch of daily records.
+
+    Returns (columns of the accepted rows, accepted row indexes, rejected row
+    indexes, summary, reasons per rejected row). The summary counts
+    received / accepted / rejected rows, rejections per reason, and lists a
+    few example rows.
+    """
+    if not isinstance(records, list):
+        raise RecordValidationError("Expected a list of records")
+    n = len(records)
+    reasons: Dict[str, np.ndarray] = {}
+
+    def flag(reason: str, mask: np.ndarray) -> None:
+        if mask.any():
+            reasons[reason] = reasons[reason] | mask if reason in reasons else mask
+
+    rows = records
+    not_dict = np.zeros(n, dtype=bool)
+    if not set(map(type, records)) <= {dict}:
+        not_dict = np.fromiter((type(r) is not dict for r in records), dtype=bool, count=n)
+        flag("record: not an object", not_dict)
+        rows = [_EMPTY if bad else r for r, bad in zip(records, not_dict.tolist())]
+
+    dates = [r.get("date") for r in rows]
+    ordinals = parse_dates(dates)
+    flag("date: missing or not YYYY-MM-DD", (ordinals < 0) & ~not_dict)
+    today = today or date.today()
+    flag(
+        "date: out of range",
+        (ordinals >= 0) & ((ordinals < MIN_DATE.toordinal()) | (ordinals > (today + timedelta(days=MAX_FUTURE_DAYS)).toordinal())),
+    )
+
+    values: Dict[str, np.ndarray] = {}
+    present: Dict[str, np.ndarray] = {}
+    for group in GROUPS:
+        sub = [r.get(group) or _EMPTY for r in rows]
+        if not set(map(type, sub)) <= {dict}:
+            not_dict = np.fromiter((type(s) is not dict for s in sub), dtype=bool, count=n)
+            flag(f"{group}: not an object", not_dict)
+            sub = [_EMPTY if bad else s for s, bad in zip(sub, not_dict.tolist())]
+        for g, field, _, _ in FIELD_SCHEMA:
+            if g != group:
+                continue
+            name = f"{g}.{field}"
+            values[name], wrong_type = _parse_column([s.get(field) for s in sub])
+            flag(f"{name}: not a number", wrong_type)
+            # Infinite values count as present, so the range check rejects them
+            present[name] = ~np.isnan(values[name])
+
+    for reason, mask in check_columns(values, present).items():
+        flag(reason, mask)
+
+    bad_rows = np.zeros(n, dtype=bool)
+    for mask in reasons.values():
+        bad_rows |= mask
+    accepted = np.flatnonzero(~bad_rows)
+    rejected = np.flatnonzero(bad_rows)
+    summary, row_reasons = _summary(n, reasons, rejected, dates)
+
+    if len(rejected):
+        ordinals = ordinals[accepted]
+        values = {f: v[accepted] for f, v in values.items()}
+        present = {f: p[accepted] for f, p in present.items()}
+    return _typed_columns(ordinals, values, present), accepted, rejected, summary, row_reasons
+
+
+def validate_columns(columns: MetricColumns) -> Tuple[np.ndarray, Dict[str, Any], List[List[str]]]:
+    """
+    Range and cross-field checks for already-typed columns (CSV imports).
+
+    Returns (rejected row indexes, summary, reasons per rejected row).
+    """
+    values = {f: columns.column(f) for f in FIELDS}
+    reasons = check_columns(values, columns.valid)
+    bad_rows = np.zeros(len(columns), dtype=bool)
+    for mask in reasons.values():
+        bad_rows |= mask
+    rejected = np.flatnonzero(bad_rows)
+    summary, row_reasons = _summary(len(columns), reasons, rejected, columns.date_strings().tolist())
+    return rejected, summary, row_reasons
+
+
+class Quarantine:
+    """Rejected records, kept as JSON lines next to the data file for review."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, records: List[Any], reasons: List[List[str]], origin: str) -> None:
+        if not records:
+            return
+        received_at = datetime.now().isoformat()
+        lines = [
+            json.dumps({"received_at": received_at, "origin": origin, "errors": errors, "record": record}, default=str)
+            for record, errors in zip(records, reasons)
+        ]
+        with self._lock, open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The latest `limit` quarantined entries, newest last."""
+        if not os.path.exists(self.path):
+            return []
+        with self._lock, open(self.path) as f:
+            lines = f.readlines()[-limit:] if limit > 0 else []
+        return [json.loads(line) for line in lines if line.strip()]
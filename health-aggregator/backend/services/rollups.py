@@ -0,0 +1,363 @@
+"""
+Metric Rollups
+Precomputed range structures over the store's rows, so aggregates of a
+field over any row or date range cost a few lookups instead of a pass over
+the rows: prefix sums for sum / count / mean, sparse tables for min / max,
+and monthly quantile digests (services.quantile_sketch) for percentiles.
+
+A field's structures are built the first time they are asked for, then
+kept with the snapshot. Appended rows extend them in place in geometrically
+grown buffers (as MetricColumns.append does for the columns themselves), so
+a snapshot produced by an append has its rollups ready in O(rows appended)
+for sums and O(rows appended * log n) for min / max.
+"""
+
+from datetime import date, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from services.metric_store import MetricColumns, FIELDS, EPOCH_ORDINAL, ordinals_to_strings
+from services.quantile_sketch import QuantileSketch, MonthlySketches
+
+
+BUCKETS = ("day", "week", "month", "year", "all")
+AGGREGATES = ("sum", "mean", "min", "max", "count")
+MAX_BUCKETS = 10_000
+
+
+class RollupError(ValueError):
+    """Raised for an invalid trend window, bucket or aggregate."""
+
+    pass
+
+
+class _Prefix:
+    """
+    Running sums and counts of one field: entry i covers rows [0, i).
+    Entries are never rewritten, so older rollups read their own prefix.
+    """
+
+    def __init__(self, capacity: int):
+        self.sums = np.zeros(capacity + 1, dtype=np.float64)
+        self.counts = np.zeros(capacity + 1, dtype=np.int64)
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.sums) - 1
+
+    def write(self, columns: MetricColumns, field: str, start: int, stop: int) -> None:
+        part = columns.slice(start, stop)
+        self.sums[start + 1:stop + 1] = self.sums[start] + np.cumsum(part.column(field, fill=0))
+        self.counts[start + 1:stop + 1] = self.counts[start] + np.cumsum(part.valid[field])
+        self.size = stop
+
+    def grown(self, n: int, capacity: int) -> "_Prefix":
+        """Copy of the first n rows' entries with room for `capacity` rows."""
+        copy = _Prefix(capacity)
+        copy.sums[:n + 1] = self.sums[:n + 1]
+        copy.counts[:n + 1] = self.counts[:n + 1]
+        copy.size = n
+        return copy
+
+
+class _SparseTable:
+    """
+    Min or max of one field over any row range in O(1).
+
+    Level k, entry i holds the extreme of rows (i - 2^k, i], so a range is
+    covered by two overlapping power-of-two windows. Entries are keyed by
+    the window's last row, which makes appending rows add new entries only
+    (one per level) and leave existing ones untouched. Missing values hold
+    the identity (+inf for min, -inf for max).
+    """
+
+    def __init__(self, capacity: int, op: np.ufunc, identity: float):
+        self.op = op
+        self.identity = identity
+        self.table = np.full((max(1, capacity.bit_length()), capacity), identity, dtype=np.float64)
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.table.shape[1]
+
+    def write(self, columns: MetricColumns, field: str, start: int, stop: int) -> None:
+        table = self.table
+        table[0, start:stop] = columns.slice(start, stop).column(field, fill=self.identity)
+        for k in range(1, len(table)):
+            half = 1 << (k - 1)
+            # Windows ending before row 2^k - 1 would start before row 0
+            lo = max(start, (1 << k) - 1)
+            if lo >= stop:
+                break
+            self.op(table[k - 1, lo:stop], table[k - 1, lo - half:stop - half], out=table[k, lo:stop])
+        self.size = stop
+
+    def grown(self, n: int, capacity: int) -> "_SparseTable":
+        copy = _SparseTable(capacity, self.op, self.identity)
+        levels = min(len(self.table), len(copy.table))
+        copy.table[:levels, :n] = self.table[:levels, :n]
+        copy.size = n
+        return copy
+
+    def query(self, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        """Extreme over rows [lo, hi) for each pair; ranges must be non-empty."""
+        # frexp gives length = m * 2^e with 0.5 <= m < 1, so e - 1 = floor(log2(length))
+        k = np.frexp((hi - lo).astype(np.float64))[1] - 1
+        return self.op(self.table[k, lo + (1 << k) - 1], self.table[k, hi - 1])
+
+
+_STRUCTURES = {
+    "sum": _Prefix,
+    "min": lambda capacity: _SparseTable(capacity, np.minimum, np.inf),
+    "max": lambda capacity: _SparseTable(capacity, np.maximum, -np.inf),
+    "quantile": MonthlySketches,
+}
+
+
+class MetricRollups:
+    """Per-field prefix sums, min / max tables and monthly quantile digests."""
+
+    def __init__(self, columns: MetricColumns, structures: Optional[Dict[Tuple[str, str], Any]] = None):
+        self.columns = columns
+        # (kind, field) -> _Prefix ("sum"), _SparseTable ("min" / "max") or
+        # MonthlySketches ("quantile")
+        self._structures: Dict[Tuple[str, str], Any] = structures or {}
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def _structure(self, kind: str, field: str) -> Any:
+        structure = self._structures.get((kind, field))
+        if structure is None:
+            n = len(self.columns)
+            structure = _STRUCTURES[kind](n)
+            structure.write(self.columns, field, 0, n)
+            self._structures[(kind, field)] = structure
+        return structure
+
+    def _prefix(self, field: str) -> _Prefix:
+        return self._structure("sum", field)
+
+    def extended(self, columns: MetricColumns) -> "MetricRollups":
+        """
+        Rollups for `columns`, which are our columns with rows appended.
+        Structures already built are extended, not rebuilt.
+        """
+        n, total = len(self.columns), len(columns)
+        structures: Dict[Tuple[str, str], Any] = {}
+        for (kind, field), structure in list(self._structures.items()):
+            if structure.size != n or total > structure.capacity:
+                # Another snapshot already extended this buffer, or it is full
+                structure = structure.grown(n, max(2 * total, 64))
+            structure.write(columns, field, n, total)
+            structures[(kind, field)] = structure
+        return MetricRollups(columns, structures)
+
+    def rows(self, start: Optional[date] = None, end: Optional[date] = None) -> Tuple[int, int]:
+        """Row bounds [lo, hi) of the days start..end (inclusive), by binary search."""
+        days = self.columns.days
+        lo = int(np.searchsorted(days, start.toordinal(), side="left")) if start else 0
+        hi = int(np.searchsorted(days, end.toordinal(), side="right")) if end else len(days)
+        return lo, max(lo, hi)
+
+    def window(self, field: str, lo: int, hi: int) -> Tuple[float, int]:
+        """(sum, count) of the field's values over rows [lo, hi), in O(1)."""
+        prefix = self._prefix(field)
+        return float(prefix.sums[hi] - prefix.sums[lo]), int(prefix.counts[hi] - prefix.counts[lo])
+
+    def aggregate(self, field: str, lo: np.ndarray, hi: np.ndarray, agg: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (values, counts) of `agg` over the row ranges [lo[i], hi[i]), O(1)
+        each; values are NaN where a range holds no value for the field.
+        """
+        if agg not in AGGREGATES:
+            raise RollupError(f"agg must be one of {', '.join(AGGREGATES)}, got {agg!r}")
+        prefix = self._prefix(field)
+        counts = prefix.counts[hi] - prefix.counts[lo]
+        if agg == "count":
+            return counts.astype(np.float64), counts
+        values = np.full(len(lo), np.nan)
+        filled = counts > 0
+        if agg in ("sum", "mean"):
+            values[filled] = prefix.sums[hi[filled]] - prefix.sums[lo[filled]]
+            if agg == "mean":
+                values[filled] /= counts[filled]
+        else:
+            values[filled] = self._structure(agg, field).query(lo[filled], hi[filled])
+        return values, counts
+
+
+    def sketch(self, field: str, lo: int, hi: int) -> QuantileSketch:
+        """Quantile digest of the field's values over rows [lo, hi)."""
+        return self._structure("quantile", field).sketch(self.columns, field, lo, hi)
+
+
+def bucket_ranges(start: date, end: date, bucket: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (first day, last day) ordinals of the calendar buckets covering
+    start..end, clipped to it. Weeks start on Monday.
+    """
+    if bucket not in BUCKETS:
+        raise RollupError(f"bucket must be one of {', '.join(BUCKETS)}, got {bucket!r}")
+    first, last = start.toordinal(), end.toordinal()
+    if bucket == "all":
+        starts = np.array([first], dtype=np.int64)
+    elif bucket == "day":
+        starts = np.arange(first, last + 1, dtype=np.int64)
+    elif bucket == "week":
+        starts = np.arange(first - start.weekday(), last + 1, 7, dtype=np.int64)
+    else:
+        unit = "M" if bucket == "month" else "Y"
+        periods = np.arange(np.datetime64(start, unit), np.datetime64(end, unit) + 1)
+        starts = periods.astype("datetime64[D]").astype(np.int64) + EPOCH_ORDINAL
+    if len(starts) > MAX_BUCKETS:
+        raise RollupError(f"{len(starts)} buckets requested; at most {MAX_BUCKETS} are allowed")
+    starts[0] = first
+    ends = np.append(starts[1:] - 1, last)
+    return starts, ends
+
+
+def aggregate_buckets(
+    rollups: MetricRollups,
+    field: str,
+    start: Optional[date],
+    end: Optional[date],
+    bucket: str,
+    agg: str,
+) -> List[Dict[str, Any]]:
+    """
+    `agg` of a field per calendar bucket over start..end (defaulting to the
+    stored date range). Each bucket is two binary searches plus O(1) lookups,
+    however many days it spans.
+    """
+    days = rollups.columns.days
+    if len(days) == 0:
+        return []
+    start = start or date.fromordinal(int(days[0]))
+    end = end or date.fromordinal(int(days[-1]))
+    if start > end:
+        raise RollupError("start must not be after end")
+    starts, ends = bucket_ranges(start, end, bucket)
+    lo = np.searchsorted(days, starts, side="left")
+    hi = np.maximum(lo, np.searchsorted(days, ends, side="right"))
+    values, counts = rollups.aggregate(field, lo, hi, agg)
+    first_days = ordinals_to_strings(starts).tolist()
+    last_days = ordinals_to_strings(ends).tolist()
+    if agg == "count":
+        results = counts.tolist()
+    else:
+        results = [None if np.isnan(v) else round(v, 2) for v in values.tolist()]
+    return [
+        {"start": s, "end": e, "value": v, "count": c}
+        for s, e, v, c in zip(first_days, last_days, results, counts.tolist())
+    ]
+
+
+def percentile_buckets(
+    rollups: MetricRollups,
+    field: str,
+    start: Optional[date],
+    end: Optional[date],
+    bucket: str,
+    percentiles: List[float],
+) -> List[Dict[str, Any]]:
+    """
+    Percentiles (0..100) of a field per calendar bucket over start..end,
+    from the monthly digests merged over each bucket.
+    """
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise RollupError("percentiles must be between 0 and 100")
+    days = rollups.columns.days
+    if len(days) == 0:
+        return []
+    start = start or date.fromordinal(int(days[0]))
+    end = end or date.fromordinal(int(days[-1]))
+    if start > end:
+        raise RollupError("start must not be after end")
+    starts, ends = bucket_ranges(start, end, bucket)
+    lo = np.searchsorted(days, starts, side="left").tolist()
+    hi = np.searchsorted(days, ends, side="right").tolist()
+    qs = [p / 100 for p in percentiles]
+    results = []
+    for first, last, a, b in zip(ordinals_to_strings(starts).tolist(), ordinals_to_strings(ends).tolist(), lo, hi):
+        sketch = rollups.sketch(field, a, max(a, b))
+        values = sketch.quantiles(qs).tolist()
+        results.append({
+            "start": first,
+            "end": last,
+            "count": sketch.count,
+            "percentiles": {f"p{p:g}": None if np.isnan(v) else round(v, 2) for p, v in zip(percentiles, values)},
+        })
+    return results
+
+
+def window_periods(last_day: date, window: str) -> Tuple[Tuple[date, date], Tuple[date, date]]:
+    """
+    (current, previous) inclusive date ranges for a trend window ending on
+    `last_day`: "<n>" compares the last n days with the n days before them,
+    "month" compares last_day's calendar month (to date) with the month before.
+    """
+    if window == "month":
+        current_start = last_day.replace(day=1)
+        previous_end = current_start - timedelta(days=1)
+        previous_start = previous_end.replace(day=1)
+        return (current_start, last_day), (previous_start, previous_end)
+    try:
+        days = int(window)
+    except ValueError:
+        days = 0
+    if days <= 0:
+        raise RollupError(f"window must be a positive number of days or 'month', got {window!r}")
+    current_start = last_day - timedelta(days=days - 1)
+    previous_end = current_start - timedelta(days=1)
+    return (current_start, last_day), (previous_end - timedelta(days=days - 1), previous_end)
+
+
+def compare_windows(
+    rollups: MetricRollups,
+    window: str,
+    fields: Optional[List[str]] = None,
+    bands: Optional[Dict[str, float]] = None,
+    default_band: float = 5,
+) -> Dict[str, Any]:
+    """
+    Mean of every field over the current and previous window, with the
+    change in percent and a direction ("stable" within the field's band).
+    """
+    columns = rollups.columns
+    if len(columns) == 0:
+        return {"window": window, "current": None, "previous": None, "trends": []}
+    last_day = date.fromordinal(int(columns.days[-1]))
+    current, previous = window_periods(last_day, window)
+    current_rows = rollups.rows(*current)
+    previous_rows = rollups.rows(*previous)
+
+    trends = []
+    for field in fields or FIELDS:
+        current_sum, current_count = rollups.window(field, *current_rows)
+        previous_sum, previous_count = rollups.window(field, *previous_rows)
+        current_avg = current_sum / current_count if current_count else None
+        previous_avg = previous_sum / previous_count if previous_count else None
+        change = direction = None
+        if current_avg is not None and previous_avg:
+            change = (current_avg - previous_avg) / abs(previous_avg) * 100
+            band = (bands or {}).get(field, default_band)
+            direction = "up" if change > band else "down" if change < -band else "stable"
+        trends.append({
+            "metric": field,
+            "current_avg": round(current_avg, 2) if current_avg is not None else None,
+            "previous_avg": round(previous_avg, 2) if previous_avg is not None else None,
+            "current_days": current_count,
+            "previous_days": previous_count,
+            "change_percent": round(change, 1) if change is not None else None,
+            "direction": direction,
+        })
+
+    def period(bounds: Tuple[date, date]) -> Dict[str, Any]:
+        start, end = bounds
+        return {"start": start.isoformat(), "end": end.isoformat(), "days": (end - start).days + 1}
+
+    return {"window": window, "current": period(current), "previous": period(previous), "trends": trends}
@@ -0,0 +1,225 @@
+"""
+Source Merge
+Combines daily records for the same dates coming from several devices or
+apps (Apple Health, Fitbit, Oura, ...).
+
+Each source's rows are first collapsed to one row per day: rows may arrive
+out of order and repeat a day, and for every field the latest non-null value
+wins. Sources are then joined on day ordinal: their day columns are sorted
+runs, so a stable sort of the concatenation merges them in O(n log k) for k
+sources, and each source's rows are placed with a binary search. Conflicts
+(several sources with a value for the same day and field) are resolved by a
+per-field source priority.
+
+Each source's rows are kept (in a SQLite file next to the data file when
+the merger has a path) so later syncs are resolved against them.
+"""
+
+import json
+import os
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+
+from services.metric_store import MetricColumns, FIELDS, FIELD_DTYPES
+from services.sqlite_store import SqliteRecordStore
+
+
+# field / group / "*" -> sources, highest priority first. Sources that are not
+# listed rank below the listed ones, in the order they were first seen.
+DEFAULT_SOURCE_PRIORITY: Dict[str, List[str]] = {
+    "sleep": ["oura", "apple_health", "fitbit", "google_fit"],
+    "heart_rate": ["apple_health", "oura", "fitbit", "google_fit"],
+    "activity": ["apple_health", "fitbit", "google_fit", "oura"],
+    "*": ["apple_health", "fitbit", "oura", "google_fit"],
+}
+
+DEFAULT_SOURCE = "manual"
+
+# Per-source rows are kept in <data file> + this suffix
+SOURCES_SUFFIX = ".sources.db"
+
+
+class SourceMergeError(ValueError):
+    """Raised for malformed source batches or priority rules."""
+
+    pass
+
+
+class SourcePriority:
+    """Per-field source ranking, looked up by field, then group, then "*"."""
+
+    def __init__(self, rules: Optional[Dict[str, List[str]]] = None):
+        if rules is None:
+            env_rules = os.environ.get("HEALTH_SOURCE_PRIORITY")
+            try:
+                rules = json.loads(env_rules) if env_rules else DEFAULT_SOURCE_PRIORITY
+            except json.JSONDecodeError as e:
+                raise SourceMergeError(f"HEALTH_SOURCE_PRIORITY is not valid JSON: {e}") from e
+        if not isinstance(rules, dict) or not all(isinstance(v, list) for v in rules.values()):
+            raise SourceMergeError("Source priority must map field, group or '*' to a list of sources")
+        self.rules = rules
+
+    def ranking(self, field: str, sources: List[str]) -> List[str]:
+        """`sources` ordered from highest to lowest priority for `field`."""
+        group = field.split(".", 1)[0]
+        ranked = self.rules.get(field) or self.rules.get(group) or self.rules.get("*") or []
+        listed = [s for s in ranked if s in sources]
+        return listed + [s for s in sources if s not in listed]
+
+
+def collapse_days(columns: MetricColumns) -> MetricColumns:
+    """
+    One row per day, in date order. Where a day repeats, each field takes
+    the value of the last row that has one.
+    """
+    if len(columns) == 0:
+        return columns
+    order = np.argsort(columns.days, kind="stable")
+    sorted_days = columns.days[order]
+    if len(sorted_days) < 2 or bool(np.all(sorted_days[1:] > sorted_days[:-1])):
+        return columns if bool(np.all(order == np.arange(len(order)))) else columns.take(order)
+
+    days = sorted_days[np.append(True, sorted_days[1:] != sorted_days[:-1])]
+    values: Dict[str, np.ndarray] = {}
+    valid: Dict[str, np.ndarray] = {}
+    for f in FIELDS:
+        values[f] = np.zeros(len(days), dtype=FIELD_DTYPES[f])
+        valid[f] = np.zeros(len(days), dtype=bool)
+        rows = order[columns.valid[f][order]]
+        if len(rows) == 0:
+            continue
+        field_days = columns.days[rows]
+        last = np.append(field_days[1:] != field_days[:-1], True)
+        target = np.searchsorted(days, field_days[last])
+        values[f][target] = columns.values[f][rows[last]]
+        valid[f][target] = True
+    return MetricColumns(days.astype(np.int32), values, valid)
+
+
+def merge_sources(
+    batches: Dict[str, MetricColumns],
+    priority: Optional[SourcePriority] = None,
+) -> Tuple[MetricColumns, Dict[str, Any]]:
+    """
+    Merge per-source columns into one row per day.
+
+    Returns (columns, report); the report counts each source's days and the
+    day-field cells where more than one source had a value.
+    """
+    priority = priority or SourcePriority()
+    sources = {name: collapse_days(columns) for name, columns in batches.items() if len(columns)}
+    if not sources:
+        return MetricColumns.empty(), {"days": 0, "sources": {}, "conflicts": 0}
+
+    # Each source is a sorted run; a stable sort merges the runs
+    days = np.sort(np.concatenate([c.days for c in sources.values()]), kind="stable")
+    days = days[np.append(True, days[1:] != days[:-1])]
+    rows = {name: np.searchsorted(days, c.days) for name, c in sources.items()}
+
+    values: Dict[str, np.ndarray] = {}
+    valid: Dict[str, np.ndarray] = {}
+    conflicts = 0
+    for f in FIELDS:
+        values[f] = np.zeros(len(days), dtype=FIELD_DTYPES[f])
+        valid[f] = np.zeros(len(days), dtype=bool)
+        present = np.zeros(len(days), dtype=np.int32)
+        # Lowest priority first, so higher-priority sources overwrite
+        for name in reversed(priority.ranking(f, list(sources))):
+            mask = sources[name].valid[f]
+            target = rows[name][mask]
+            values[f][target] = sources[name].values[f][mask]
+            valid[f][target] = True
+            present[target] += 1
+        conflicts += int((present > 1).sum())
+
+    report = {
+        "days": len(days),
+        "sources": {name: len(c) for name, c in sources.items()},
+        "conflicts": conflicts,
+    }
+    return MetricColumns(days.astype(np.int32), values, valid), report
+
+
+class SourceMerger:
+    """
+    Keeps each source's latest rows so a sync from one source is resolved
+    against what the others reported for the same days.
+
+    With a `path` the rows are kept in a SQLite database there, one user id
+    per source, so priorities hold across restarts and a sync reads only
+    the days it touches. Without one they are kept in memory.
+    """
+
+    def __init__(self, priority: Optional[SourcePriority] = None, path: Optional[str] = None):
+        self.priority = priority or SourcePriority()
+        self.path = path
+        self._db: Optional[SqliteRecordStore] = None
+        self._sources: Dict[str, MetricColumns] = {}
+
+    def _database(self) -> SqliteRecordStore:
+        # Opened on first use: services that never sync create no file
+        if self._db is None:
+            self._db = SqliteRecordStore(self.path)
+        return self._db
+
+    @property
+    def sources(self) -> List[str]:
+        if self.path is None:
+            return list(self._sources)
+        if self._db is None and not os.path.exists(self.path):
+            return []
+        return self._database().user_ids()
+
+    def _stored(self, days: np.ndarray) -> Dict[str, MetricColumns]:
+        """Each source's rows for the sorted `days` it has rows for."""
+        if self.path is not None:
+            db = self._database()
+            stored = {name: db.load_days(days, name) for name in db.user_ids()}
+            return {name: columns for name, columns in stored.items() if len(columns)}
+        subsets = {}
+        for name, columns in self._sources.items():
+            # Both sides are sorted: find each touched day in the source
+            pos = np.minimum(np.searchsorted(columns.days, days), len(columns) - 1)
+            hits = pos[columns.days[pos] == days]
+            if len(hits):
+                subsets[name] = columns.take(hits)
+        return subsets
+
+    def resolve(
+        self, batches: Dict[str, MetricColumns]
+    ) -> Tuple[MetricColumns, Dict[str, Any], Dict[str, MetricColumns]]:
+        """
+        Resolved rows for every day the new per-source rows touch (all
+        sources considered) and the merge report, without recording the new
+        rows. The third item is what commit() records once the resolved
+        rows are stored.
+        """
+        collapsed = {name: collapse_days(columns) for name, columns in batches.items() if len(columns)}
+        if not collapsed:
+            return MetricColumns.empty(), {"days": 0, "sources": {}, "conflicts": 0}, {}
+
+        days = np.unique(np.concatenate([columns.days for columns in collapsed.values()]))
+        subsets = self._stored(days)
+        for name, columns in collapsed.items():
+            subsets[name] = subsets[name].merge(columns) if name in subsets else columns
+        resolved, report = merge_sources(subsets, self.priority)
+        return resolved, report, collapsed
+
+    def commit(self, collapsed: Dict[str, MetricColumns]) -> None:
+        """Record per-source rows returned by resolve()."""
+        for name, columns in collapsed.items():
+            if self.path is not None:
+                self._database().upsert_columns(columns, user_id=name)
+            else:
+                known = self._sources.get(name, MetricColumns.empty())
+                self._sources[name] = known.merge(columns)
+
+    def sync(self, batches: Dict[str, MetricColumns]) -> Tuple[MetricColumns, Dict[str, Any]]:
+        """
+        Fold new per-source rows in and return the resolved rows for every
+        day they touch (all sources considered), plus the merge report.
+        """
+        resolved, report, collapsed = self.resolve(batches)
+        self.commit(collapsed)
+        return resolved, report
@@ -0,0 +1,342 @@
+"""
+SQLite Record Store
+Daily records in a SQLite database, for histories too large to keep as JSON.
+
+One row per (user_id, date) in a WITHOUT ROWID table clustered on that key,
+so a date range for a user is a single B-tree range scan. Each analysis
+metric also gets a narrow covering index on (user_id, date, metric), so
+single-series queries read only that index. The database runs in WAL mode:
+readers never block the writer or each other.
+
+Connections come from a small pool; each is used by one thread at a time,
+which makes the store safe to call from FastAPI's threadpool.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+import numpy as np
+
+from services.metric_store import (
+    MetricColumns,
+    FIELDS,
+    FIELD_DTYPES,
+    ANALYSIS_FIELDS,
+    strings_to_ordinals,
+    ordinals_to_strings,
+    to_typed,
+)
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+DEFAULT_USER_ID = "default"
+DEFAULT_POOL_SIZE = 4
+TABLE = "daily_records"
+
+# Rows per executemany / fetchmany round trip
+BATCH_ROWS = 10_000
+
+# Bound parameters per IN (...) list, below SQLite's default limit
+MAX_PARAMETERS = 500
+
+
+def is_sqlite_path(path: str) -> bool:
+    return str(path).endswith(SQLITE_SUFFIXES)
+
+
+def _column_name(field: str) -> str:
+    return field.replace(".", "__")
+
+
+_COLUMNS = [_column_name(f) for f in FIELDS]
+_SQL_TYPES = {f: "INTEGER" if FIELD_DTYPES[f].kind == "i" else "REAL" for f in FIELDS}
+# Metrics the services chart and analyze get a covering index each
+INDEXED_FIELDS = sorted(set(ANALYSIS_FIELDS.values()))
+
+
+class SqliteStoreError(Exception):
+    """Raised when the database cannot be opened or has an incompatible schema."""
+
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    Connections are created lazily up to `size` and handed to one thread at
+    a time (``check_same_thread`` is off because they move between worker
+    threads, never because they are shared concurrently).
+    """
+
+    def __init__(self, path: str, size: int = DEFAULT_POOL_SIZE, timeout: float = 30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise SqliteStoreError("Timed out waiting for a database connection")
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+class SqliteRecordStore:
+    """Daily records for one or more users in a SQLite database."""
+
+    def __init__(self, path: str, user_id: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE):
+        self.path = path
+        self.user_id = user_id or os.environ.get("HEALTH_USER_ID") or DEFAULT_USER_ID
+        self.pool = ConnectionPool(path, pool_size)
+        # SQLite has one writer at a time; serializing in-process avoids busy retries
+        self._write_lock = threading.Lock()
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        columns = ",\n    ".join(f"{_column_name(f)} {_SQL_TYPES[f]}" for f in FIELDS)
+        try:
+            with self.pool.connection() as conn, conn:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {TABLE} (\n"
+                    f"    user_id TEXT NOT NULL,\n"
+                    f"    date TEXT NOT NULL,\n"
+                    f"    {columns},\n"
+                    f"    PRIMARY KEY (user_id, date)\n"
+                    f") WITHOUT ROWID"
+                )
+                for field in INDEXED_FIELDS:
+                    column = _column_name(field)
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_{column} ON {TABLE} (user_id, date, {column})"
+                    )
+        except sqlite3.DatabaseError as e:
+            raise SqliteStoreError(f"Cannot open {self.path}: {e}") from e
+
+    # -- writes -------------------------------------------------------------
+
+    def upsert_columns(self, columns: MetricColumns, user_id: Optional[str] = None) -> int:
+        """
+        Insert or update daily rows from columns, in batches.
+
+        On an existing (user_id, date) the incoming non-null values replace
+        the stored ones and missing values keep them, as MetricColumns.merge.
+        """
+        user_id = user_id or self.user_id
+        n = len(columns)
+        if n == 0:
+            return 0
+        placeholders = ", ".join("?" * (len(_COLUMNS) + 2))
+        updates = ", ".join(f"{c} = COALESCE(excluded.{c}, {c})" for c in _COLUMNS)
+        sql = (
+            f"INSERT INTO {TABLE} (user_id, date, {', '.join(_COLUMNS)}) VALUES ({placeholders}) "
+            f"ON CONFLICT (user_id, date) DO UPDATE SET {updates}"
+        )
+        with self._write_lock, self.pool.connection() as conn, conn:
+            for start in range(0, n, BATCH_ROWS):
+                part = columns.slice(start, start + BATCH_ROWS)
+                decoded = []
+                for f in FIELDS:
+                    items = part.values[f].tolist() if FIELD_DTYPES[f].kind == "i" else part.column(f).tolist()
+                    decoded.append([v if ok else None for v, ok in zip(items, part.valid[f].tolist())])
+                dates = part.date_strings().tolist()
+                conn.executemany(sql, zip([user_id] * len(dates), dates, *decoded))
+        return n
+
+    # -- reads --------------------------------------------------------------
+
+    def load_columns(self, user_id: Optional[str] = None) -> MetricColumns:
+        """All of a user's rows as columns, in date order."""
+        user_id = user_id or self.user_id
+        columns = MetricColumns.empty()
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
+                f"SELECT date, {', '.join(_COLUMNS)} FROM {TABLE} WHERE user_id = ? ORDER BY date", (user_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(BATCH_ROWS)
+                if not rows:
+                    break
+                columns = columns.append(self._to_columns(rows))
+        return columns
+
+    def load_days(self, days: np.ndarray, user_id: Optional[str] = None) -> MetricColumns:
+        """A user's rows for the given sorted day ordinals (those stored), in date order."""
+        user_id = user_id or self.user_id
+        dates = ordinals_to_strings(days).tolist()
+        columns = MetricColumns.empty()
+        with self.pool.connection() as conn:
+            for start in range(0, len(dates), MAX_PARAMETERS):
+                part = dates[start:start + MAX_PARAMETERS]
+                rows = conn.execute(
+                    f"SELECT date, {', '.join(_COLUMNS)} FROM {TABLE} "
+                    f"WHERE user_id = ? AND date IN ({', '.join('?' * len(part))}) ORDER BY date",
+                    [user_id, *part],
+                ).fetchall()
+                if rows:
+                    columns = columns.append(self._to_columns(rows))
+        return columns
+
+    def user_ids(self) -> List[str]:
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute(f"SELECT DISTINCT user_id FROM {TABLE} ORDER BY user_id")]
+
+    @staticmethod
+    def _to_columns(rows: List[Tuple[Any, ...]]) -> MetricColumns:
+        transposed = list(zip(*rows))
+        values: Dict[str, np.ndarray] = {}
+        valid: Dict[str, np.ndarray] = {}
+        for f, raw in zip(FIELDS, transposed[1:]):
+            values[f], valid[f] = to_typed(list(raw), FIELD_DTYPES[f])
+        return MetricColumns(strings_to_ordinals(transposed[0]), values, valid)
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {TABLE} WHERE user_id = ?", (user_id or self.user_id,)).fetchone()[0]
+
+    def query_records(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        limit: Optional[int] = None,
+        latest: bool = False,
+        fields: Optional[List[str]] = None,
+        user_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Records dated start..end (inclusive) in ascending date order.
+
+        With `latest`, the `limit` most recent rows of the range are returned
+        (still oldest first). `fields` restricts the columns read, so a one-
+        or two-metric query is served from the covering indexes.
+        """
+        selected = FIELDS if fields is None else fields
+        where = ["user_id = ?"]
+        params: List[Any] = [user_id or self.user_id]
+        if start:
+            where.append("date >= ?")
+            params.append(start.isoformat())
+        if end:
+            where.append("date <= ?")
+            params.append(end.isoformat())
+        sql = (
+            f"SELECT date, {', '.join(_column_name(f) for f in selected)} FROM {TABLE} "
+            f"WHERE {' AND '.join(where)} ORDER BY date {'DESC' if latest else 'ASC'}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if latest:
+            rows.reverse()
+        return [self._to_record(row, selected) for row in rows]
+
+    def iter_values(
+        self,
+        field: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        (user_id, float64 values) batches of one field for every user, dated
+        start..end (inclusive), nulls skipped. A user's batches arrive
+        together, so per-user aggregates need memory for one batch at a time.
+
+        Each batch is fetched with its own short query, resuming after the
+        last (user_id, date) read, so no pooled connection is held while the
+        caller consumes a batch (or abandons the iterator).
+        """
+        column = _column_name(field)
+        where = [f"{column} IS NOT NULL"]
+        params: List[Any] = []
+        if start:
+            where.append("date >= ?")
+            params.append(start.isoformat())
+        if end:
+            where.append("date <= ?")
+            params.append(end.isoformat())
+        sql = (
+            f"SELECT user_id, date, {column} FROM {TABLE} WHERE {' AND '.join(where)} "
+            f"AND (user_id, date) > (?, ?) ORDER BY user_id, date LIMIT ?"
+        )
+        # Sorts before every stored row: dates are never empty
+        last: Tuple[str, str] = ("", "")
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute(sql, params + [*last, BATCH_ROWS]).fetchall()
+            if not rows:
+                break
+            last = rows[-1][:2]
+            users, _, raw = zip(*rows)
+            values = np.array(raw, dtype=np.float64)
+            cuts = [0] + [i for i in range(1, len(users)) if users[i] != users[i - 1]] + [len(users)]
+            for lo, hi in zip(cuts[:-1], cuts[1:]):
+                yield users[lo], values[lo:hi]
+            if len(rows) < BATCH_ROWS:
+                break
+
+    @staticmethod
+    def _to_record(row: Tuple[Any, ...], fields: List[str]) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"date": row[0]}
+        for f, value in zip(fields, row[1:]):
+            group, name = f.split(".", 1)
+            record.setdefault(group, {})[name] = value
+        return record
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def convert_columns_to_sqlite(columns: MetricColumns, path: str, user_id: Optional[str] = None) -> int:
+    """Write columns into a (new or existing) SQLite database; returns rows written."""
+    store = SqliteRecordStore(path, user_id)
+    try:
+        return store.upsert_columns(columns)
+    finally:
+        store.close()
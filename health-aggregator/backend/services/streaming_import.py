@@ -0,0 +1,251 @@
+"""
+Streaming JSON Import
+Imports large JSON exports into the columnar store without loading the whole
+document.
+
+The file is read in fixed-size chunks and the ``records`` array is decoded one
+element at a time with ``json.JSONDecoder.raw_decode``; records are converted
+to columns in batches, so peak memory is one chunk plus one batch of dicts on
+top of the (compact) columns being built. Both a bare list of records and an
+object with a ``records`` key are accepted; other top-level keys are kept as
+metadata.
+"""
+
+import codecs
+import json
+import os
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple
+
+from services.metric_store import MetricColumns
+from services.record_validation import parse_dates
+from services.columnar_format import ColumnarWriter
+
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_BATCH_SIZE = 10_000
+
+ProgressCallback = Callable[["ImportProgress"], None]
+
+
+class StreamingImportError(Exception):
+    """Raised when the export is not a JSON list of records or {"records": [...]}."""
+
+    pass
+
+
+class ImportProgress:
+    """Running counters reported to progress callbacks."""
+
+    __slots__ = ("records", "rejected", "bytes_read", "total_bytes", "done")
+
+    def __init__(self, total_bytes: int = 0):
+        self.records = 0
+        self.rejected = 0
+        self.bytes_read = 0
+        self.total_bytes = total_bytes
+        self.done = False
+
+    @property
+    def percent(self) -> float:
+        if not self.total_bytes:
+            return 100.0 if self.done else 0.0
+        return round(min(100.0, self.bytes_read * 100.0 / self.total_bytes), 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "records": self.records,
+            "rejected": self.rejected,
+            "bytes_read": self.bytes_read,
+            "total_bytes": self.total_bytes,
+            "percent": self.percent,
+            "done": self.done,
+        }
+
+
+class _JsonStream:
+    """Chunked reader exposing just enough tokenizing to walk the top level."""
+
+    _WHITESPACE = " \t\r\n"
+
+    def __init__(self, f, chunk_size: int):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.bytes_read = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self._decoder.decode(b"", final=True)
+            self.pos = 0
+            return False
+        # Drop consumed text so the buffer stays around one chunk
+        self.buf = self.buf[self.pos:] + self._decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self._WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise StreamingImportError(f"Expected {char!r} but found {found or 'end of file'!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise StreamingImportError(f"Invalid JSON: {e}") from e
+            # A scalar that runs to the end of the buffer may be cut mid-token
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+
+def _iter_records(stream: _JsonStream, metadata: Dict[str, Any]) -> Iterator[Any]:
+    def separator(close: str) -> bool:
+        found = stream.peek()
+        if not found or found not in ("," + close):
+            raise StreamingImportError(f"Expected ',' or {close!r} but found {found or 'end of file'!r}")
+        stream.pos += 1
+        return found == close
+
+    def records_array() -> Iterator[Any]:
+        stream.expect("[")
+        if stream.peek() == "]":
+            stream.pos += 1
+            return
+        while True:
+            yield stream.value()
+            if separator("]"):
+                return
+
+    first = stream.peek()
+    if first == "[":
+        yield from records_array()
+        return
+    if first != "{":
+        raise StreamingImportError("JSON must be a list of records or an object with 'records' key")
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if key == "records":
+            yield from records_array()
+        else:
+            metadata[key] = stream.value()
+        if separator("}"):
+            return
+
+
+def iter_json_records(f, metadata: Optional[Dict[str, Any]] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Yield the elements of the records array from a binary file object.
+
+    Top-level keys other than ``records`` are stored into `metadata` as they
+    are encountered.
+    """
+    return _iter_records(_JsonStream(f, chunk_size), metadata if metadata is not None else {})
+
+
+def _importable(batch: List[Any]) -> List[Dict[str, Any]]:
+    """Records of `batch` with a YYYY-MM-DD ``date``, checked as record validation does."""
+    ordinals = parse_dates([r.get("date") if isinstance(r, dict) else None for r in batch])
+    return [r for r, ordinal in zip(batch, ordinals.tolist()) if ordinal >= 0]
+
+
+def iter_column_batches(
+    path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[ProgressCallback] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Iterator[MetricColumns]:
+    """
+    Stream a JSON export as MetricColumns batches of up to `batch_size` rows.
+
+    Records without a YYYY-MM-DD ``date`` are skipped and counted as rejected.
+    `progress` is called after every batch and once more when done.
+    """
+    state = ImportProgress(os.path.getsize(path))
+    with open(path, "rb") as f:
+        stream = _JsonStream(f, chunk_size)
+        batch: List[Any] = []
+        for record in _iter_records(stream, metadata if metadata is not None else {}):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                records = _importable(batch)
+                state.rejected += len(batch) - len(records)
+                state.records += len(records)
+                state.bytes_read = stream.bytes_read
+                if records:
+                    yield MetricColumns.from_records(records)
+                batch = []
+                if progress:
+                    progress(state)
+        records = _importable(batch)
+        state.rejected += len(batch) - len(records)
+        if records:
+            state.records += len(records)
+            yield MetricColumns.from_records(records)
+        state.bytes_read = stream.bytes_read
+        state.done = True
+        if progress:
+            progress(state)
+
+
+def stream_import(
+    path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[ProgressCallback] = None,
+) -> Tuple[MetricColumns, Dict[str, Any]]:
+    """Import a JSON export into in-memory columns; returns (columns, metadata)."""
+    metadata: Dict[str, Any] = {}
+    columns = MetricColumns.empty()
+    for batch in iter_column_batches(path, batch_size, chunk_size, progress, metadata):
+        columns = columns.append(batch)
+    return columns, metadata.get("metadata", metadata)
+
+
+def stream_convert_to_columnar(
+    json_path: str,
+    out_path: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, Any]:
+    """Convert a JSON export straight to a columnar file with bounded memory."""
+    metadata: Dict[str, Any] = {}
+    writer = ColumnarWriter(out_path)
+    try:
+        for batch in iter_column_batches(json_path, batch_size, chunk_size, progress, metadata):
+            writer.write(batch)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close(metadata.get("metadata", metadata))
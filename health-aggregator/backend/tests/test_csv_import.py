@@ -0,0 +1,27 @@
+"""CSV cells that do not parse are counted and quarantined, not dropped."""
+
+import io
+import json
+
+from services.data_ingestion import DataIngestionService
+
+
+def test_unparseable_cells_are_quarantined(tmp_path):
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps({"records": []}))
+    service = DataIngestionService(data_path=str(path))
+
+    csv = b"date,steps,hrv\n2026-01-16,100,40\n2026-01-17,abc,41\n2026-01-18,,42\nnot-a-date,5,43\n"
+    result = service.import_csv([io.BytesIO(csv)])
+
+    stats = result["files"][0]
+    assert (stats["rows"], stats["rejected"], stats["invalid_cells"]) == (4, 2, 1)
+    # The empty steps cell is missing, not invalid
+    assert result["days"] == 2
+    assert [r["date"] for r in service.get_records_for_analysis()] == ["2026-01-16", "2026-01-18"]
+
+    quarantined = service.get_quarantine()
+    assert [(q["origin"], q["record"]["row"], q["errors"]) for q in quarantined] == [
+        ("csv", 2, ["steps: not a number"]),
+        ("csv", 4, ["date: not a date"]),
+    ]
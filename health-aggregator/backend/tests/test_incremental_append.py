@@ -0,0 +1,108 @@
+"""
+Appending records and updating the services incrementally must give the
+same derived state as loading the full history from scratch.
+"""
+
+import json
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from services.anomaly_detection import AnomalyDetectionService
+from services.record_store import RecordStore
+
+
+DAYS = 400
+
+# (baseline_window, baseline_method) for frozen and rolling, mean and median baselines
+MODES = [(None, "mean"), (None, "median"), (28, "mean"), (28, "median")]
+
+# Rows loaded before the first append, and the batch sizes appended after them.
+# (100, [50, 7]) ends inside the first illness episode, so its runs began
+# before the 30-day detection window.
+SPLITS = [(100, [1]), (100, [7, 1, 30, 2]), (20, [5, 40, 1, 13]), (300, [30, 30, 30]), (100, [50, 7])]
+
+
+def synthetic_records(days: int = DAYS, seed: int = 0):
+    """Daily records with a long illness episode, a slow resting HR drift and gaps."""
+    rng = np.random.default_rng(seed)
+    start = date(2020, 1, 1)
+    records = []
+    for i in range(days):
+        ill = 120 <= i < 160 or 330 <= i < 345
+        drift = max(0, i - 200) * 0.04
+        record = {
+            "date": (start + timedelta(days=i)).isoformat(),
+            "sleep": {
+                "duration_hours": round(float(rng.normal(6.0 if ill else 7.2, 0.6)), 1),
+                "quality_score": int(rng.normal(70, 8)),
+            },
+            "heart_rate": {
+                "resting": int(round(rng.normal(70 if ill else 62, 2.5) + drift)),
+                "hrv": round(float(rng.normal(35 if ill else 45, 5)), 1),
+            },
+            "activity": {"steps": int(rng.normal(4000 if ill else 8500, 1500))},
+            "wellness": {
+                "stress_score": int(rng.normal(55 if ill else 35, 8)),
+                "energy_level": int(rng.normal(65, 10)),
+            },
+        }
+        if rng.random() < 0.05:
+            record["heart_rate"]["hrv"] = None
+        if rng.random() < 0.03:
+            record["activity"]["steps"] = None
+        records.append(record)
+    return records
+
+
+def alert_keys(alerts):
+    return [
+        (a.timestamp, a.metric_type, a.title, a.severity, a.consecutive_days, a.current_value, a.description)
+        for a in alerts
+    ]
+
+
+def derived_state(service: AnomalyDetectionService):
+    return {
+        "anomalies": alert_keys(service.get_anomalies(limit=10_000)),
+        "drift": alert_keys(service.get_drift_alerts(limit=10_000)),
+        "multivariate": alert_keys(service.get_multivariate_anomalies(limit=10_000)),
+        "baselines": service.get_baselines(),
+    }
+
+
+@pytest.mark.parametrize("window,method", MODES)
+@pytest.mark.parametrize("initial,batches", SPLITS)
+def test_split_appends_match_full_recompute(tmp_path, window, method, initial, batches):
+    records = synthetic_records()
+    total = initial + sum(batches)
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps({"records": records[:initial]}))
+
+    store = RecordStore(str(path))
+    service = AnomalyDetectionService(store=store, baseline_window=window, baseline_method=method)
+    done = initial
+    for size in batches:
+        store.append(records[done:done + size])
+        # As the app does: update a fork, the old instance keeps serving
+        updated = service.fork()
+        updated.apply_append(size)
+        service = updated
+        done += size
+
+    full = AnomalyDetectionService(store=RecordStore(str(path)), baseline_window=window, baseline_method=method)
+    assert len(full._columns) == total
+    incremental, recomputed = derived_state(service), derived_state(full)
+    for part in recomputed:
+        assert incremental[part] == recomputed[part], part
+    assert recomputed["anomalies"]
+
+
+def test_recalculate_matches_fresh_service(tmp_path):
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps({"records": synthetic_records()}))
+    service = AnomalyDetectionService(store=RecordStore(str(path)))
+    before = derived_state(service)
+    service.recalculate_anomalies()
+    assert derived_state(service) == before
@@ -0,0 +1,43 @@
+"""Intraday queries without a resolution stay within MAX_POINTS points."""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from services.intraday_store import IntradayStore, MAX_POINTS, ROLLUP_SECONDS, resolution_for
+from services.metric_store import EPOCH_ORDINAL
+
+
+FIRST_DAY = date(2025, 1, 1)
+DAYS = 400
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    store = IntradayStore(str(tmp_path_factory.mktemp("intraday")))
+    start = (FIRST_DAY.toordinal() - EPOCH_ORDINAL) * 86400
+    # One sample a minute
+    timestamps = np.arange(start, start + DAYS * 86400, 60, dtype=np.int64)
+    store.add_samples("heart_rate", timestamps, 60 + 10 * np.sin(timestamps / 3600))
+    return store
+
+
+@pytest.mark.parametrize("days", [1, 3, 7, 30, 365])
+def test_auto_resolution_bounds_point_count(store, days):
+    result = store.query("heart_rate", FIRST_DAY, FIRST_DAY + timedelta(days=days - 1))
+    assert 0 < len(result["timestamps"]) <= MAX_POINTS
+    # The finest rollup that fits: the next finer one would not
+    finer = [w for w in ROLLUP_SECONDS if w < result["resolution"]]
+    if finer:
+        assert days * 86400 // finer[-1] > MAX_POINTS
+
+
+def test_resolution_for():
+    assert resolution_for(MAX_POINTS) == 0
+    assert resolution_for(86400) == 300
+    assert resolution_for(7 * 86400) == 3600
+    assert resolution_for(2000 * 86400) == 86400
+    # An explicit resolution still picks the coarsest rollup within it
+    assert resolution_for(86400, 7200) == 3600
+    assert resolution_for(365 * 86400, 60) == 0
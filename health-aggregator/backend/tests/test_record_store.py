@@ -0,0 +1,67 @@
+"""Refreshing a memory-mapped columnar store after the file grew."""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from services.columnar_format import write_columnar
+from services.metric_store import MetricColumns
+from services.record_store import RecordStore, APPENDED, RELOADED
+
+
+def columns(days: int, steps_offset: int = 0) -> MetricColumns:
+    start = date(2025, 1, 1)
+    return MetricColumns.from_records([
+        {"date": (start + timedelta(days=i)).isoformat(), "activity": {"steps": 5000 + i + steps_offset}}
+        for i in range(days)
+    ])
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "health.hcol")
+    write_columnar(columns(200), path)
+    return path
+
+
+def test_grown_file_is_appended_without_rereading_old_rows(path, monkeypatch):
+    store = RecordStore(path)
+    old = store.snapshot
+    window = old.rollups.window("activity.steps", 0, len(old))
+    write_columnar(columns(230), path)
+
+    compared = []
+    original = MetricColumns.starts_with
+
+    def starts_with(self, other):
+        compared.append(len(other))
+        return original(self, other)
+
+    monkeypatch.setattr(MetricColumns, "starts_with", starts_with)
+    result = store.refresh()
+
+    assert (result.change, result.added) == (APPENDED, 30)
+    # Only the old file's last row was compared
+    assert compared == [1]
+    snapshot = store.snapshot
+    assert snapshot.columns.starts_with(columns(230)) and len(snapshot) == 230
+    assert snapshot.rollups.window("activity.steps", 0, 200) == window
+    assert snapshot.rollups.window("activity.steps", 0, 230) == (float(sum(5000 + i for i in range(230))), 230)
+
+
+def test_changed_last_row_is_reloaded(path):
+    store = RecordStore(path)
+    grown = columns(230)
+    grown.values["activity.steps"][199] += 1
+    write_columnar(grown, path)
+    assert store.refresh().change == RELOADED
+
+
+def test_inserted_day_is_reloaded(path):
+    store = RecordStore(path)
+    grown = columns(231)
+    keep = np.ones(231, dtype=bool)
+    keep[100] = False
+    write_columnar(grown.take(keep), path)
+    assert store.refresh().change == RELOADED
@@ -0,0 +1,55 @@
+"""Source priorities hold across restarts and failed store merges."""
+
+import json
+
+import pytest
+
+from services.data_ingestion import DataIngestionService
+from services.record_store import RecordStore
+from services.source_merge import SourceMerger, SOURCES_SUFFIX
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps({"records": []}))
+    return str(path)
+
+
+def steps(service: DataIngestionService, day: str = "2026-01-05") -> int:
+    return next(r for r in service.get_records_for_analysis() if r["date"] == day)["activity"]["steps"]
+
+
+def sync(service: DataIngestionService, source: str, value: int, day: str = "2026-01-05") -> None:
+    service.sync_sources([{"date": day, "activity": {"steps": value}}], source)
+
+
+def test_priority_holds_after_restart(path):
+    service = DataIngestionService(store=RecordStore(path))
+    sync(service, "apple_health", 12345)
+    sync(service, "oura", 2)
+    assert steps(service) == 12345
+
+    restarted = DataIngestionService(store=RecordStore(path))
+    sync(restarted, "oura", 3)
+    assert steps(restarted) == 12345
+    # A higher-priority source still wins over what it reported before
+    sync(restarted, "apple_health", 12000)
+    assert steps(restarted) == 12000
+
+
+def test_failed_store_merge_is_not_recorded(path, monkeypatch):
+    service = DataIngestionService(store=RecordStore(path))
+
+    def fail(columns):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(service.store, "merge", fail)
+        with pytest.raises(OSError):
+            sync(service, "apple_health", 12345)
+
+    # The lost apple_health sync must not outrank the next one
+    sync(service, "oura", 2)
+    assert steps(service) == 2
+    assert SourceMerger(path=path + SOURCES_SUFFIX).sources == ["oura"]
@@ -0,0 +1,28 @@
+"""Reads over a SQLite store come from the published snapshot."""
+
+from services.data_ingestion import DataIngestionService
+from services.metric_store import MetricColumns
+from services.record_store import RecordStore
+from services.sqlite_store import SqliteRecordStore
+
+
+def days(first: int, last: int) -> MetricColumns:
+    return MetricColumns.from_records(
+        [{"date": f"2026-01-{d:02d}", "activity": {"steps": 1000 * d}} for d in range(first, last + 1)]
+    )
+
+
+def test_reads_match_snapshot_while_database_changes(tmp_path):
+    path = str(tmp_path / "health.db")
+    SqliteRecordStore(path).upsert_columns(days(1, 3))
+    service = DataIngestionService(store=RecordStore(path))
+
+    # Another writer (a refresh in progress) adds a day the snapshot does not have yet
+    SqliteRecordStore(path).upsert_columns(days(4, 4))
+
+    assert str(service.get_latest_metrics().date) == "2026-01-03"
+    assert [r["date"] for r in service.get_metrics_range()["data"]] == ["2026-01-01", "2026-01-02", "2026-01-03"]
+    assert [r["date"] for r in service.get_metrics_history(days=30)] == ["2026-01-01", "2026-01-02", "2026-01-03"]
+
+    service.refresh_data(force=True)
+    assert str(service.get_latest_metrics().date) == "2026-01-04"
@@ -0,0 +1,30 @@
+"""The streaming importer accepts the same dates as record validation."""
+
+import json
+
+import numpy as np
+
+from services.metric_store import EPOCH_ORDINAL
+from services.streaming_import import stream_import
+
+
+def test_non_calendar_date_forms_are_rejected(tmp_path):
+    records = [
+        {"date": "2026-01-01", "activity": {"steps": 1}},
+        # Accepted by date.fromisoformat on Python 3.11+, not YYYY-MM-DD
+        {"date": "20260102", "activity": {"steps": 2}},
+        {"date": "2026-W01-2", "activity": {"steps": 3}},
+        {"date": "2026-02-30"},
+        {"date": None},
+        "not a record",
+        {"date": "2026-01-03", "activity": {"steps": 4}},
+    ]
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps({"records": records}))
+
+    progress = []
+    columns, _ = stream_import(str(path), batch_size=2, progress=progress.append)
+
+    dates = (columns.days.astype(np.int64) - EPOCH_ORDINAL).astype("datetime64[D]").astype(str)
+    assert dates.tolist() == ["2026-01-01", "2026-01-03"]
+    assert (progress[-1].records, progress[-1].rejected) == (2, 5)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Anomaly Scan Benchmark
+Times the vectorized anomaly engine over full histories (users x ten years of
+days x the detected metrics) against a per-day Python loop doing the same
+z-score, threshold and consecutive-day logic, then replays the EWMA / CUSUM
+drift detectors over the same histories.
+
+The loop is timed on a few users and extrapolated; it stands in for the
+per-record scan the detection service used before the engine.
+
+usage: benchmark_anomalies.py [users] [--loop-users N]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.anomaly_engine import scan  # noqa: E402
+from services.change_detectors import ChangeDetectors  # noqa: E402
+
+
+DAYS_PER_USER = 3650
+METRICS = 5
+THRESHOLDS = (1.5, 2.0, 2.5)
+MISSING_RATE = 0.05
+
+
+def synthetic_history(seed: int):
+    rng = np.random.default_rng(seed)
+    means = rng.uniform(10, 100, METRICS)
+    stds = means * rng.uniform(0.05, 0.2, METRICS)
+    values = rng.normal(means, stds, (DAYS_PER_USER, METRICS))
+    values[rng.random(values.shape) < MISSING_RATE] = np.nan
+    return values, means, stds
+
+
+def loop_scan(values: np.ndarray, means: np.ndarray, stds: np.ndarray) -> int:
+    runs = [0] * METRICS
+    alerts = 0
+    for row in values.tolist():
+        for j, value in enumerate(row):
+            if value != value:
+                continue
+            z = abs(value - means[j]) / stds[j]
+            if z < THRESHOLDS[0]:
+                runs[j] = 0
+                continue
+            runs[j] += 1
+            alerts += 1
+    return alerts
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    loop_users = 10
+    if "--loop-users" in args:
+        i = args.index("--loop-users")
+        loop_users = int(args[i + 1])
+        del args[i:i + 2]
+    users = int(args[0]) if args else 1000
+
+    histories = [synthetic_history(seed) for seed in range(users)]
+
+    started = time.perf_counter()
+    alerts = sum(len(scan(values, means, stds, THRESHOLDS)) for values, means, stds in histories)
+    engine_s = time.perf_counter() - started
+
+    sample = histories[:min(loop_users, users)]
+    started = time.perf_counter()
+    for values, means, stds in sample:
+        loop_scan(values, means.tolist(), stds.tolist())
+    loop_s = (time.perf_counter() - started) / len(sample) * users
+
+    started = time.perf_counter()
+    signals = sum(len(ChangeDetectors(METRICS).replay((values - means) / stds)) for values, means, stds in histories)
+    drift_s = time.perf_counter() - started
+
+    cells = users * DAYS_PER_USER * METRICS
+    print(f"{users:,} users x {DAYS_PER_USER:,} days x {METRICS} metrics = {cells:,} values, {alerts:,} alerts")
+    print(f"  engine      {engine_s:10.2f} s")
+    print(f"  python loop {loop_s:10.2f} s (extrapolated from {len(sample)} users)")
+    print(f"  drift replay{drift_s:10.2f} s ({signals:,} EWMA / CUSUM signals)")
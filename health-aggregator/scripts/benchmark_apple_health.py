@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Apple Health Import Benchmark
+Writes a synthetic export.xml with the requested number of samples and
+reports import throughput (records/sec) and peak memory.
+"""
+
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.apple_health_import import parse_apple_health_export  # noqa: E402
+
+
+SAMPLE_TYPES = [
+    ("HKQuantityTypeIdentifierStepCount", "count", lambda: random.randint(20, 800)),
+    ("HKQuantityTypeIdentifierHeartRate", "count/min", lambda: random.randint(55, 140)),
+    ("HKQuantityTypeIdentifierActiveEnergyBurned", "kcal", lambda: round(random.uniform(1, 30), 2)),
+    ("HKQuantityTypeIdentifierDistanceWalkingRunning", "km", lambda: round(random.uniform(0.01, 0.6), 3)),
+]
+
+
+def write_synthetic_export(path: str, samples: int) -> None:
+    """Write `samples` quantity records (about 30 min apart) plus daily RHR/HRV/sleep."""
+    start = datetime(2015, 1, 1)
+    fmt = "%Y-%m-%d %H:%M:%S -0500"
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<HealthData locale="en_US">\n')
+        for i in range(samples):
+            type_id, unit, value = SAMPLE_TYPES[i % len(SAMPLE_TYPES)]
+            t = start + timedelta(minutes=30 * (i // len(SAMPLE_TYPES)))
+            f.write(
+                f' <Record type="{type_id}" sourceName="Watch" unit="{unit}" '
+                f'creationDate="{t.strftime(fmt)}" startDate="{t.strftime(fmt)}" '
+                f'endDate="{(t + timedelta(minutes=5)).strftime(fmt)}" value="{value()}">\n'
+                f'  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="0"/>\n'
+                f' </Record>\n'
+            )
+            if i % (48 * len(SAMPLE_TYPES)) == 0:
+                night = t.replace(hour=23)
+                f.write(
+                    f' <Record type="HKQuantityTypeIdentifierRestingHeartRate" sourceName="Watch" unit="count/min" '
+                    f'startDate="{t.strftime(fmt)}" endDate="{t.strftime(fmt)}" value="{random.randint(55, 70)}"/>\n'
+                    f' <Record type="HKQuantityTypeIdentifierHeartRateVariabilitySDNN" sourceName="Watch" unit="ms" '
+                    f'startDate="{t.strftime(fmt)}" endDate="{t.strftime(fmt)}" value="{random.uniform(30, 60):.1f}"/>\n'
+                    f' <Record type="HKCategoryTypeIdentifierSleepAnalysis" sourceName="Watch" '
+                    f'startDate="{night.strftime(fmt)}" endDate="{(night + timedelta(hours=7)).strftime(fmt)}" '
+                    f'value="HKCategoryValueSleepAnalysisAsleepCore"/>\n'
+                )
+        f.write("</HealthData>\n")
+
+
+if __name__ == "__main__":
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.xml")
+        write_synthetic_export(path, samples)
+        size_mb = os.path.getsize(path) / 1e6
+
+        started = time.perf_counter()
+        records, stats = parse_apple_health_export(path)
+        elapsed = time.perf_counter() - started
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{stats['xml_records']:,} records ({size_mb:,.0f} MB) → {len(records):,} days in {elapsed:.2f}s")
+    print(f"throughput: {stats['xml_records'] / elapsed:,.0f} records/sec, peak RSS {peak_mb:,.0f} MB")
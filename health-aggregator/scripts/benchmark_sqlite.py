@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+SQLite vs JSON Benchmark
+Times history, latest-metrics and trend queries against the SQLite store and
+against the JSON path (json.load plus list scans) for growing row counts.
+
+Rows are spread over users with ten years of daily records each, since one
+user's history cannot reach millions of days.
+
+usage: benchmark_sqlite.py [rows,rows,...] [--max-json-rows N]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.metric_store import MetricColumns, FIELDS, FIELD_DTYPES  # noqa: E402
+from services.sqlite_store import SqliteRecordStore  # noqa: E402
+
+
+DAYS_PER_USER = 3650
+START = date(2016, 1, 1)
+QUERY_REPEATS = 50
+
+
+def synthetic_columns(n: int, seed: int) -> MetricColumns:
+    rng = np.random.default_rng(seed)
+    days = (START.toordinal() + np.arange(n)).astype(np.int32)
+    values = {}
+    for f in FIELDS:
+        raw = rng.uniform(1, 100, n)
+        values[f] = np.rint(raw).astype(FIELD_DTYPES[f]) if FIELD_DTYPES[f].kind == "i" else np.round(raw, 1).astype(FIELD_DTYPES[f])
+    return MetricColumns(days, values, {f: np.ones(n, dtype=bool) for f in FIELDS})
+
+
+def users_for(rows: int):
+    for i, start in enumerate(range(0, rows, DAYS_PER_USER)):
+        yield f"user{i}", synthetic_columns(min(DAYS_PER_USER, rows - start), i)
+
+
+def timed(fn, repeats: int = 1):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - started) / repeats * 1000, result
+
+
+def bench_json(rows: int, tmp: str, user: str, range_start: str, range_end: str) -> dict:
+    path = os.path.join(tmp, f"records_{rows}.json")
+    with open(path, "w") as f:
+        f.write('{"records": [')
+        first = True
+        for user_id, columns in users_for(rows):
+            for record in columns.to_records():
+                record["user_id"] = user_id
+                f.write(("" if first else ",") + json.dumps(record))
+                first = False
+        f.write("]}")
+
+    load_ms, data = timed(lambda: json.load(open(path)))
+    records = data["records"]
+
+    def user_records():
+        return [r for r in records if r["user_id"] == user]
+
+    return {
+        "load": load_ms,
+        "latest": timed(lambda: user_records()[-1], QUERY_REPEATS)[0],
+        "history_30": timed(lambda: user_records()[-30:], QUERY_REPEATS)[0],
+        "range_90": timed(lambda: [r for r in user_records() if range_start <= r["date"] <= range_end], QUERY_REPEATS)[0],
+        "trend_14": timed(lambda: [r["activity"]["steps"] for r in user_records()[-14:]], QUERY_REPEATS)[0],
+    }
+
+
+def bench_sqlite(rows: int, tmp: str, user: str, range_start: date, range_end: date) -> dict:
+    path = os.path.join(tmp, f"records_{rows}.db")
+    store = SqliteRecordStore(path)
+    for user_id, columns in users_for(rows):
+        store.upsert_columns(columns, user_id=user_id)
+    store.close()
+
+    load_ms, store = timed(lambda: SqliteRecordStore(path, user_id=user))
+    result = {
+        "load": load_ms,
+        "latest": timed(lambda: store.query_records(limit=1, latest=True), QUERY_REPEATS)[0],
+        "history_30": timed(lambda: store.query_records(limit=30, latest=True), QUERY_REPEATS)[0],
+        "range_90": timed(lambda: store.query_records(range_start, range_end), QUERY_REPEATS)[0],
+        "trend_14": timed(lambda: store.query_records(limit=14, latest=True, fields=["activity.steps"]), QUERY_REPEATS)[0],
+    }
+    store.close()
+    return result
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    max_json_rows = 1_000_000
+    if "--max-json-rows" in args:
+        i = args.index("--max-json-rows")
+        max_json_rows = int(args[i + 1])
+        del args[i:i + 2]
+    sizes = [int(s) for s in args[0].split(",")] if args else [1_000, 100_000, 10_000_000]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            # Query the last user, the worst case for a list scan
+            user = f"user{(rows - 1) // DAYS_PER_USER}"
+            range_start = START + timedelta(days=100)
+            range_end = range_start + timedelta(days=89)
+            print(f"\n{rows:,} rows")
+            sqlite_ms = bench_sqlite(rows, tmp, user, range_start, range_end)
+            if rows <= max_json_rows:
+                json_ms = bench_json(rows, tmp, user, range_start.isoformat(), range_end.isoformat())
+            else:
+                json_ms = None
+            print(f"  {'query (ms)':<12}{'json':>12}{'sqlite':>12}")
+            for name, value in sqlite_ms.items():
+                json_value = f"{json_ms[name]:12.3f}" if json_ms else f"{'skipped':>12}"
+                print(f"  {name:<12}{json_value}{value:12.3f}")
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+JSON → Columnar Converter
+Converts a health data JSON export into the memory-mapped columnar format
+served by the backend (set HEALTH_DATA_PATH to the .hcol file to use it).
+The export is streamed, so memory stays bounded regardless of its size.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.columnar_format import COLUMNAR_SUFFIX  # noqa: E402
+from services.streaming_import import stream_convert_to_columnar  # noqa: E402
+
+
+def print_progress(progress):
+    end = "\n" if progress.done else "\r"
+    print(f"  {progress.percent:5.1f}%  {progress.records:,} records", end=end, flush=True)
+
+
+if __name__ == "__main__":
+    input_path = sys.argv[1] if len(sys.argv) > 1 else "../backend/data/synthetic_health_data.json"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else str(Path(input_path).with_suffix(COLUMNAR_SUFFIX))
+    header = stream_convert_to_columnar(input_path, output_path, progress=print_progress)
+    print(f"Converted {header['rows']} records ({header['start_date']} → {header['end_date']}) → {output_path}")
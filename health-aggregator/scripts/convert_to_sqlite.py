@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+JSON → SQLite Converter
+Loads a health data JSON export into a SQLite database served by the backend
+(set HEALTH_DATA_PATH to the .db file to use it; HEALTH_USER_ID selects the
+user, "default" if unset). The export is streamed in batches.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.sqlite_store import SqliteRecordStore  # noqa: E402
+from services.streaming_import import iter_column_batches  # noqa: E402
+
+
+def print_progress(progress):
+    end = "\n" if progress.done else "\r"
+    print(f"  {progress.percent:5.1f}%  {progress.records:,} records", end=end, flush=True)
+
+
+if __name__ == "__main__":
+    input_path = sys.argv[1] if len(sys.argv) > 1 else "../backend/data/synthetic_health_data.json"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else str(Path(input_path).with_suffix(".db"))
+    user_id = sys.argv[3] if len(sys.argv) > 3 else None
+    store = SqliteRecordStore(output_path, user_id)
+    rows = 0
+    for batch in iter_column_batches(input_path, progress=print_progress):
+        rows += store.upsert_columns(batch)
+    print(f"Loaded {rows:,} records for user {store.user_id!r} → {output_path} ({store.count():,} rows stored)")
+    store.close()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Parquet / Arrow Exporter
+Exports the health records to Parquet (.parquet) or Arrow IPC (.arrow) for
+offline analytics, optionally with the ML training frame. JSON exports are
+streamed one row group at a time; other sources (.hcol, .db, .xml, ...) are
+loaded through the record store first. Set HEALTH_DATA_PATH to a .parquet
+or .arrow file to serve it from the backend.
+
+usage: export_arrow.py <input> <output.parquet|output.arrow> [training_frame.parquet]
+"""
+
+import itertools
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.arrow_io import export_batches, export_columns, export_training_frame  # noqa: E402
+from services.record_store import RecordStore  # noqa: E402
+from services.streaming_import import iter_column_batches  # noqa: E402
+
+
+def print_progress(progress):
+    end = "\n" if progress.done else "\r"
+    print(f"  {progress.percent:5.1f}%  {progress.records:,} records", end=end, flush=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    input_path, output_path = sys.argv[1], sys.argv[2]
+    frame_path = sys.argv[3] if len(sys.argv) > 3 else None
+
+    if input_path.endswith(".json") and not frame_path:
+        collected = {}
+        batches = iter_column_batches(input_path, 100_000, progress=print_progress, metadata=collected)
+        # The schema (and its metadata) is written with the first row group
+        first = next(batches, None)
+        metadata = collected.get("metadata", collected)
+        rows = export_batches(itertools.chain([first] if first else [], batches), output_path, metadata)
+    else:
+        snapshot = RecordStore(input_path).snapshot
+        rows = export_columns(snapshot.columns, output_path, snapshot.metadata)
+        if frame_path:
+            frame_rows = export_training_frame(snapshot.columns, frame_path)
+            print(f"Exported {frame_rows:,} training rows → {frame_path}")
+    print(f"Exported {rows:,} records → {output_path}")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Apple Health Importer
+Converts an Apple Health export.xml into daily health records, written as
+JSON or (for a .hcol output path) the memory-mapped columnar format.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from services.apple_health_import import parse_apple_health_export  # noqa: E402
+from services.columnar_format import is_columnar_path, write_columnar  # noqa: E402
+from services.metric_store import MetricColumns  # noqa: E402
+
+
+def print_progress(seen, bytes_read):
+    print(f"  {seen:,} samples, {bytes_read / 1e6:,.0f} MB read", end="\r", flush=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: import_apple_health.py <export.xml> <output.json|output.hcol>")
+        sys.exit(1)
+    input_path, output_path = sys.argv[1], sys.argv[2]
+    records, stats = parse_apple_health_export(input_path, progress=print_progress)
+    metadata = {"source": "apple_health", "days": len(records), **stats}
+
+    if is_columnar_path(output_path):
+        write_columnar(MetricColumns.from_records(records), output_path, metadata=metadata)
+    else:
+        with open(output_path, 'w') as f:
+            json.dump({"metadata": metadata, "records": records}, f, indent=2)
+    print(f"\nImported {stats['used_records']:,} of {stats['xml_records']:,} samples → {len(records)} days → {output_path}")